@@ -9,6 +9,10 @@ from supabase import create_client, Client
 from dotenv import load_dotenv
 from flask_bcrypt import Bcrypt
 import numpy as np
+from face_engine import snapshot as gallery_snapshot
+from face_engine.embedding import BatchEmbedder
+from face_engine.scheduler import InferenceScheduler
+from face_engine.detection import CascadeDetector
 
 # Blueprint imports
 from auth.routes import auth_bp
@@ -52,6 +56,47 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 THRESHOLD = float(os.getenv("THRESHOLD", "0.6"))
 
+# Embedding gallery search mode ("exact" scan, "ivf" ANN index or "compact" float16/int8 coarse matrix)
+GALLERY_INDEX_CONFIG = {
+    "index": os.getenv("GALLERY_INDEX", "exact"),
+    "nlist": int(os.getenv("GALLERY_IVF_NLIST", "0")),
+    "nprobe": int(os.getenv("GALLERY_IVF_NPROBE", "8")),
+    "precision": os.getenv("GALLERY_PRECISION", "int8"),
+    "pca_dims": int(os.getenv("GALLERY_PCA_DIMS", "0")),
+    "rerank": int(os.getenv("GALLERY_RERANK", "64")),
+    "min_size": int(os.getenv("GALLERY_ANN_MIN_SIZE", "2000"))
+}
+
+# How new enrollments store embeddings: "float16" / "float32" packed base64 centroid, or legacy "json" lists
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float16")
+EMBEDDING_STORE_SAMPLES = os.getenv("EMBEDDING_STORE_SAMPLES", "false").lower() == "true"
+
+# Haar cascade pre-filter in front of MTCNN for recognition endpoints ("haar" or "off")
+DETECTOR_PREFILTER = os.getenv("DETECTOR_PREFILTER", "haar")
+DETECTOR_PREFILTER_WIDTH = int(os.getenv("DETECTOR_PREFILTER_WIDTH", "320"))
+
+# Cross-request micro-batching of face embeddings
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "32"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+
+# Memory-mapped gallery snapshot shared by all gunicorn workers (empty value disables it)
+GALLERY_SNAPSHOT_PATH = os.getenv(
+    "GALLERY_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "gallery_snapshot.bin")
+)
+gallery_snapshot.configure(GALLERY_SNAPSHOT_PATH)
+
+# Memory budget for the cached class galleries of each recognition cache (least recently used evicted first)
+GALLERY_CACHE_MAX_MB = float(os.getenv("GALLERY_CACHE_MAX_MB", "512"))
+
+# Live session events (SSE): open streams per worker (each holds a thread), stream lifetime,
+# and the Redis URL that fans events out across workers (empty = this worker only)
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "16"))
+SSE_STREAM_SECONDS = int(os.getenv("SSE_STREAM_SECONDS", "300"))
+SESSION_EVENTS_REDIS_URL = os.getenv("SESSION_EVENTS_REDIS_URL", "")
+# Seconds between background refreshes of the attendance rollups (dashboard stats)
+ATTENDANCE_SUMMARY_REFRESH_SECONDS = int(os.getenv("ATTENDANCE_SUMMARY_REFRESH_SECONDS", "10"))
+
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
 
@@ -81,7 +126,10 @@ class ModelManager:
 
         self.models_ready = False
         self.detector = None
+        self.cascade_detector = None
         self.deepface_ready = False
+        self.embedder = BatchEmbedder()
+        self.scheduler = None
 
         try:
             # 1. Initialize MTCNN detector with optimized parameters
@@ -90,6 +138,15 @@ class ModelManager:
             self.detector = MTCNN()
             logger.info("✅ MTCNN detector loaded successfully")
 
+            # Two-stage detector: cascade rejects empty frames, MTCNN runs on regions of interest
+            self.cascade_detector = CascadeDetector(
+                self.detector,
+                enabled=DETECTOR_PREFILTER == "haar",
+                scale_width=DETECTOR_PREFILTER_WIDTH
+            )
+            self.cascade_detector.calibrate()
+            logger.info(f"✅ Face pre-filter: {'haar cascade' if self.cascade_detector.enabled else 'off'}")
+
             # 2. Preload DeepFace model properly
             from deepface import DeepFace
             logger.info("Warming up DeepFace Facenet512 model...")
@@ -117,6 +174,9 @@ class ModelManager:
             self.deepface_ready = True
             logger.info("✅ DeepFace Facenet512 model warmed up successfully")
 
+            # 3. Batched embedding path (one forward pass for all faces in a frame)
+            self.embedder.load()
+
             self.models_ready = True
 
             initialization_time = time.time() - start_time
@@ -128,11 +188,34 @@ class ModelManager:
             raise e
 
     def get_detector(self):
-        """Get the MTCNN detector instance"""
+        """Get the two-stage (cascade + MTCNN) detector used by recognition endpoints"""
+        if not self.models_ready:
+            raise RuntimeError("Models not properly initialized")
+        return self.cascade_detector
+
+    def get_mtcnn(self):
+        """Get the plain MTCNN detector (registration wants every face checked at full quality)"""
         if not self.models_ready:
             raise RuntimeError("Models not properly initialized")
         return self.detector
 
+    def get_embedder(self):
+        """Get the batched Facenet512 embedder"""
+        if not self.models_ready:
+            raise RuntimeError("Models not properly initialized")
+        return self.embedder
+
+    def start_scheduler(self, max_batch_size, max_wait_ms):
+        """Start the shared micro-batching scheduler in front of the embedder"""
+        if self.scheduler is None:
+            self.scheduler = InferenceScheduler(self.get_embedder(), max_batch_size, max_wait_ms)
+            logger.info(f"✅ Inference scheduler started (batch ≤ {max_batch_size}, wait ≤ {max_wait_ms} ms)")
+        return self.scheduler
+
+    def get_scheduler(self):
+        """Get the micro-batching scheduler (None until started)"""
+        return self.scheduler
+
     def is_ready(self):
         """Check if all models are ready"""
         return self.models_ready and self.deepface_ready
@@ -166,6 +249,7 @@ class ModelManager:
 # Initialize the model manager (singleton)
 logger.info("Initializing Model Manager...")
 model_manager = ModelManager()
+model_manager.start_scheduler(INFERENCE_MAX_BATCH, INFERENCE_MAX_WAIT_MS)
 
 # Flask app
 app = Flask(__name__)
@@ -174,10 +258,14 @@ CORS(app)
 # Configure Flask app with database and model instances
 app.config["SUPABASE"] = supabase
 app.config["THRESHOLD"] = THRESHOLD
+app.config["GALLERY_INDEX_CONFIG"] = GALLERY_INDEX_CONFIG
+app.config["EMBEDDING_STORAGE"] = EMBEDDING_STORAGE
+app.config["EMBEDDING_STORE_SAMPLES"] = EMBEDDING_STORE_SAMPLES
+app.config["SSE_STREAM_SECONDS"] = SSE_STREAM_SECONDS
 
 # CRITICAL: Pass model manager to Flask config so blueprints can access it
 app.config["MODEL_MANAGER"] = model_manager
-app.config["MTCNN_DETECTOR"] = model_manager.get_detector()
+app.config["MTCNN_DETECTOR"] = model_manager.get_mtcnn()
 
 bcrypt = Bcrypt(app)
 
@@ -192,6 +280,8 @@ def health_check():
         "status": "healthy" if model_status and model_health else "unhealthy",
         "models_ready": model_status,
         "models_healthy": model_health,
+        "inference": model_manager.get_scheduler().metrics(),
+        "detection": model_manager.get_detector().metrics() if model_status else None,
         "timestamp": time.time()
     }
 
@@ -220,6 +310,42 @@ if attendance_session_bp:
     app.register_blueprint(attendance_session_bp)
     logger.info("✅ Attendance session blueprint registered")
 
+    from teacher.session_events import session_events
+    session_events.configure(SESSION_EVENTS_REDIS_URL, max_subscribers=SSE_MAX_STREAMS)
+
+    from teacher.attendance_summaries import attendance_summaries
+    attendance_summaries.start(supabase, ATTENDANCE_SUMMARY_REFRESH_SECONDS)
+
+# Optional WebSocket recognition channel (needs flask-sock)
+if attendance_session_bp:
+    try:
+        from flask_sock import Sock
+        from teacher.recognition_socket import register_recognition_socket
+        register_recognition_socket(Sock(app))
+        logger.info("✅ WebSocket recognition channel registered")
+    except ImportError:
+        logger.warning("⚠️ flask-sock not installed, WebSocket recognition channel disabled")
+
+# Warm the recognition galleries before the first request (maps the snapshot when present)
+def warm_embedding_galleries():
+    caches = []
+    if demo_session_bp:
+        from student.demo_session import embedding_cache
+        caches.append(embedding_cache)
+    if attendance_session_bp:
+        from teacher.attendance_records import attendance_cache
+        caches.append(attendance_cache)
+
+    for cache in caches:
+        cache.set_budget(int(GALLERY_CACHE_MAX_MB * 1024 * 1024) if GALLERY_CACHE_MAX_MB > 0 else None)
+        try:
+            gallery = cache.warm_start(supabase, GALLERY_INDEX_CONFIG)
+            logger.info(f"✅ {type(cache).__name__} warmed with {len(gallery)} students")
+        except Exception as e:
+            logger.error(f"❌ Gallery warm-up failed for {type(cache).__name__}: {e}")
+
+warm_embedding_galleries()
+
 # List all registered routes
 logger.info("\nRegistered Flask Routes:")
 for rule in app.url_map.iter_rules():
@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify, current_app
 import time
 import logging
 import hashlib
+from student.queries import STUDENT_PROFILE_COLUMNS
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -172,14 +173,14 @@ def api_signin():
         })
         
         # Check if teacher has student record too (optional)
-        student_result = supabase.table('students').select("*").eq("email", email).execute()
+        student_result = supabase.table('students').select("student_id").eq("email", email).limit(1).execute()
         if student_result.data:
             student_record = student_result.data[0]
             user_info['hasStudentRecord'] = True
             user_info['studentId'] = student_record.get('student_id')
     else:
         # For students, try to get student record
-        student_result = supabase.table('students').select("*").eq("email", email).execute()
+        student_result = supabase.table('students').select(STUDENT_PROFILE_COLUMNS).eq("email", email).limit(1).execute()
         if student_result.data:
             student_record = student_result.data[0]
             user_info.update({
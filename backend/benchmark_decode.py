@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Benchmark frame decoding: full decode + LANCZOS thumbnail vs draft-mode decode to detection size"""
+
+import io
+import time
+import numpy as np
+from PIL import Image
+
+from face_engine.decode import decode_frame, DETECTION_SIZE
+
+FRAME_SIZES = {
+    "webcam VGA": (640, 480),
+    "webcam 720p": (1280, 720),
+    "webcam 1080p": (1920, 1080),
+    "phone 12MP": (4032, 3024),
+    "phone 12MP portrait": (3024, 4032),
+}
+REPEATS = 10
+FACE_BOXES = [(120, 140, 70, 70), (360, 160, 90, 90)]  # in detection coordinates
+
+
+def synthetic_photo(width, height, rng):
+    """Smooth gradients plus sensor noise, so JPEG sizes are close to real photos"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+    noise = rng.normal(0, 12, (height, width, 3))
+    image = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, "JPEG", quality=88)
+    return buffer.getvalue()
+
+
+def baseline_decode(data):
+    """The previous path: full-resolution decode, RGB convert, LANCZOS thumbnail"""
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    if img.width > DETECTION_SIZE[0] or img.height > DETECTION_SIZE[1]:
+        img.thumbnail(DETECTION_SIZE, Image.Resampling.LANCZOS)
+    return np.array(img)
+
+
+def timed(fn, data):
+    fn(data)  # warm-up
+    start = time.time()
+    for _ in range(REPEATS):
+        fn(data)
+    return (time.time() - start) / REPEATS
+
+
+def draft_with_crops(data):
+    frame = decode_frame(io.BytesIO(data))
+    frame.face_crops(FACE_BOXES)
+    return frame
+
+
+print("=== FRAME DECODE BENCHMARK (detection input 640x480) ===")
+rng = np.random.default_rng(7)
+
+for label, (width, height) in FRAME_SIZES.items():
+    data = synthetic_photo(width, height, rng)
+    baseline = timed(baseline_decode, data)
+    draft = timed(lambda d: decode_frame(io.BytesIO(d)), data)
+    with_crops = timed(draft_with_crops, data)
+
+    print(f"\n📷 {label}: {width}x{height}, {len(data) / 1024:.0f} KiB JPEG")
+    print(f"  full decode + LANCZOS : {baseline * 1000:8.2f} ms")
+    print(f"  draft decode          : {draft * 1000:8.2f} ms  ({baseline / draft:.1f}x)")
+    print(f"  draft + 2 face crops  : {with_crops * 1000:8.2f} ms  ({baseline / with_crops:.1f}x)")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Benchmark exact vs IVF vs compact (float16 / int8 / PCA) gallery search on synthetic 512-d Facenet-like galleries"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+from face_engine import snapshot
+from face_engine.gallery import EmbeddingGallery, normalize_rows
+
+DIM = 512
+GALLERY_SIZES = [int(n) for n in sys.argv[1:]] or [5000, 20000, 50000]
+QUERIES = 40          # roughly one classroom frame
+NPROBE_VALUES = [4, 8, 16, 32]
+RERANK = 64
+COMPACT_VARIANTS = [("float16", 0), ("int8", 0), ("int8", 256), ("int8", 128), ("float16", 128)]
+
+
+def synthetic_gallery(n, rng):
+    """Students spread around a few hundred 'look-alike' clusters, like real face embeddings"""
+    centers = normalize_rows(rng.normal(size=(max(8, n // 100), DIM)))
+    members = centers[rng.integers(0, len(centers), n)]
+    return normalize_rows(members + rng.normal(size=(n, DIM)).astype(np.float32) * 0.06)
+
+
+def probe_faces(gallery_matrix, rng):
+    """Noisy re-captures of random enrolled students"""
+    truth = rng.choice(gallery_matrix.shape[0], QUERIES, replace=False)
+    probes = gallery_matrix[truth] + rng.normal(size=(QUERIES, DIM)).astype(np.float32) * 0.02
+    return truth, probes
+
+
+def resident(gallery):
+    """Bytes resident per worker: its private memory plus the snapshot pages it maps"""
+    private, shared = gallery.nbytes(), gallery.shared_nbytes()
+    return f"{(private + shared) / 1e6:7.1f} MB/worker ({private / 1e6:.1f} private + {shared / 1e6:.1f} shared mmap)"
+
+
+def delta_records(students, matrix, rng, fraction=0.01):
+    """Re-enrolment of a few students, as a delta poll would apply it"""
+    picked = rng.choice(len(students), max(1, int(len(students) * fraction)), replace=False)
+    return [{"student_id": students[i]["studentId"], "student_name": students[i]["studentName"],
+             "embeddings": matrix[i].tolist()} for i in picked]
+
+
+def timed_search(gallery, probes, repeats=5):
+    gallery.search(probes, k=1)  # warm-up
+    start = time.time()
+    for _ in range(repeats):
+        indices, _ = gallery.search(probes, k=1)
+    return (time.time() - start) / repeats, indices[:, 0]
+
+
+print("=== GALLERY SEARCH BENCHMARK (exact vs IVF vs compact) ===")
+rng = np.random.default_rng(42)
+snapshot_dir = tempfile.mkdtemp(prefix="gallery-bench-")
+
+for n in GALLERY_SIZES:
+    matrix = synthetic_gallery(n, rng)
+    students = [{"studentId": f"S{i:06d}", "studentName": f"Student {i}"} for i in range(n)]
+    truth, probes = probe_faces(matrix, rng)
+
+    # Every variant searches the memory-mapped snapshot, as the gunicorn workers do
+    path = os.path.join(snapshot_dir, f"gallery-{n}.bin")
+    snapshot.write_snapshot(path, EmbeddingGallery(students, matrix), version=0)
+
+    def mapped(config=None):
+        return snapshot.read_snapshot(path, config)[0]
+
+    exact = mapped()
+    exact_time, exact_ids = timed_search(exact, probes)
+    print(f"\n📦 Gallery size: {n} students, {QUERIES} faces per frame")
+    print(f"  exact        : {exact_time * 1000:8.2f} ms/frame  recall@1 {np.mean(exact_ids == truth):.3f}  "
+          f"{resident(exact)}")
+    print(f"  without snapshot every worker holds the float32 matrix privately: {resident(EmbeddingGallery(students, matrix))}")
+
+    for nprobe in NPROBE_VALUES:
+        config = {"index": "ivf", "nprobe": nprobe, "rerank": RERANK, "min_size": 0}
+        ivf = mapped(config)
+        ivf_time, ivf_ids = timed_search(ivf, probes)
+        info = ivf.index_info()
+        print(f"  ivf nprobe={nprobe:<3}: {ivf_time * 1000:8.2f} ms/frame  "
+              f"recall@1 {np.mean(ivf_ids == truth):.3f}  "
+              f"agreement w/ exact {np.mean(ivf_ids == exact_ids):.3f}  "
+              f"(nlist={info['nlist']}, build {info['build_time']}s)  {resident(ivf)}")
+
+    for precision, pca_dims in COMPACT_VARIANTS:
+        config = {"index": "compact", "precision": precision, "pca_dims": pca_dims, "rerank": RERANK, "min_size": 0}
+        compact = mapped(config)
+        compact_time, compact_ids = timed_search(compact, probes)
+        info = compact.index_info()
+        label = f"{precision}" + (f"/pca{pca_dims}" if pca_dims else "")
+        print(f"  compact {label:<12}: {compact_time * 1000:8.2f} ms/frame  "
+              f"recall@1 {np.mean(compact_ids == truth):.3f}  "
+              f"agreement w/ exact {np.mean(compact_ids == exact_ids):.3f}  "
+              f"(build {info['build_time']}s)  {resident(compact)}")
+    # Deltas land in a private overlay; the float32 rows stay in the shared snapshot
+    updated = compact.upsert(delta_records(students, matrix, rng))
+    print(f"  compact {label} after a 1% delta: {resident(updated)}")
+
+shutil.rmtree(snapshot_dir, ignore_errors=True)
+print("\nTune GALLERY_IVF_NPROBE / GALLERY_PRECISION / GALLERY_PCA_DIMS / GALLERY_RERANK in .env from these numbers.")
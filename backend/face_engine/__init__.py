@@ -0,0 +1,20 @@
+# Shared face recognition building blocks used by the student and teacher blueprints
+from .gallery import EmbeddingGallery, GalleryPartitions, load_gallery, normalize_rows
+from .live_gallery import IncrementalGalleryCache, filter_key
+from .events import publish_student_upserted, publish_student_removed
+from .codec import pack_embeddings, unpack_centroid
+from . import snapshot
+
+__all__ = [
+    'EmbeddingGallery',
+    'GalleryPartitions',
+    'load_gallery',
+    'normalize_rows',
+    'IncrementalGalleryCache',
+    'filter_key',
+    'publish_student_upserted',
+    'publish_student_removed',
+    'pack_embeddings',
+    'unpack_centroid',
+    'snapshot'
+]
@@ -0,0 +1,231 @@
+# face_engine/ann.py - Approximate nearest-neighbour indexes for large galleries
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_CONFIG = {
+    "index": "exact",     # "exact", "ivf" or "compact"
+    "nlist": 0,           # IVF coarse cells, 0 = about sqrt(gallery size)
+    "nprobe": 8,          # cells visited per query (recall vs latency)
+    "precision": "int8",  # compact coarse matrix: "float16" or "int8" (per-row scale)
+    "pca_dims": 0,        # compact: project to this many dims first (0 = keep all)
+    "rerank": 64,         # candidates rescored exactly in float32
+    "min_size": 2000      # below this an exact scan is already fast enough
+}
+
+
+def top_n(scores, n):
+    """Indices of the n highest scores per row, best first"""
+    n = min(n, scores.shape[1])
+    if n <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if n < scores.shape[1]:
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    else:
+        top = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=10, seed=0, chunk_size=8192):
+    """K-means on unit vectors (cosine); returns normalized centroids"""
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, min(n_clusters, vectors.shape[0]))
+    centroids = vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(vectors, centroids, chunk_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+
+        # Re-seed empty cells with random points so every list stays useful
+        empty = np.where(counts == 0)[0]
+        if len(empty):
+            sums[empty] = vectors[rng.choice(vectors.shape[0], len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+
+    return centroids
+
+
+def assign_to_centroids(vectors, centroids, chunk_size=8192):
+    """Nearest centroid (max dot product) for every row, computed in chunks"""
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], chunk_size):
+        block = vectors[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+    """
+    IVF coarse quantizer: rows are bucketed under their nearest k-means
+    centroid and stored contiguously per bucket. A query only scores the
+    rows in its `nprobe` closest buckets and hands the best `n` row ids back
+    to the gallery, which reranks them exactly against its float32 matrix.
+    """
+    name = "ivf"
+
+    def __init__(self, matrix, nlist=0, nprobe=8, iterations=10, seed=0, centroids=None):
+        start = time.time()
+        n = matrix.shape[0]
+        self.nlist = int(nlist) if nlist else max(1, int(np.sqrt(n)))
+        self.nprobe = max(1, int(nprobe))
+
+        if centroids is not None:
+            # Incremental gallery updates reuse the trained quantizer and only re-bucket rows
+            self.centroids = centroids
+        else:
+            # Train on a bounded sample so build time stays flat for huge galleries
+            rng = np.random.default_rng(seed)
+            sample_size = min(n, self.nlist * 64)
+            sample = matrix if sample_size == n else matrix[rng.choice(n, sample_size, replace=False)]
+            self.centroids = spherical_kmeans(sample, self.nlist, iterations, seed)
+        self.nlist = self.centroids.shape[0]
+
+        assignments = assign_to_centroids(matrix, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=self.nlist)
+
+        self.row_ids = order
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.list_vectors = np.ascontiguousarray(matrix[order], dtype=np.float32)
+        self.build_time = time.time() - start
+        logger.info(f"IVF index built: {n} rows, {self.nlist} lists in {self.build_time:.2f}s")
+
+    def nbytes(self):
+        return self.list_vectors.nbytes + self.centroids.nbytes + self.row_ids.nbytes + self.offsets.nbytes
+
+    def candidates(self, queries, n):
+        """Row ids of the best `n` rows among each query's probed buckets (-1 padded)"""
+        nprobe = min(self.nprobe, self.nlist)
+        probes = top_n(queries @ self.centroids.T, nprobe)
+        result = np.full((queries.shape[0], n), -1, dtype=np.int64)
+
+        for qi, cells in enumerate(probes):
+            # Buckets are contiguous slices, so scoring them needs no gather copy
+            spans = [(self.offsets[c], self.offsets[c + 1]) for c in cells]
+            scores = np.concatenate([self.list_vectors[lo:hi] @ queries[qi] for lo, hi in spans])
+            if not len(scores):
+                continue
+            positions = np.concatenate([np.arange(lo, hi) for lo, hi in spans])
+            best = top_n(scores[None, :], n)[0]
+            result[qi, :len(best)] = self.row_ids[positions[best]]
+
+        return result
+
+    def info(self):
+        return {
+            "index": self.name,
+            "size": int(self.row_ids.shape[0]),
+            "nlist": int(self.nlist),
+            "nprobe": int(self.nprobe),
+            "build_time": round(float(self.build_time), 3)
+        }
+
+
+def learn_projection(matrix, dims, sample_size=20000, seed=0):
+    """
+    Top `dims` right singular vectors of the (uncentered) gallery, as a
+    (dim, dims) float32 matrix. Uncentered on purpose: dot products between
+    unit vectors are what the gallery ranks by, and this subspace keeps the
+    most of them.
+    """
+    rng = np.random.default_rng(seed)
+    sample = matrix if matrix.shape[0] <= sample_size else matrix[rng.choice(matrix.shape[0], sample_size, replace=False)]
+    _, _, vt = np.linalg.svd(sample.astype(np.float64), full_matrices=False)
+    return np.ascontiguousarray(vt[:dims].T, dtype=np.float32)
+
+
+class CompactIndex:
+    """
+    The gallery again as a compact coarse matrix: float16, or int8 with one
+    float32 scale per row, optionally PCA-projected to `pca_dims` first. The
+    whole frame is scored against it in row chunks (cast to float32 one chunk
+    at a time) and the best `n` row ids go back to the gallery for the exact
+    float32 rerank.
+    """
+    name = "compact"
+    chunk_rows = 2048
+
+    def __init__(self, matrix, precision="int8", pca_dims=0, projection=None):
+        start = time.time()
+        if precision not in ("float16", "int8"):
+            raise ValueError(f"Unsupported compact precision: {precision}")
+        self.precision = precision
+
+        if projection is None and pca_dims and 0 < int(pca_dims) < matrix.shape[1]:
+            projection = learn_projection(matrix, int(pca_dims))
+        self.projection = projection
+        coarse = matrix @ projection if projection is not None else matrix
+
+        if precision == "float16":
+            self.codes = np.ascontiguousarray(coarse, dtype=np.float16)
+            self.scales = None
+        else:
+            scales = np.abs(coarse).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.codes = np.ascontiguousarray(np.rint(coarse / scales[:, None]), dtype=np.int8)
+            self.scales = scales.astype(np.float32)
+        self.build_time = time.time() - start
+        logger.info(f"Compact index built: {matrix.shape[0]} rows, {precision}, "
+                     f"{self.codes.shape[1]} dims, {self.nbytes() / 1e6:.1f} MB in {self.build_time:.2f}s")
+
+    def nbytes(self):
+        total = self.codes.nbytes
+        if self.scales is not None:
+            total += self.scales.nbytes
+        if self.projection is not None:
+            total += self.projection.nbytes
+        return total
+
+    def candidates(self, queries, n):
+        """Row ids of the best `n` coarse scores per query"""
+        if self.projection is not None:
+            queries = queries @ self.projection
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        scores = np.empty((queries.shape[0], self.codes.shape[0]), dtype=np.float32)
+        for lo in range(0, self.codes.shape[0], self.chunk_rows):
+            block = self.codes[lo:lo + self.chunk_rows].astype(np.float32)
+            scores[:, lo:lo + len(block)] = queries @ block.T
+        if self.scales is not None:
+            scores *= self.scales
+        return top_n(scores, n)
+
+    def info(self):
+        return {
+            "index": self.name,
+            "size": int(self.codes.shape[0]),
+            "precision": self.precision,
+            "dims": int(self.codes.shape[1]),
+            "coarse_bytes": int(self.nbytes()),
+            "build_time": round(float(self.build_time), 3)
+        }
+
+
+def wants_index(config, size):
+    """True if a gallery of `size` rows gets an index under this (complete) config"""
+    return config["index"] in ("ivf", "compact") and size >= config["min_size"]
+
+
+def build_index(matrix, index_config=None, previous=None):
+    """
+    Create the configured index for a gallery matrix (None means plain exact search).
+    Passing the index of the gallery this one was derived from keeps its trained
+    coarse quantizer (or PCA projection), so small deltas do not retrain it.
+    """
+    config = dict(DEFAULT_INDEX_CONFIG)
+    config.update(index_config or {})
+
+    if not wants_index(config, matrix.shape[0]):
+        return None
+    if config["index"] == "ivf":
+        centroids = previous.centroids if isinstance(previous, IVFIndex) else None
+        return IVFIndex(matrix, nlist=config["nlist"], nprobe=config["nprobe"], centroids=centroids)
+    projection = previous.projection if isinstance(previous, CompactIndex) else None
+    return CompactIndex(matrix, precision=config["precision"], pca_dims=config["pca_dims"], projection=projection)
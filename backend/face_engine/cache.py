@@ -0,0 +1,176 @@
+# face_engine/cache.py - Single-flight, stale-while-revalidate cache with an LRU byte budget
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("value", "size", "loaded_at", "refreshing")
+
+    def __init__(self, value, size, loaded_at):
+        self.value = value
+        self.size = size
+        self.loaded_at = loaded_at
+        self.refreshing = False
+
+
+class _Flight:
+    """One in-progress cold load that concurrent callers wait on"""
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlightCache:
+    """
+    Keyed cache for expensive values (embedding galleries):
+
+    - a missing key is loaded exactly once; concurrent callers for that key
+      wait on the same load instead of each hitting the database;
+    - an entry older than `max_age` keeps being served while one background
+      refresh replaces it (stale-while-revalidate), so no request waits on it;
+    - entries are evicted least recently used first once their total
+      `sizeof()` exceeds `max_bytes` (the entry just stored is always kept).
+    """
+
+    def __init__(self, max_bytes=None, max_age=None, sizeof=None, name="cache"):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sizeof = sizeof or (lambda value: 0)
+        self.name = name
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "stale_served": 0, "refreshes": 0, "refresh_errors": 0, "evictions": 0}
+
+    def get(self, key, loader, refresher=None, loaded_at=None):
+        """
+        Value for `key`, calling loader() on a miss. `refresher(value)` (default
+        loader()) rebuilds a stale entry in the background and may return None
+        when it refreshed the value in place. `loaded_at(value)` lets a freshly
+        loaded value report an older age (e.g. seeded from an old snapshot).
+        """
+        stale = None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                if self.max_age is not None and not entry.refreshing and time.time() - entry.loaded_at > self.max_age:
+                    entry.refreshing = True
+                    self.counters["stale_served"] += 1
+                    stale = entry
+            else:
+                self.counters["misses"] += 1
+                flight = self.inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.inflight[key] = _Flight()
+
+        if entry is not None:
+            if stale is not None:
+                threading.Thread(
+                    target=self._refresh, args=(key, stale, refresher or (lambda _: loader())),
+                    name=f"{self.name}-refresh", daemon=True
+                ).start()
+            return entry.value
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = loader()
+            flight.value = value
+            self._store(key, value, loaded_at(value) if loaded_at else time.time())
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            flight.done.set()
+
+    def _refresh(self, key, entry, refresher):
+        try:
+            value = refresher(entry.value)
+            self.counters["refreshes"] += 1
+            self._store(key, entry.value if value is None else value, time.time())
+        except Exception as e:
+            self.counters["refresh_errors"] += 1
+            logger.error(f"{self.name}: background refresh of {key} failed: {e}")
+        finally:
+            entry.refreshing = False
+
+    def _store(self, key, value, loaded_at):
+        size = self.sizeof(value)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous.size
+            self.entries[key] = _Entry(value, size, loaded_at)
+            self.total_bytes += size
+            self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            oldest = next(iter(self.entries))
+            if oldest == keep:
+                self.entries.move_to_end(oldest)
+                oldest = next(iter(self.entries))
+            evicted = self.entries.pop(oldest)
+            self.total_bytes -= evicted.size
+            self.counters["evictions"] += 1
+            logger.info(f"{self.name}: evicted {oldest} ({evicted.size / 1e6:.1f} MB) to stay within budget")
+
+    def peek(self, key):
+        """Cached value or None, without loading, refreshing or touching LRU order"""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry.value if entry is not None else None
+
+    def values(self):
+        with self.lock:
+            return [entry.value for entry in self.entries.values()]
+
+    def resize(self):
+        """Re-measure every entry (values that are updated in place) and enforce the budget"""
+        with self.lock:
+            entries = list(self.entries.items())
+        sizes = [(key, entry, self.sizeof(entry.value)) for key, entry in entries]
+        with self.lock:
+            for key, entry, size in sizes:
+                if self.entries.get(key) is entry:
+                    self.total_bytes += size - entry.size
+                    entry.size = size
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": int(self.total_bytes),
+                "max_bytes": self.max_bytes,
+                "loading": len(self.inflight),
+                **self.counters
+            }
@@ -0,0 +1,78 @@
+# face_engine/codec.py - Packed binary storage format for student embeddings
+import base64
+import numpy as np
+
+# Stored in the students.embeddings JSONB column:
+#   v1 (legacy): [[512 floats], ...] - one JSON number per component
+#   v2 (packed): {"v": 2, "dtype": "float16", "dim": 512, "count": 5,
+#                 "centroid": "<base64>", "samples": "<base64>" (optional)}
+PACKED_VERSION = 2
+PACKED_DTYPES = {"float16": "<f2", "float32": "<f4"}
+
+
+def _encode(array, dtype):
+    return base64.b64encode(np.ascontiguousarray(array, dtype=PACKED_DTYPES[dtype]).tobytes()).decode("ascii")
+
+
+def _decode(text, dtype):
+    return np.frombuffer(base64.b64decode(text), dtype=PACKED_DTYPES[dtype]).astype(np.float32)
+
+
+def pack_embeddings(vectors, dtype="float16", keep_samples=False):
+    """Pack enrollment embeddings as their mean vector (and optionally every sample)"""
+    if dtype not in PACKED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    samples = np.asarray(vectors, dtype=np.float32)
+    if samples.ndim == 1:
+        samples = samples[None, :]
+    packed = {
+        "v": PACKED_VERSION,
+        "dtype": dtype,
+        "dim": int(samples.shape[1]),
+        "count": int(samples.shape[0]),
+        "centroid": _encode(samples.mean(axis=0), dtype)
+    }
+    if keep_samples:
+        packed["samples"] = _encode(samples, dtype)
+    return packed
+
+
+def storage_version(value):
+    """1 for legacy JSON float lists, 2 for packed, None for empty/unknown values"""
+    if isinstance(value, dict):
+        return value.get("v") if value.get("centroid") else None
+    if isinstance(value, (list, tuple)) and len(value):
+        return 1
+    return None
+
+
+def unpack_centroid(value):
+    """float32 centroid of a stored embeddings value in either format (None if unusable)"""
+    version = storage_version(value)
+    try:
+        if version == PACKED_VERSION:
+            centroid = _decode(value["centroid"], value.get("dtype", "float16"))
+            return centroid if centroid.shape[0] == value.get("dim", centroid.shape[0]) else None
+        if version == 1:
+            arr = np.asarray(value, dtype=np.float32)
+            if arr.ndim == 2:
+                # Multiple embeddings - average them
+                arr = arr.mean(axis=0)
+            return arr if arr.ndim == 1 and arr.size else None
+    except (TypeError, ValueError, KeyError):
+        return None
+    return None
+
+
+def unpack_samples(value):
+    """(count, dim) float32 samples if they were stored, else None"""
+    version = storage_version(value)
+    try:
+        if version == PACKED_VERSION and value.get("samples"):
+            return _decode(value["samples"], value.get("dtype", "float16")).reshape(-1, value["dim"])
+        if version == 1:
+            arr = np.asarray(value, dtype=np.float32)
+            return arr if arr.ndim == 2 else arr[None, :]
+    except (TypeError, ValueError, KeyError):
+        return None
+    return None
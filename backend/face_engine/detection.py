@@ -0,0 +1,209 @@
+# face_engine/detection.py - Two-stage face detection (Haar cascade pre-filter + MTCNN)
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_CASCADE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "haarcascade_frontalface_default.xml"
+)
+
+
+def _find_cascade():
+    """The cascade shipped at the repo root, else the copy bundled with OpenCV"""
+    if os.path.exists(BUNDLED_CASCADE):
+        return BUNDLED_CASCADE
+    import cv2
+    return os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+
+
+def _merge_boxes(boxes):
+    """Union overlapping (x0, y0, x1, y1) boxes so each region is sent to MTCNN once"""
+    boxes = [list(b) for b in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+class CascadeDetector:
+    """
+    Drop-in replacement for MTCNN.detect_faces(). A Haar cascade on a
+    downscaled grayscale frame rejects frames without faces and proposes
+    regions of interest; full MTCNN then runs only on those regions (or on the
+    whole frame when the regions cover most of it). Every `audit_every`-th
+    frame without regions still goes through full MTCNN to measure the miss
+    rate. OpenCV classifiers are not safe to share between threads, so each
+    request thread loads its own copy of the cascade.
+    """
+
+    def __init__(self, mtcnn, enabled=True, scale_width=320, margin=0.5,
+                 min_neighbors=3, full_frame_ratio=0.6, audit_every=50):
+        self.mtcnn = mtcnn
+        self.enabled = enabled
+        self.scale_width = scale_width
+        self.margin = margin
+        self.min_neighbors = min_neighbors
+        self.full_frame_ratio = full_frame_ratio
+        self.audit_every = audit_every
+        self.cascade_path = None
+
+        self._local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.frames = 0
+        self.no_region_frames = 0  # audit cadence; audited frames are not counted as rejected
+        self.rejected = 0
+        self.audited = 0
+        self.missed = 0
+        self.roi_frames = 0
+        self.time_saved = 0.0
+        self.full_mtcnn_time = None  # moving average of whole-frame MTCNN latency
+
+        if enabled:
+            self.cascade_path = _find_cascade()
+            if self._cascade().empty():
+                logger.error("Haar cascade failed to load, face pre-filter disabled")
+                self.enabled = False
+
+    def _cascade(self):
+        """This thread's classifier (detectMultiScale must not run concurrently on one instance)"""
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            import cv2
+            cascade = self._local.cascade = cv2.CascadeClassifier(self.cascade_path)
+        return cascade
+
+    def _full_mtcnn(self, rgb_image):
+        start = time.time()
+        detections = self.mtcnn.detect_faces(rgb_image)
+        elapsed = time.time() - start
+        with self.stats_lock:
+            self.full_mtcnn_time = elapsed if self.full_mtcnn_time is None else 0.9 * self.full_mtcnn_time + 0.1 * elapsed
+        return detections, elapsed
+
+    def calibrate(self, shape=(480, 640, 3)):
+        """Measure full-frame MTCNN latency once so time-saved estimates start accurate"""
+        self._full_mtcnn(np.zeros(shape, dtype=np.uint8))
+
+    def _propose_regions(self, rgb_image):
+        import cv2
+        h, w = rgb_image.shape[:2]
+        scale = min(1.0, self.scale_width / float(w))
+        small = cv2.resize(rgb_image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else rgb_image
+        gray = cv2.equalizeHist(cv2.cvtColor(small, cv2.COLOR_RGB2GRAY))
+        hits = self._cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=self.min_neighbors, minSize=(16, 16))
+
+        regions = []
+        for (x, y, bw, bh) in (hits if len(hits) else []):
+            # Back to full resolution, padded so MTCNN sees the whole head
+            x, y, bw, bh = x / scale, y / scale, bw / scale, bh / scale
+            pad_x, pad_y = bw * self.margin, bh * self.margin
+            regions.append((
+                int(max(0, x - pad_x)), int(max(0, y - pad_y)),
+                int(min(w, x + bw + pad_x)), int(min(h, y + bh + pad_y))
+            ))
+        return _merge_boxes(regions)
+
+    def detect_faces(self, rgb_image):
+        stats = {"prefilter": "haar" if self.enabled else "off", "rejected": False, "regions": 0}
+        start = time.time()
+
+        if not self.enabled:
+            detections, _ = self._full_mtcnn(rgb_image)
+            self._record(stats, start)
+            return detections
+
+        regions = self._propose_regions(rgb_image)
+        stats["regions"] = len(regions)
+        h, w = rgb_image.shape[:2]
+
+        if not regions:
+            with self.stats_lock:
+                self.no_region_frames += 1
+                audit = self.audit_every and self.no_region_frames % self.audit_every == 0
+                if not audit:
+                    self.rejected += 1
+            if audit:
+                detections, _ = self._full_mtcnn(rgb_image)
+                with self.stats_lock:
+                    self.audited += 1
+                    if detections:
+                        self.missed += 1
+                self._record(stats, start)
+                return detections
+            stats["rejected"] = True
+            self._record(stats, start, saved=self.full_mtcnn_time)
+            return []
+
+        covered = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+        if covered >= self.full_frame_ratio * w * h:
+            detections, _ = self._full_mtcnn(rgb_image)
+            self._record(stats, start)
+            return detections
+
+        detections = []
+        for x0, y0, x1, y1 in regions:
+            for d in self.mtcnn.detect_faces(np.ascontiguousarray(rgb_image[y0:y1, x0:x1])):
+                bx, by, bw, bh = d["box"]
+                d["box"] = [bx + x0, by + y0, bw, bh]
+                if "keypoints" in d:
+                    d["keypoints"] = {k: (px + x0, py + y0) for k, (px, py) in d["keypoints"].items()}
+                if all(_iou(d["box"], kept["box"]) < 0.5 for kept in detections):
+                    detections.append(d)
+
+        with self.stats_lock:
+            self.roi_frames += 1
+        elapsed = time.time() - start
+        saved = max(0.0, self.full_mtcnn_time - elapsed) if self.full_mtcnn_time else None
+        self._record(stats, start, saved=saved)
+        return detections
+
+    def _record(self, stats, start, saved=None):
+        stats["detection_time"] = round(time.time() - start, 4)
+        stats["time_saved"] = round(saved, 4) if saved else 0.0
+        with self.stats_lock:
+            self.frames += 1
+            self.time_saved += saved or 0.0
+        self._local.stats = stats
+
+    def last_stats(self):
+        """Pre-filter outcome of the most recent detect_faces() call on this thread"""
+        return getattr(self._local, "stats", None)
+
+    def metrics(self):
+        with self.stats_lock:
+            return {
+                "enabled": self.enabled,
+                "frames": self.frames,
+                "rejected": self.rejected,
+                "reject_rate": round(self.rejected / self.frames, 3) if self.frames else 0.0,
+                "roi_frames": self.roi_frames,
+                "audited_rejections": self.audited,
+                "missed_in_audit": self.missed,
+                "full_mtcnn_ms": round(self.full_mtcnn_time * 1000, 1) if self.full_mtcnn_time else None,
+                "total_time_saved": round(self.time_saved, 3)
+            }
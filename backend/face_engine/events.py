@@ -0,0 +1,40 @@
+# face_engine/events.py - In-process student change notifications for gallery caches
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_subscribers = []
+_lock = threading.Lock()
+
+
+def subscribe(subscriber):
+    """
+    Register a cache to receive deltas. Subscribers implement
+    on_students_upserted(records) and on_students_removed(student_ids).
+    """
+    with _lock:
+        if subscriber not in _subscribers:
+            _subscribers.append(subscriber)
+
+
+def _publish(method, payload):
+    with _lock:
+        subscribers = list(_subscribers)
+    for subscriber in subscribers:
+        try:
+            getattr(subscriber, method)(payload)
+        except Exception as e:
+            # A broken cache must never fail the registration/update request
+            logger.error(f"Gallery event {method} failed for {type(subscriber).__name__}: {e}")
+
+
+def publish_student_upserted(record):
+    """A student was registered or updated in this worker"""
+    _publish("on_students_upserted", [record])
+
+
+def publish_student_removed(student_id):
+    """A student was deleted in this worker"""
+    if student_id:
+        _publish("on_students_removed", [student_id])
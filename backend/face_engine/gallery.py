@@ -0,0 +1,387 @@
+# face_engine/gallery.py - Shared embedding gallery for all recognition routes
+import logging
+import mmap
+import threading
+import numpy as np
+from .ann import DEFAULT_INDEX_CONFIG, build_index, top_n, wants_index
+from .codec import unpack_centroid
+from .cache import SingleFlightCache
+
+logger = logging.getLogger(__name__)
+
+# Columns needed to build a gallery (never select("*") on students here)
+GALLERY_COLUMNS = "student_id, student_name, department, year, division, embeddings, updated_at"
+
+
+def _to_centroid(embeddings):
+    """Collapse stored embeddings (packed v2, list of vectors or a single vector) into one float32 vector"""
+    if embeddings is None:
+        return None
+    return unpack_centroid(embeddings)
+
+
+def normalize_rows(matrix):
+    """L2-normalize each row so cosine similarity becomes a plain dot product"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _mapped(array):
+    """True if `array` is (a view of) a memory-mapped file rather than worker-private memory"""
+    while isinstance(array, np.ndarray):
+        array = array.base
+    return isinstance(array, mmap.mmap)
+
+
+def student_key(record):
+    """Student ID of a row in either Supabase or legacy key naming"""
+    return record.get('student_id') or record.get('studentId')
+
+
+def student_entry(record):
+    """Metadata kept for every gallery row (handles both Supabase and legacy key names)"""
+    return {
+        'studentId': student_key(record),
+        'studentName': record.get('student_name') or record.get('studentName'),
+        'department': record.get('department'),
+        'year': record.get('year'),
+        'division': record.get('division')
+    }
+
+
+class EmbeddingGallery:
+    """
+    All enrolled students as pre-normalized float32 rows. Row i belongs to
+    `students[i]` and lives either in the `base` matrix (usually the
+    memory-mapped snapshot, shared by every worker) or, for students added or
+    re-enrolled since, in a small private `overlay`. A whole frame of faces is
+    scored against every student with one matrix multiply, or through an ANN
+    index (see ann.py) followed by an exact float32 rerank of the candidates.
+    """
+
+    def __init__(self, students, matrix, index_config=None, previous_index=None, rows=None, overlay=None):
+        self.students = students
+        self.base = matrix
+        # rows[i] >= 0 is a base row, rows[i] < 0 is overlay row -1 - rows[i]; None means row i is base[i]
+        self.rows = rows
+        self.overlay = overlay if overlay is not None else np.zeros((0, matrix.shape[1]), dtype=np.float32)
+        self.row_of = {s['studentId']: i for i, s in enumerate(students)}
+        self.index_config = dict(DEFAULT_INDEX_CONFIG)
+        self.index_config.update(index_config or {})
+        self.index = None
+        if wants_index(self.index_config, len(students)):
+            self.index = build_index(self.dense(), self.index_config, previous_index)
+
+    @classmethod
+    def empty(cls, dim=512):
+        return cls([], np.zeros((0, dim), dtype=np.float32))
+
+    @classmethod
+    def from_records(cls, records, index_config=None):
+        """Build a gallery from student rows carrying an `embeddings` (or legacy `embedding`) field"""
+        students = []
+        vectors = []
+        dim = None
+
+        for record in records:
+            centroid = _to_centroid(record.get('embeddings') or record.get('embedding'))
+            if centroid is None:
+                continue
+            if dim is None:
+                dim = centroid.shape[0]
+            elif centroid.shape[0] != dim:
+                logger.warning(f"Skipping {student_key(record)}: "
+                               f"embedding has {centroid.shape[0]} dims, expected {dim}")
+                continue
+            students.append(student_entry(record))
+            vectors.append(centroid)
+
+        if not vectors:
+            return cls.empty()
+        return cls(students, normalize_rows(np.vstack(vectors)), index_config)
+
+    def __len__(self):
+        return len(self.students)
+
+    def __contains__(self, student_id):
+        return student_id in self.row_of
+
+    def _sources(self):
+        """Private copy of the row map (base row, or encoded overlay row, of every student)"""
+        if self.rows is None:
+            return np.arange(len(self.students), dtype=np.int64)
+        return self.rows.copy()
+
+    def _derive(self, students, rows, overlay, previous_index=None):
+        """New gallery over the same base; overlay rows nobody points at any more are dropped"""
+        in_overlay = rows < 0
+        used = np.unique(-1 - rows[in_overlay])
+        if len(used) < len(overlay):
+            overlay = overlay[used]
+            rows[in_overlay] = -1 - np.searchsorted(used, -1 - rows[in_overlay])
+        return EmbeddingGallery(students, self.base, self.index_config, previous_index, rows, overlay)
+
+    def upsert(self, records):
+        """
+        Copy-on-write delta: a new gallery with these students added or replaced.
+        New rows go to the private overlay, so a shared (memory-mapped) base is
+        never copied. Rows without embeddings only refresh metadata of students
+        already present. Readers holding the old gallery are never affected.
+        """
+        students = list(self.students)
+        row_of = dict(self.row_of)
+        rows = self._sources()
+        appended_rows = []
+        vectors = []
+
+        for record in records:
+            sid = student_key(record)
+            centroid = _to_centroid(record.get('embeddings') or record.get('embedding'))
+            if centroid is not None and len(self) and centroid.shape[0] != self.dim:
+                logger.warning(f"Skipping {sid}: embedding has {centroid.shape[0]} dims, expected {self.dim}")
+                continue
+
+            entry = student_entry(record)
+            if sid in row_of:
+                i = row_of[sid]
+                students[i] = {**students[i], **{k: v for k, v in entry.items() if v is not None}}
+                if centroid is not None:
+                    if i < len(rows):
+                        rows[i] = -1 - (len(self.overlay) + len(vectors))
+                    else:
+                        appended_rows[i - len(rows)] = -1 - (len(self.overlay) + len(vectors))
+                    vectors.append(centroid)
+            elif centroid is not None:
+                row_of[sid] = len(students)
+                students.append(entry)
+                appended_rows.append(-1 - (len(self.overlay) + len(vectors)))
+                vectors.append(centroid)
+
+        if not len(self):
+            # Nothing to share yet: the new rows simply become the base
+            return EmbeddingGallery(students, normalize_rows(np.vstack(vectors)) if vectors else self.base,
+                                    self.index_config, self.index)
+        overlay = self.overlay
+        if vectors:
+            overlay = np.vstack([overlay, normalize_rows(np.vstack(vectors))])
+        rows = np.concatenate([rows, np.asarray(appended_rows, dtype=np.int64)])
+        return self._derive(students, rows, overlay, self.index)
+
+    def subset(self, predicate):
+        """
+        New gallery with only the students for which predicate(student) is true.
+        It shares a memory-mapped base; a private base is not kept alive by a
+        small class partition, whose rows are copied instead.
+        """
+        keep = [i for i, student in enumerate(self.students) if predicate(student)]
+        if len(keep) == len(self.students):
+            return self
+        students = [self.students[i] for i in keep]
+        if not _mapped(self.base):
+            return EmbeddingGallery(students, self._take(np.asarray(keep, dtype=np.int64)), self.index_config)
+        return self._derive(students, self._sources()[keep], self.overlay)
+
+    def remove(self, student_ids):
+        """Copy-on-write delta: a new gallery without these students"""
+        drop = {self.row_of[sid] for sid in student_ids if sid in self.row_of}
+        if not drop:
+            return self
+        keep = [i for i in range(len(self.students)) if i not in drop]
+        return self._derive([self.students[i] for i in keep], self._sources()[keep], self.overlay, self.index)
+
+    def with_index_config(self, index_config):
+        """The same rows (and base) searched under another index config"""
+        return EmbeddingGallery(self.students, self.base, index_config, None, self.rows, self.overlay)
+
+    def dense(self):
+        """All rows as one float32 matrix (the base itself while nothing is overlaid or removed)"""
+        if self.rows is None:
+            return self.base
+        return self._take(np.arange(len(self.students), dtype=np.int64))
+
+    def _take(self, positions):
+        """Float32 rows for an array of row numbers (any shape), gathered from base and overlay"""
+        if self.rows is None:
+            return np.asarray(self.base[positions])
+        sources = self.rows[positions]
+        taken = np.empty(sources.shape + (self.dim,), dtype=np.float32)
+        in_base = sources >= 0
+        taken[in_base] = self.base[sources[in_base]]
+        taken[~in_base] = self.overlay[-1 - sources[~in_base]]
+        return taken
+
+    def _similarities(self, queries):
+        """queries @ rows.T for every row, scoring the base in place"""
+        if self.rows is None:
+            return queries @ self.base.T
+        in_base = self.rows >= 0
+        similarities = np.empty((queries.shape[0], len(self.rows)), dtype=np.float32)
+        if in_base.any():
+            base_rows = self.rows[in_base]
+            if 2 * len(base_rows) >= len(self.base):
+                similarities[:, in_base] = (queries @ self.base.T)[:, base_rows]
+            else:
+                similarities[:, in_base] = queries @ self.base[base_rows].T
+        if not in_base.all():
+            similarities[:, ~in_base] = queries @ self.overlay[-1 - self.rows[~in_base]].T
+        return similarities
+
+    def nbytes(self):
+        """Memory private to this worker: overlay, row map, index, and the base unless it is memory-mapped"""
+        total = self.overlay.nbytes + (self.rows.nbytes if self.rows is not None else 0)
+        if not _mapped(self.base):
+            total += self.base.nbytes
+        return total + (self.index.nbytes() if self.index is not None else 0)
+
+    def shared_nbytes(self):
+        """Memory-mapped base bytes, held once in the OS page cache for all workers"""
+        return self.base.nbytes if _mapped(self.base) else 0
+
+    @property
+    def dim(self):
+        return self.base.shape[1]
+
+    def search(self, queries, k=1):
+        """
+        Score every query against the whole gallery in one matmul.
+        Returns (indices, distances), both shaped (n_queries, k), sorted by
+        ascending cosine distance.
+        """
+        queries = normalize_rows(queries)
+        n = len(self.students)
+        if n == 0:
+            empty = np.zeros((queries.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        k = max(1, min(int(k), n))
+        if self.index is None:
+            similarities = self._similarities(queries)
+            indices = top_n(similarities, k)
+            top_sims = np.take_along_axis(similarities, indices, axis=1)
+        else:
+            # Coarse ANN candidates, then exact float32 rerank over just those rows
+            candidates = self.index.candidates(queries, max(k, int(self.index_config["rerank"])))
+            valid = candidates >= 0
+            rows = self._take(np.where(valid, candidates, 0))
+            similarities = np.einsum('qcd,qd->qc', rows, queries)
+            similarities[~valid] = -np.inf
+            order = top_n(similarities, k)
+            indices = np.where(
+                np.take_along_axis(valid, order, axis=1),
+                np.take_along_axis(candidates, order, axis=1),
+                -1
+            )
+            top_sims = np.take_along_axis(similarities, order, axis=1)
+
+        distances = np.clip(1.0 - top_sims, 0.0, 2.0)
+        distances[indices < 0] = np.inf
+        return indices, distances
+
+    def index_info(self):
+        """Describe the active search mode for status endpoints"""
+        if self.index is None:
+            return {"index": "exact", "size": len(self)}
+        return self.index.info()
+
+    def match(self, queries, threshold=0.6, k=1):
+        """
+        Match a batch of query embeddings.
+        Returns one (best_match or None, min_distance, candidates) tuple per query,
+        where candidates is the top-k list of {"student", "distance"} dicts.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+
+        indices, distances = self.search(queries, k)
+        results = []
+        for row_idx, row_dist in zip(indices, distances):
+            candidates = [
+                {"student": self.students[i], "distance": float(d)}
+                for i, d in zip(row_idx, row_dist) if i >= 0
+            ]
+            if not candidates:
+                results.append((None, float('inf'), []))
+                continue
+            best = candidates[0]
+            best_match = best["student"] if best["distance"] < threshold else None
+            results.append((best_match, best["distance"], candidates))
+        return results
+
+    def verify(self, student_id, query, threshold=0.6):
+        """
+        1:1 check of one query against one student's row (found through the
+        row_of lookup, so the cost does not grow with the gallery).
+        Returns (student or None, distance); distance is inf if the student has no row.
+        """
+        row = self.row_of.get(student_id)
+        if row is None:
+            return None, float('inf')
+        query = normalize_rows(query)[0]
+        distance = float(np.clip(1.0 - self._take(np.asarray([row]))[0] @ query, 0.0, 2.0))
+        return (self.students[row] if distance < threshold else None), distance
+
+    def best_match(self, query, threshold=0.6):
+        """Single-query convenience wrapper returning (best_match or None, min_distance)"""
+        best_match, min_distance, _ = self.match(query, threshold, k=1)[0]
+        return best_match, min_distance
+
+
+class GalleryPartitions:
+    """
+    Per-class views (department, year, division) of one gallery, each cached
+    as a subset() of it. Partitions are carved out of the current gallery with
+    subset() on first use (once, however many requests ask at the same time)
+    and dropped as soon as the gallery is swapped for a newer copy (deltas and
+    reloads are copy-on-write), so they never go stale.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.source = None
+        # Values are (source gallery, partition); holding the source keeps its id() unique while cached
+        self.partitions = SingleFlightCache(max_bytes, sizeof=lambda value: value[1].nbytes(), name="GalleryPartitions")
+        self.lock = threading.Lock()
+
+    def get(self, gallery, student_filter):
+        if not student_filter:
+            return gallery
+        with self.lock:
+            if gallery is not self.source:
+                self.source = gallery
+                self.partitions.clear()
+        # The gallery's identity is part of the key: a view built from an older
+        # gallery by a request still in flight during the swap is never served
+        _, partition = self.partitions.get(
+            (id(gallery), tuple(sorted(student_filter.items()))),
+            lambda: (gallery, gallery.subset(lambda student: all(student.get(k) == v for k, v in student_filter.items())))
+        )
+        return partition
+
+    def __len__(self):
+        return len(self.partitions)
+
+
+def fetch_gallery_records(supabase_client, student_filter=None, updated_since=None):
+    """
+    Student rows for a gallery. With `updated_since` this is the cheap delta
+    query: every row touched after that `updated_at`, embeddings or not.
+    """
+    query = supabase_client.table('students').select(GALLERY_COLUMNS)
+    if updated_since is None:
+        query = query.not_.is_('embeddings', 'null')
+    else:
+        query = query.gt('updated_at', updated_since)
+    for key, value in (student_filter or {}).items():
+        query = query.eq(key, value)
+    response = query.execute()
+    return response.data or []
+
+
+def load_gallery(supabase_client, student_filter=None, index_config=None):
+    """Fetch students with embeddings from Supabase and pack them into a gallery"""
+    records = fetch_gallery_records(supabase_client, student_filter)
+    return EmbeddingGallery.from_records(records, index_config)
@@ -0,0 +1,264 @@
+# face_engine/live_gallery.py - Galleries kept current by deltas instead of TTL reloads
+import logging
+import threading
+import time
+
+from . import events, snapshot
+from .gallery import EmbeddingGallery, fetch_gallery_records, student_key
+from .cache import SingleFlightCache
+
+logger = logging.getLogger(__name__)
+
+# updated_at is stored in whole seconds, so each delta poll re-reads a small overlap
+WATERMARK_OVERLAP = 2
+
+
+def filter_key(student_filter):
+    """Stable cache key for a class filter dict"""
+    return str(sorted((student_filter or {}).items()))
+
+
+def max_updated_at(records, default=0):
+    values = [r.get('updated_at') for r in records if isinstance(r.get('updated_at'), (int, float))]
+    return max(values, default=default)
+
+
+class LiveGallery:
+    """One (optionally class-filtered) gallery that accepts copy-on-write deltas"""
+
+    def __init__(self, student_filter=None, index_config=None):
+        self.student_filter = dict(student_filter or {})
+        self.index_config = index_config
+        self.gallery = None
+        self.loaded_at = 0
+        self.needs_catch_up = False  # set by a cold load until the first delta poll after it is cached
+        self.lock = threading.Lock()  # serializes delta swaps
+
+    def nbytes(self):
+        gallery = self.gallery
+        return gallery.nbytes() if gallery is not None else 0
+
+    def matches(self, record):
+        return all(record.get(key) == value for key, value in self.student_filter.items())
+
+    def load(self, supabase_client):
+        """Full reload; the new gallery is built off to the side and swapped in"""
+        records = fetch_gallery_records(supabase_client, self.student_filter)
+        if self.student_filter:
+            gallery = EmbeddingGallery.from_records(records, self.index_config)
+        else:
+            # Index built once, on the memory-mapped rows rather than the private copy
+            gallery = EmbeddingGallery.from_records(records, {"index": "exact"})
+            gallery = snapshot.share_gallery(gallery, max_updated_at(records), self.index_config)
+        with self.lock:
+            self.gallery = gallery
+            self.loaded_at = time.time()
+        return records
+
+    def load_snapshot(self, snapshot_gallery):
+        """Seed from the memory-mapped snapshot (class galleries take their rows from it)"""
+        gallery = snapshot_gallery.subset(self.matches).with_index_config(self.index_config)
+        with self.lock:
+            self.gallery = gallery
+            self.loaded_at = time.time()
+
+    def apply_upserts(self, records):
+        with self.lock:
+            if self.gallery is None:
+                return
+            # Students who moved out of this class or had their face data cleared drop out
+            leaving = {
+                student_key(r) for r in records
+                if not self.matches(r) or ('embeddings' in r and r['embeddings'] is None)
+            }
+            staying = [r for r in records if student_key(r) not in leaving]
+            self.gallery = self.gallery.remove(leaving).upsert(staying)
+
+    def apply_removals(self, student_ids):
+        with self.lock:
+            if self.gallery is not None:
+                self.gallery = self.gallery.remove(student_ids)
+
+
+class IncrementalGalleryCache:
+    """
+    Base for the recognition embedding caches. Each class filter maps to a
+    LiveGallery held in a SingleFlightCache: a cold filter is loaded once
+    however many requests arrive together, a partition older than
+    `full_reload_interval` keeps serving while one background reload (which
+    also catches deletes made elsewhere) replaces it, and partitions beyond
+    the byte budget are evicted least recently used first. Writes made in this
+    worker arrive as events (events.py); writes from other workers are picked
+    up by a background `updated_at` delta poll.
+    """
+
+    def __init__(self, poll_interval=30, full_reload_interval=3600, max_bytes=None):
+        self.galleries = SingleFlightCache(
+            max_bytes=max_bytes,
+            max_age=full_reload_interval,
+            sizeof=lambda live: live.nbytes(),
+            name=type(self).__name__
+        )
+        self.poll_interval = poll_interval
+        self.full_reload_interval = full_reload_interval
+        self.watermark = 0
+        # A poll that overlapped a cold load (in progress, or stored since the poll began) may have
+        # applied its rows to every gallery but the new one, so it must not advance the watermark
+        self.cold_loads = 0
+        self.watermark_epoch = 0
+        self.last_poll = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self._snapshot = None
+        events.subscribe(self)
+
+    def set_budget(self, max_bytes):
+        """Byte budget for all cached class partitions of this cache (None = unbounded)"""
+        self.galleries.max_bytes = max_bytes
+        self.galleries.resize()
+
+    def warm_start(self, supabase_client, index_config=None):
+        """Called at worker startup: map the snapshot (or load from Supabase) before traffic arrives"""
+        return self.get_gallery(supabase_client, None, index_config)
+
+    def get_gallery(self, supabase_client, student_filter=None, index_config=None):
+        try:
+            live = self.galleries.get(
+                filter_key(student_filter),
+                lambda: self._cold_load(LiveGallery(student_filter, index_config), supabase_client),
+                refresher=lambda live: self._reload(live, supabase_client),
+                loaded_at=lambda live: live.loaded_at
+            )
+        except Exception as e:
+            # Nothing is cached for a failed load, so the next request retries it
+            logger.error(f"Error fetching embeddings from Supabase: {e}")
+            return EmbeddingGallery.empty()
+
+        with self.lock:
+            catch_up = live.needs_catch_up
+            if catch_up:
+                live.needs_catch_up = False
+                self.cold_loads -= 1
+                self.watermark_epoch += 1
+        # Now that the gallery is cached, poll the deltas it missed while loading
+        self.schedule_refresh(supabase_client, force=catch_up)
+        return live.gallery
+
+    def peek_gallery(self, student_filter=None):
+        """The cached gallery for a filter, or None (never loads)"""
+        live = self.galleries.peek(filter_key(student_filter))
+        return live.gallery if live is not None else None
+
+    def _cold_load(self, live, supabase_client):
+        """Build a gallery for the cache; get_gallery polls its missed deltas once it is stored"""
+        with self.lock:
+            self.cold_loads += 1
+        try:
+            if self._load_from_snapshot(live, supabase_client):
+                # Only rows changed since the snapshot was written come from the database
+                return live
+            logger.info(f"Loading embedding gallery for {live.student_filter or 'all students'}...")
+            records = live.load(supabase_client)
+            self._rewind_watermark(live, max_updated_at(records))
+            logger.info(f"Gallery loaded with {len(live.gallery)} students")
+            return live
+        except Exception:
+            with self.lock:
+                self.cold_loads -= 1
+            raise
+
+    def _rewind_watermark(self, live, version):
+        """The next poll re-reads everything newer than `version` (deltas are idempotent, so this is always safe)"""
+        with self.lock:
+            self.watermark = min(self.watermark, version) if self.watermark else version
+        live.needs_catch_up = True
+
+    def _reload(self, live, supabase_client):
+        """Background full reload of one stale partition (swapped in place when done)"""
+        live.load(supabase_client)
+        logger.info(f"Full gallery reload finished for {live.student_filter or 'all students'}")
+
+    def _load_from_snapshot(self, live, supabase_client):
+        path = snapshot.configured_path()
+        if not path:
+            return False
+        # A full reload in any worker may have rewritten the file since it was last mapped here
+        header = snapshot.read_header(path)
+        if header is None:
+            return False
+        mapped = self._snapshot[1] if self._snapshot else None
+        if mapped is None or (mapped["version"], mapped.get("created_at")) != (header["version"], header.get("created_at")):
+            gallery, header = snapshot.read_snapshot(path)
+            if gallery is None:
+                return False
+            self._snapshot = (gallery, header)
+        gallery, header = self._snapshot
+
+        with self.lock:
+            watermark = self.watermark
+        created_at = header.get("created_at", live.loaded_at)
+        if watermark and time.time() - created_at >= self.full_reload_interval:
+            # It would be replaced by a full reload right away; load from the database instead
+            return False
+
+        live.load_snapshot(gallery)
+        # Aged like the snapshot: a full reload replaces it when the snapshot's own interval is up
+        live.loaded_at = created_at
+        if watermark and header["version"] < watermark:
+            # Catch this partition up to the watermark itself instead of rewinding it for every partition
+            live.apply_upserts(fetch_gallery_records(supabase_client, updated_since=header["version"] - WATERMARK_OVERLAP))
+            live.needs_catch_up = True
+        else:
+            self._rewind_watermark(live, header["version"])
+        logger.info(f"Gallery for {live.student_filter or 'all students'} seeded from snapshot "
+                    f"({len(live.gallery)} students)")
+        return True
+
+    def schedule_refresh(self, supabase_client, force=False):
+        """Kick off a background delta poll when due"""
+        now = time.time()
+        with self.lock:
+            if self.refreshing or (not force and now - self.last_poll < self.poll_interval):
+                return
+            self.refreshing = True
+            self.last_poll = now
+        threading.Thread(target=self._refresh, args=(supabase_client,), daemon=True).start()
+
+    def _refresh(self, supabase_client):
+        complete = True
+        try:
+            complete = self._poll_changes(supabase_client)
+        except Exception as e:
+            logger.error(f"Gallery refresh failed: {e}")
+        finally:
+            self.refreshing = False
+        if not complete:
+            # A gallery was loading mid-poll: poll again from the unchanged watermark
+            # (once it is stored, unless it already is)
+            self.schedule_refresh(supabase_client, force=not self.cold_loads)
+
+    def _poll_changes(self, supabase_client):
+        """Apply rows changed since the watermark; False if a gallery joined meanwhile and may have missed them"""
+        with self.lock:
+            since = max(0, self.watermark - WATERMARK_OVERLAP)
+            epoch = self.watermark_epoch
+        records = fetch_gallery_records(supabase_client, updated_since=since)
+        if records:
+            self.on_students_upserted(records)
+            logger.info(f"Applied {len(records)} student changes since updated_at={since}")
+        with self.lock:
+            if self.cold_loads or self.watermark_epoch != epoch:
+                return False
+            self.watermark = max(self.watermark, max_updated_at(records))
+        return True
+
+    # Event subscriber interface (see events.py)
+    def on_students_upserted(self, records):
+        for live in self.galleries.values():
+            live.apply_upserts(records)
+        self.galleries.resize()
+
+    def on_students_removed(self, student_ids):
+        for live in self.galleries.values():
+            live.apply_removals(student_ids)
+        self.galleries.resize()
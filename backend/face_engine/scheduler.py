@@ -0,0 +1,136 @@
+# face_engine/scheduler.py - Cross-request micro-batching for face embeddings
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_EMPTY_CROP = np.zeros((0, 0, 3), dtype=np.uint8)
+
+
+class _Job:
+    __slots__ = ("crops", "future", "enqueued_at")
+
+    def __init__(self, crops):
+        self.crops = crops
+        self.future = Future()
+        self.enqueued_at = time.time()
+
+
+class InferenceScheduler:
+    """
+    Collects face crops submitted by concurrent Flask request threads and runs
+    them through the shared embedder together. A batch is closed when it holds
+    `max_batch_size` faces or `max_wait_ms` has passed since its first job, so
+    a lone request waits at most a few milliseconds longer than before.
+    """
+
+    def __init__(self, embedder, max_batch_size=32, max_wait_ms=5, metrics_window=1000):
+        self.embedder = embedder
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.jobs = queue.Queue()
+
+        self.metrics_lock = threading.Lock()
+        self.batch_sizes = deque(maxlen=metrics_window)
+        self.queue_waits = deque(maxlen=metrics_window)
+        self.inference_times = deque(maxlen=metrics_window)
+        self.total_batches = 0
+        self.total_faces = 0
+
+        self.worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self.worker.start()
+
+    def submit(self, face_crops, min_size=0):
+        """Queue a request's crops; the Future resolves to an (N, 512) array (NaN rows = unusable)"""
+        crops = [
+            crop if crop.size and crop.shape[0] >= min_size and crop.shape[1] >= min_size else _EMPTY_CROP
+            for crop in face_crops
+        ]
+        job = _Job(crops)
+        if not crops:
+            job.future.set_result(self.embedder.embed([]))
+            return job.future
+        self.jobs.put(job)
+        return job.future
+
+    def embed(self, face_crops, min_size=0, timeout=30):
+        return self.submit(face_crops, min_size).result(timeout=timeout)
+
+    def _collect_batch(self):
+        first = self.jobs.get()
+        batch = [first]
+        size = len(first.crops)
+        deadline = time.time() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                job = self.jobs.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(job)
+            size += len(job.crops)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.time()
+            crops = [crop for job in batch for crop in job.crops]
+
+            try:
+                embeddings = self.embedder.embed(crops)
+            except Exception as e:
+                logger.error(f"Batched inference failed: {e}")
+                for job in batch:
+                    job.future.set_exception(e)
+                continue
+
+            offset = 0
+            for job in batch:
+                job.future.set_result(embeddings[offset:offset + len(job.crops)])
+                offset += len(job.crops)
+
+            finished = time.time()
+            with self.metrics_lock:
+                self.total_batches += 1
+                self.total_faces += len(crops)
+                self.batch_sizes.append(len(crops))
+                self.inference_times.append(finished - started)
+                self.queue_waits.extend(started - job.enqueued_at for job in batch)
+
+    def metrics(self):
+        """Recent batch-size and queue-latency statistics for status endpoints"""
+        with self.metrics_lock:
+            sizes = np.array(self.batch_sizes, dtype=np.float64)
+            waits = np.array(self.queue_waits, dtype=np.float64) * 1000
+            inference = np.array(self.inference_times, dtype=np.float64) * 1000
+            totals = (self.total_batches, self.total_faces)
+
+        def summary(values, digits=2):
+            if not len(values):
+                return {"mean": None, "p50": None, "p95": None, "max": None}
+            return {
+                "mean": round(float(values.mean()), digits),
+                "p50": round(float(np.percentile(values, 50)), digits),
+                "p95": round(float(np.percentile(values, 95)), digits),
+                "max": round(float(values.max()), digits)
+            }
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "queue_depth": self.jobs.qsize(),
+            "total_batches": totals[0],
+            "total_faces": totals[1],
+            "batch_size": summary(sizes),
+            "queue_latency_ms": summary(waits),
+            "inference_ms": summary(inference)
+        }
@@ -0,0 +1,146 @@
+# face_engine/snapshot.py - On-disk gallery snapshot shared by all workers via mmap
+"""
+File layout (little-endian):
+
+    8 bytes   magic b"AMSGAL01"
+    4 bytes   header length (uint32)
+    N bytes   JSON header: version (max students.updated_at), count, dim, students
+    padding   up to a 64-byte boundary
+    rest      count x dim float32 matrix of L2-normalized centroids
+
+Every gunicorn worker memory-maps the same file, so the matrix lives once in
+the OS page cache instead of once per worker, and a cold worker only has to
+fetch rows with updated_at > version from Supabase. A full reload is re-based
+onto the file it just wrote (share_gallery), so it stays shared as well.
+"""
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+import numpy as np
+
+from .gallery import EmbeddingGallery
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"AMSGAL01"
+ALIGNMENT = 64
+
+_snapshot_path = None
+
+
+def configure(path):
+    """Set the snapshot file used by the gallery caches (None disables snapshots)"""
+    global _snapshot_path
+    _snapshot_path = path or None
+
+
+def configured_path():
+    return _snapshot_path
+
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a gallery snapshot")
+    (header_len,) = struct.unpack("<I", f.read(4))
+    header = json.loads(f.read(header_len).decode("utf-8"))
+    offset = len(MAGIC) + 4 + header_len
+    header["data_offset"] = offset + (-offset % ALIGNMENT)
+    return header
+
+
+def read_header(path):
+    """Snapshot metadata without touching the matrix (None if missing or unreadable)"""
+    try:
+        with open(path, "rb") as f:
+            return _read_header(f)
+    except (OSError, ValueError) as e:
+        logger.debug(f"No usable gallery snapshot at {path}: {e}")
+        return None
+
+
+def write_snapshot(path, gallery, version):
+    """Atomically write `gallery` to `path` (temp file + rename, safe with concurrent workers)"""
+    matrix = np.ascontiguousarray(gallery.dense(), dtype="<f4")
+    header = json.dumps({
+        "version": version,
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "students": gallery.students,
+        "created_at": time.time()
+    }).encode("utf-8")
+
+    offset = len(MAGIC) + 4 + len(header)
+    padding = -offset % ALIGNMENT
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".gallery-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            f.write(b"\0" * padding)
+            f.write(matrix.tobytes())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    logger.info(f"Gallery snapshot written: {matrix.shape[0]} students, version {version}")
+
+
+def read_snapshot(path, index_config=None):
+    """
+    Memory-map a snapshot. Returns (gallery, header) or (None, None).
+    The gallery's base matrix is a read-only view of the file; deltas applied
+    later go to the gallery's private overlay and never modify it.
+    """
+    header = read_header(path)
+    if header is None:
+        return None, None
+
+    count, dim = header["count"], header["dim"]
+    if count == 0:
+        return EmbeddingGallery.empty(dim), header
+
+    matrix = np.memmap(path, dtype="<f4", mode="r", offset=header["data_offset"], shape=(count, dim))
+    gallery = EmbeddingGallery(header["students"], matrix, index_config)
+    logger.info(f"Memory-mapped gallery snapshot: {count} students, version {header['version']}")
+    return gallery, header
+
+
+def maybe_write_snapshot(gallery, version):
+    """Refresh the configured snapshot if this gallery is newer or differs in size"""
+    path = configured_path()
+    if not path:
+        return
+    header = read_header(path)
+    if header and header["version"] >= version and header["count"] == len(gallery):
+        return
+    try:
+        write_snapshot(path, gallery, version)
+    except OSError as e:
+        logger.error(f"Failed to write gallery snapshot {path}: {e}")
+
+
+def share_gallery(gallery, version, index_config=None):
+    """
+    Write `gallery` as the snapshot if it is newer, then return the same rows
+    memory-mapped from that file (with the index built on them), so a full
+    reload does not leave a private float32 matrix in every worker. Falls back
+    to `gallery` itself when snapshots are off or the file holds other rows.
+    """
+    maybe_write_snapshot(gallery, version)
+    path = configured_path()
+    if path:
+        header = read_header(path)
+        if header and header["version"] == version and header["students"] == gallery.students:
+            mapped, _ = read_snapshot(path, index_config)
+            if mapped is not None and mapped.students == gallery.students:
+                return mapped
+    return gallery.with_index_config(index_config)
@@ -0,0 +1,153 @@
+# face_engine/tracker.py - Per-session face tracking across consecutive frames
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def box_iou(a, b):
+    """IoU of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def _centroid_distance(a, b):
+    """Centroid distance relative to the larger box side"""
+    ax, ay = a[0] + a[2] / 2.0, a[1] + a[3] / 2.0
+    bx, by = b[0] + b[2] / 2.0, b[1] + b[3] / 2.0
+    scale = max(a[2], a[3], b[2], b[3], 1)
+    return ((ax - bx) ** 2 + (ay - by) ** 2) ** 0.5 / scale
+
+
+class Track:
+    """One face followed across frames, with the identity it was matched to (if any)"""
+    __slots__ = ("track_id", "box", "student", "distance", "hits", "frames_since_embed", "last_seen")
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = tuple(box)
+        self.student = None
+        self.distance = None
+        self.hits = 0
+        self.frames_since_embed = 0
+        self.last_seen = time.time()
+
+
+class FaceTracker:
+    """
+    Associates detected boxes with the tracks of the previous frames by IoU,
+    falling back to centroid distance for faces that moved more than their
+    box overlap allows. A track whose identity has been confirmed
+    `confirm_hits` times reuses it instead of being embedded again, and is
+    re-verified every `reverify_every` frames in case two people swapped seats.
+    """
+
+    def __init__(self, iou_threshold=0.3, centroid_threshold=0.5, max_idle=10.0,
+                 confirm_hits=1, reverify_every=30):
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold
+        self.max_idle = max_idle
+        self.confirm_hits = confirm_hits
+        self.reverify_every = reverify_every
+        self.tracks = []
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+        self._ids = itertools.count(1)
+
+    def assign(self, boxes):
+        """Return one Track per box (existing or new), in box order"""
+        with self.lock:
+            now = time.time()
+            self.last_used = now
+            self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_idle]
+
+            assigned = [None] * len(boxes)
+            free = set(range(len(self.tracks)))
+
+            # Greedy association, best overlaps first
+            pairs = sorted(
+                ((box_iou(box, track.box), i, j)
+                 for i, box in enumerate(boxes) for j, track in enumerate(self.tracks)),
+                reverse=True
+            )
+            for iou, i, j in pairs:
+                if iou < self.iou_threshold:
+                    break
+                if assigned[i] is None and j in free:
+                    assigned[i] = self.tracks[j]
+                    free.discard(j)
+
+            for i, box in enumerate(boxes):
+                if assigned[i] is not None:
+                    continue
+                nearest = min(free, key=lambda j: _centroid_distance(box, self.tracks[j].box), default=None)
+                if nearest is not None and _centroid_distance(box, self.tracks[nearest].box) <= self.centroid_threshold:
+                    assigned[i] = self.tracks[nearest]
+                    free.discard(nearest)
+
+            for i, box in enumerate(boxes):
+                track = assigned[i]
+                if track is None:
+                    track = Track(next(self._ids), box)
+                    self.tracks.append(track)
+                    assigned[i] = track
+                else:
+                    track.frames_since_embed += 1
+                track.box = tuple(box)
+                track.last_seen = now
+            return assigned
+
+    def needs_embedding(self, track):
+        """New, unconfirmed, or due for re-verification"""
+        return (
+            track.student is None
+            or track.hits < self.confirm_hits
+            or track.frames_since_embed >= self.reverify_every
+        )
+
+    def observe(self, track, student, distance):
+        """Record the match result of a freshly embedded track"""
+        with self.lock:
+            track.frames_since_embed = 0
+            if student is None:
+                track.student, track.distance, track.hits = None, None, 0
+            elif track.student and track.student.get("studentId") == student.get("studentId"):
+                track.distance = distance
+                track.hits += 1
+            else:
+                track.student, track.distance, track.hits = student, distance, 1
+
+
+class SessionTrackers:
+    """FaceTracker per attendance session; idle sessions are dropped after `session_idle` seconds"""
+
+    def __init__(self, session_idle=900, **tracker_options):
+        self.session_idle = session_idle
+        self.tracker_options = tracker_options
+        self.trackers = {}
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        with self.lock:
+            now = time.time()
+            for key in [k for k, t in self.trackers.items() if now - t.last_used > self.session_idle]:
+                del self.trackers[key]
+            session_id = str(session_id)
+            tracker = self.trackers.get(session_id)
+            if tracker is None:
+                tracker = self.trackers[session_id] = FaceTracker(**self.tracker_options)
+            return tracker
+
+    def drop(self, session_id):
+        with self.lock:
+            self.trackers.pop(str(session_id), None)
+
+    def __len__(self):
+        return len(self.trackers)
@@ -0,0 +1,78 @@
+# face_engine/uploads.py - Image uploads as multipart, raw image/jpeg or base64 JSON
+import base64
+import io
+from flask import request
+
+RAW_IMAGE_TYPES = ("image/jpeg", "image/jpg", "image/png", "image/webp", "application/octet-stream")
+
+
+class ImageUploadError(ValueError):
+    """The request carried no usable image data"""
+
+
+def _is_raw_image():
+    return request.mimetype in RAW_IMAGE_TYPES
+
+
+def request_fields():
+    """
+    Non-image fields of the request: form fields for multipart uploads, query
+    parameters for raw image bodies, otherwise the JSON body.
+    """
+    if request.files or request.mimetype == "multipart/form-data":
+        fields = request.args.to_dict()
+        fields.update(request.form.to_dict())
+        return fields
+    if _is_raw_image():
+        return request.args.to_dict()
+    return request.get_json(silent=True) or {}
+
+
+def _decode_base64(value):
+    if not isinstance(value, str) or not value:
+        raise ImageUploadError("Invalid base64 image")
+    if value.startswith("data:"):
+        value = value.split(",", 1)[1]
+    try:
+        return io.BytesIO(base64.b64decode(value))
+    except (ValueError, TypeError):
+        raise ImageUploadError("Invalid base64 image")
+
+
+def request_images(field="image", fields=None):
+    """
+    Image payloads of the request as readable binary streams, in upload order.
+
+    - multipart/form-data: every file under `field` (the spooled upload stream
+      is handed to the decoder as-is)
+    - raw image/* body: the body itself, read once without form parsing
+    - JSON: base64 string (or list of strings) under `field`, data URLs accepted
+    """
+    if request.files:
+        uploads = [f.stream for f in request.files.getlist(field) if f]
+        if uploads:
+            return uploads
+
+    if _is_raw_image():
+        # BytesIO over the body bytes shares the buffer instead of copying it
+        body = request.get_data(cache=False)
+        if not body:
+            raise ImageUploadError("Empty image body")
+        return [io.BytesIO(body)]
+
+    if fields is None:
+        fields = request_fields()
+    value = fields.get(field)
+    if isinstance(value, list):
+        return [_decode_base64(v) for v in value]
+    if value:
+        return [_decode_base64(value)]
+    return []
+
+
+def request_image(field="image", fields=None):
+    """The single image of a recognition request (ImageUploadError if missing)"""
+    images = request_images(field, fields)
+    if not images:
+        raise ImageUploadError("No image provided")
+    return images[0]
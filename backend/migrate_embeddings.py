@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Rewrite legacy JSON float-list embeddings as the packed v2 format (face_engine/codec.py).
+Recognition reads both formats, so this can run at any time, in several passes.
+
+Usage: python migrate_embeddings.py [--dtype float16|float32] [--keep-samples] [--dry-run]
+"""
+
+import argparse
+import json
+import os
+from dotenv import load_dotenv
+from supabase import create_client
+
+from face_engine.codec import pack_embeddings, storage_version, unpack_samples
+
+PAGE_SIZE = 200
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+parser.add_argument("--keep-samples", action="store_true", help="store every enrollment sample, not just the centroid")
+parser.add_argument("--dry-run", action="store_true", help="report sizes without writing")
+args = parser.parse_args()
+
+# Load environment variables
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+if not SUPABASE_URL or not SUPABASE_KEY:
+    print("Error: Missing SUPABASE_URL or SUPABASE_KEY in .env file")
+    exit(1)
+
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+print("=== MIGRATING STUDENT EMBEDDINGS TO PACKED FORMAT ===")
+migrated = skipped = failed = 0
+bytes_before = bytes_after = 0
+last_id = 0
+
+while True:
+    rows = (
+        supabase.table('students').select('id, student_id, embeddings')
+        .not_.is_('embeddings', 'null').gt('id', last_id).order('id').limit(PAGE_SIZE)
+        .execute().data or []
+    )
+    if not rows:
+        break
+    last_id = rows[-1]['id']
+
+    for row in rows:
+        if storage_version(row['embeddings']) != 1:
+            skipped += 1
+            continue
+        samples = unpack_samples(row['embeddings'])
+        if samples is None:
+            failed += 1
+            print(f"  ⚠️ {row['student_id']}: unreadable embeddings, left as is")
+            continue
+
+        packed = pack_embeddings(samples, dtype=args.dtype, keep_samples=args.keep_samples)
+        bytes_before += len(json.dumps(row['embeddings']))
+        bytes_after += len(json.dumps(packed))
+        if not args.dry_run:
+            try:
+                supabase.table('students').update({"embeddings": packed}).eq('id', row['id']).execute()
+            except Exception as e:
+                failed += 1
+                print(f"  ❌ {row['student_id']}: {e}")
+                continue
+        migrated += 1
+
+print(f"Migrated: {migrated}, already packed/empty: {skipped}, failed: {failed}")
+if migrated:
+    print(f"Stored size: {bytes_before / 1024:.1f} KB -> {bytes_after / 1024:.1f} KB "
+          f"({bytes_before / max(bytes_after, 1):.1f}x smaller)")
+if args.dry_run:
+    print("Dry run - nothing was written")
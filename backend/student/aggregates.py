@@ -0,0 +1,206 @@
+# student/aggregates.py - Per-student / per-subject attendance rates over date ranges
+import logging
+import threading
+import time
+from datetime import date as date_cls
+import numpy as np
+
+from student.queries import call_rpc, iter_keyset
+
+logger = logging.getLogger(__name__)
+
+# Ranges that include today keep changing while sessions run
+LIVE_RANGE_TTL = 60
+SESSION_CHUNK = 200
+
+
+class SummaryCache:
+    """
+    Results keyed by (filters, day). A range that ended before today cannot
+    change any more, so it is kept for the rest of the day; a range that
+    includes today is kept for `live_ttl` seconds.
+    """
+
+    def __init__(self, live_ttl=LIVE_RANGE_TTL, max_entries=256):
+        self.live_ttl = live_ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filters):
+        today = date_cls.today().isoformat()
+        with self.lock:
+            entry = self.entries.get((filters, today))
+            if entry and (entry[0] is None or entry[0] > time.time()):
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, filters, date_to, result):
+        today = date_cls.today().isoformat()
+        expires_at = time.time() + self.live_ttl if date_to >= today else None
+        with self.lock:
+            # Entries of previous days are never read again
+            for key in [k for k in self.entries if k[1] != today]:
+                del self.entries[key]
+            if len(self.entries) >= self.max_entries:
+                self.entries.pop(next(iter(self.entries)))
+            self.entries[(filters, today)] = (expires_at, result)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+summary_cache = SummaryCache()
+
+
+def _grouped_rows_rpc(supabase, f):
+    return call_rpc(supabase, 'attendance_range_summary', {
+        "p_from": f["date_from"],
+        "p_to": f["date_to"],
+        "p_department": f["department"],
+        "p_year": f["year"],
+        "p_division": f["division"],
+        "p_subject": f["subject"],
+        "p_student_id": f["student_id"]
+    })
+
+
+def _grouped_rows_numpy(supabase, f):
+    """Same rows as the RPC, grouped with NumPy over narrow keyset scans"""
+    def session_query():
+        query = supabase.table('attendance_sessions').select("id, subject")
+        query = query.gte("date", f["date_from"]).lte("date", f["date_to"])
+        for column in ("department", "year", "division", "subject"):
+            if f[column]:
+                query = query.eq(column, f[column])
+        return query
+
+    session_subject = {row['id']: row.get('subject') or "N/A" for row in iter_keyset(session_query, "id")}
+    if not session_subject:
+        return []
+
+    session_ids, student_ids, names, present = [], [], [], []
+    ids = list(session_subject)
+    for start in range(0, len(ids), SESSION_CHUNK):
+        chunk = ids[start:start + SESSION_CHUNK]
+
+        def record_query():
+            query = supabase.table('attendance_records').select("id, session_id, student_id, student_name, present")
+            query = query.in_("session_id", chunk)
+            return query.eq("student_id", f["student_id"]) if f["student_id"] else query
+
+        for row in iter_keyset(record_query, "id"):
+            session_ids.append(row['session_id'])
+            student_ids.append(row['student_id'])
+            names.append(row.get('student_name'))
+            present.append(bool(row.get('present')))
+
+    if not student_ids:
+        return []
+
+    subjects = sorted(set(session_subject.values()))
+    subject_index = {subject: i for i, subject in enumerate(subjects)}
+    subject_codes = np.fromiter((subject_index[session_subject[s]] for s in session_ids), dtype=np.int64, count=len(session_ids))
+    students, first_seen, student_codes = np.unique(np.asarray(student_ids, dtype=object), return_index=True, return_inverse=True)
+
+    group = student_codes.astype(np.int64) * len(subjects) + subject_codes
+    size = len(students) * len(subjects)
+    totals = np.bincount(group, minlength=size)
+    presents = np.bincount(group, weights=np.asarray(present, dtype=np.float64), minlength=size)
+
+    rows = []
+    for g in np.flatnonzero(totals):
+        student, subject = divmod(int(g), len(subjects))
+        rows.append({
+            "student_id": students[student],
+            "student_name": names[first_seen[student]],
+            "subject": subjects[subject],
+            "sessions": int(totals[g]),
+            "present": int(presents[g])
+        })
+    return rows
+
+
+def _rate(present, sessions):
+    return round(present / sessions * 100, 1) if sessions else 0.0
+
+
+def _summarize(rows):
+    """Fold (student, subject) rows into per-student, per-subject and overall rates"""
+    students, subjects = {}, {}
+    for row in rows:
+        sessions, present = int(row['sessions']), int(row['present'])
+        subject = row.get('subject') or "N/A"
+
+        student = students.setdefault(row['student_id'], {
+            "studentId": str(row['student_id']),
+            "studentName": row.get('student_name'),
+            "sessions": 0,
+            "present": 0,
+            "subjects": {}
+        })
+        student["sessions"] += sessions
+        student["present"] += present
+        student["subjects"][subject] = {"sessions": sessions, "present": present, "attendanceRate": _rate(present, sessions)}
+
+        totals = subjects.setdefault(subject, {"subject": subject, "students": 0, "records": 0, "present": 0})
+        totals["students"] += 1
+        totals["records"] += sessions
+        totals["present"] += present
+
+    for student in students.values():
+        student["absent"] = student["sessions"] - student["present"]
+        student["attendanceRate"] = _rate(student["present"], student["sessions"])
+    for totals in subjects.values():
+        totals["attendanceRate"] = _rate(totals["present"], totals["records"])
+
+    records = sum(s["sessions"] for s in students.values())
+    present = sum(s["present"] for s in students.values())
+    return {
+        "students": sorted(students.values(), key=lambda s: s["studentId"]),
+        "subjects": sorted(subjects.values(), key=lambda s: s["subject"]),
+        "totals": {
+            "students": len(students),
+            "records": records,
+            "present": present,
+            "attendanceRate": _rate(present, records)
+        }
+    }
+
+
+def attendance_summary(supabase, date_from, date_to, department=None, year=None, division=None,
+                       subject=None, student_id=None):
+    """
+    Attendance rates for sessions dated date_from..date_to (inclusive, YYYY-MM-DD)
+    of the given class. Grouped by the attendance_range_summary RPC when it
+    exists, otherwise by NumPy. Returns (summary, source) where source is
+    "cache", "rpc" or "numpy".
+    """
+    f = {
+        "date_from": date_from,
+        "date_to": date_to,
+        "department": department or None,
+        "year": year or None,
+        "division": division or None,
+        "subject": subject or None,
+        "student_id": student_id or None
+    }
+    key = tuple(sorted(f.items()))
+    cached = summary_cache.get(key)
+    if cached is not None:
+        return cached, "cache"
+
+    rows = _grouped_rows_rpc(supabase, f)
+    source = "rpc"
+    if rows is None:
+        rows = _grouped_rows_numpy(supabase, f)
+        source = "numpy"
+
+    summary = _summarize(rows)
+    summary_cache.put(key, date_to, summary)
+    return summary, source
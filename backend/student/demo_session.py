@@ -1,30 +1,19 @@
 # student/demo_session.py - OPTIMIZED VERSION
 from flask import Blueprint, request, jsonify, current_app
 import time
-import base64
 import numpy as np
-from PIL import Image
-import io
-from deepface import DeepFace
-from scipy.spatial.distance import cosine
 import logging
-import threading
-from datetime import datetime
+from face_engine import IncrementalGalleryCache, unpack_centroid
+from face_engine.gallery import GALLERY_COLUMNS, student_entry
+from face_engine.embedding import embed_faces
+from face_engine.uploads import request_fields, request_image, ImageUploadError
+from face_engine.decode import decode_frame
+from teacher.session_roster import session_roster
 
 logger = logging.getLogger(__name__)
 
 demo_session_bp = Blueprint("demo_session", __name__)
 
-def read_image_from_bytes_optimized(b, target_size=(640, 480)):
-    """Optimized image reading with size constraints"""
-    img = Image.open(io.BytesIO(b)).convert("RGB")
-
-    # Resize large images to reduce processing time
-    if img.width > target_size[0] or img.height > target_size[1]:
-        img.thumbnail(target_size, Image.Resampling.LANCZOS)
-
-    return np.array(img)
-
 def detect_faces_rgb_optimized(rgb_image, detector):
     """Optimized face detection using preloaded MTCNN detector"""
     # Skip detection if image is too small
@@ -48,94 +37,79 @@ def detect_faces_rgb_optimized(rgb_image, detector):
 
     return faces
 
-def extract_embedding_optimized(face_rgb):
-    """Optimized embedding extraction using preloaded model"""
-    try:
-        # Resize face to standard size
-        face_pil = Image.fromarray(face_rgb.astype("uint8")).resize((160, 160))
-        face_array = np.array(face_pil)
-
-        # Use DeepFace with optimized parameters
-        rep = DeepFace.represent(
-            face_array, 
-            model_name="Facenet512", 
-            detector_backend="skip",
-            enforce_detection=False  # Skip additional detection
-        )
-        return np.array(rep[0]["embedding"], dtype=np.float32)  # Use float32 for speed
-
-    except Exception as e:
-        logger.error(f"Embedding extraction error: {e}")
-        return None
-
-# In-memory cache for student embeddings (optional optimization)
-class EmbeddingCache:
+# In-memory cache for the student embedding gallery. Registrations and edits in
+# this worker are applied immediately; other workers' changes arrive through a
+# background updated_at delta poll, with a full reload only once an hour.
+class EmbeddingCache(IncrementalGalleryCache):
     def __init__(self):
-        self.student_embeddings = None
-        self.last_update = 0
-        self.cache_duration = 300  # 5 minutes
-        self.lock = threading.Lock()
-
-    def get_embeddings(self, supabase_client):
-        current_time = time.time()
-
-        # Thread-safe cache check
-        with self.lock:
-            if (self.student_embeddings is None or 
-                current_time - self.last_update > self.cache_duration):
-
-                logger.info("Refreshing embedding cache...")
-
-                try:
-                    # Fetch students with embeddings from Supabase
-                    response = supabase_client.table('students').select('student_id, student_name, embeddings').not_.is_('embeddings', 'null').execute()
-                    students = response.data
-
-                    # Process embeddings
-                    self.student_embeddings = []
-                    for student in students:
-                        embeddings = student.get('embeddings', [])
-                        if embeddings and len(embeddings) > 0:
-                            # Average multiple embeddings if available
-                            avg_embedding = np.mean(embeddings, axis=0).astype(np.float32)
-                            self.student_embeddings.append({
-                                'embedding': avg_embedding,
-                                'studentId': student.get('student_id'),
-                                'studentName': student.get('student_name')
-                            })
-
-                    self.last_update = current_time
-                    logger.info(f"Cache refreshed with {len(self.student_embeddings)} students")
-
-                except Exception as e:
-                    logger.error(f"Error fetching embeddings from Supabase: {e}")
-                    self.student_embeddings = []
-
-        return self.student_embeddings
+        super().__init__(poll_interval=30, full_reload_interval=3600)
+
+    @property
+    def gallery(self):
+        return self.peek_gallery({})
 
 # Global embedding cache instance
 embedding_cache = EmbeddingCache()
 
 def find_best_match_optimized(query_embedding, supabase_client, threshold=0.6):
     """Optimized database search with caching"""
-    cached_embeddings = embedding_cache.get_embeddings(supabase_client)
+    gallery = embedding_cache.get_gallery(
+        supabase_client, index_config=current_app.config.get("GALLERY_INDEX_CONFIG")
+    )
 
-    if not cached_embeddings:
+    if not len(gallery):
         return None, float('inf')
 
-    best_match = None
-    min_distance = float('inf')
+    return gallery.best_match(query_embedding, threshold)
+
+def find_best_matches_optimized(query_embeddings, supabase_client, threshold=0.6, top_k=1):
+    """Match every face of a frame in one matrix multiply; returns (match, distance, candidates) per face"""
+    gallery = embedding_cache.get_gallery(
+        supabase_client, index_config=current_app.config.get("GALLERY_INDEX_CONFIG")
+    )
 
-    # Vectorized comparison for speed
-    for student_data in cached_embeddings:
-        stored_embedding = student_data['embedding']
-        distance = cosine(query_embedding, stored_embedding)
+    if not len(gallery):
+        return [(None, float('inf'), []) for _ in query_embeddings]
 
-        if distance < min_distance:
-            min_distance = distance
-            best_match = student_data
+    return gallery.match(np.vstack(query_embeddings), threshold, k=top_k)
 
-    return best_match if min_distance < threshold else None, min_distance
+def verify_student_optimized(query_embedding, supabase_client, student_id, threshold=0.6):
+    """
+    1:1 verification against one student's stored embedding. The cached
+    gallery answers through its per-student row lookup; a student it does not
+    hold yet (e.g. registered on another worker since the last delta poll) is
+    read on its own. Returns (student or None, distance, source).
+    """
+    gallery = embedding_cache.get_gallery(
+        supabase_client, index_config=current_app.config.get("GALLERY_INDEX_CONFIG")
+    )
+    if student_id in gallery:
+        match, distance = gallery.verify(student_id, query_embedding, threshold)
+        return match, distance, "gallery"
+
+    response = supabase_client.table('students').select(GALLERY_COLUMNS).eq('student_id', student_id).limit(1).execute()
+    if not response.data:
+        return None, float('inf'), "not_enrolled"
+    record = response.data[0]
+    centroid = unpack_centroid(record.get('embeddings'))
+    if centroid is None:
+        return None, float('inf'), "not_enrolled"
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    similarity = float(centroid @ query) / float(np.linalg.norm(centroid) * np.linalg.norm(query) or 1.0)
+    distance = float(np.clip(1.0 - similarity, 0.0, 2.0))
+    return (student_entry(record) if distance < threshold else None), distance, "database"
+
+def format_candidates(candidates):
+    """Top-k candidate list for JSON responses"""
+    return [
+        {
+            "user_id": c["student"]["studentId"],
+            "name": c["student"]["studentName"],
+            "distance": round(float(c["distance"]), 4)
+        }
+        for c in candidates
+    ]
 
 @demo_session_bp.route("/api/demo/recognize", methods=["POST"])
 def demo_recognize_optimized():
@@ -154,24 +128,29 @@ def demo_recognize_optimized():
     # Get preloaded detector
     detector = model_manager.get_detector()
 
-    data = request.get_json()
+    # Multipart / raw JPEG uploads, base64 JSON as fallback
+    data = request_fields()
     supabase_client = current_app.config.get("SUPABASE")
     threshold = float(current_app.config.get("THRESHOLD", "0.6"))
-
-    image_b64 = data.get("image", "")
-    if image_b64.startswith("data:"):
-        image_b64 = image_b64.split(",", 1)[1]
+    try:
+        top_k = max(1, int(data.get("top_k", 1)))
+    except (TypeError, ValueError):
+        top_k = 1
 
     try:
         # Optimized image processing
-        rgb = read_image_from_bytes_optimized(base64.b64decode(image_b64))
+        # Decode straight to detection size; crops come from a sharper decode later
+        frame = decode_frame(request_image("image", data))
+        rgb = frame.rgb
+    except ImageUploadError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         logger.error(f"Image processing error: {e}")
         return jsonify({"success": False, "error": "Invalid base64 image"}), 400
 
     # Face detection with timing
     detection_start = time.time()
-    faces = detect_faces_rgb_optimized(rgb, detector)
+    faces = frame.attach_crops(detect_faces_rgb_optimized(rgb, detector))
     detection_time = time.time() - detection_start
 
     if len(faces) == 0:
@@ -179,33 +158,49 @@ def demo_recognize_optimized():
             "success": True, 
             "faces": [],
             "processing_time": round(time.time() - start_time, 3),
-            "detection_time": round(detection_time, 3)
+            "detection_time": round(detection_time, 3),
+            "prefilter": detector.last_stats()
         })
 
-    results = []
-
-    # Process each detected face
-    for f in faces:
-        embedding_start = time.time()
-        emb = extract_embedding_optimized(f["face"])
-        embedding_time = time.time() - embedding_start
+    results = [None] * len(faces)
 
-        if emb is None:
-            results.append({
+    # Embed every detected face in one batched forward pass
+    embedding_start = time.time()
+    try:
+        batch_embeddings, valid, embedding_time = embed_faces(model_manager, [f["face"] for f in faces])
+    except Exception as e:
+        # Scheduler timeout or model failure: every face is reported as not embedded
+        logger.error(f"Embedding error: {e}")
+        batch_embeddings, valid, embedding_time = None, [False] * len(faces), time.time() - embedding_start
+    embedded_idx = [i for i in range(len(faces)) if valid[i]]
+    embeddings = [batch_embeddings[i] for i in embedded_idx]
+
+    for i, f in enumerate(faces):
+        if not valid[i]:
+            results[i] = {
                 "match": None, 
                 "distance": None, 
                 "box": f["box"],
                 "error": "Failed to extract embedding"
-            })
-            continue
+            }
 
-        # Search for best match with timing
+    # Match every face against the gallery in one search
+    search_time = 0.0
+    matches = []
+    if embeddings:
         search_start = time.time()
-        best_match, min_distance = find_best_match_optimized(emb, supabase_client, threshold)
+        matches = find_best_matches_optimized(embeddings, supabase_client, threshold, top_k)
         search_time = time.time() - search_start
 
+    for i, (best_match, min_distance, candidates) in zip(embedded_idx, matches):
+        f = faces[i]
+        timing = {
+            "embedding": round(float(embedding_time / len(faces)), 3),
+            "search": round(float(search_time), 3)
+        }
+
         if best_match:
-            results.append({
+            result = {
                 "match": {
                     "user_id": best_match["studentId"], 
                     "name": best_match["studentName"]
@@ -213,21 +208,19 @@ def demo_recognize_optimized():
                 "distance": round(float(min_distance), 4),
                 "confidence": round(float(1 - min_distance) * 100, 1),
                 "box": f["box"],
-                "timing": {
-                    "embedding": round(float(embedding_time), 3),
-                    "search": round(float(search_time), 3)
-                }
-            })
+                "timing": timing
+            }
         else:
-            results.append({
+            result = {
                 "match": None, 
-                "distance": round(float(min_distance), 4), 
+                "distance": round(float(min_distance), 4) if min_distance != float('inf') else None, 
                 "box": f["box"],
-                "timing": {
-                    "embedding": round(float(embedding_time), 3),
-                    "search": round(float(search_time), 3)
-                }
-            })
+                "timing": timing
+            }
+
+        if top_k > 1:
+            result["candidates"] = format_candidates(candidates)
+        results[i] = result
 
     total_time = time.time() - start_time
 
@@ -237,11 +230,15 @@ def demo_recognize_optimized():
         "processing_time": round(float(total_time), 3),
         "detailed_timing": {
             "detection": round(float(detection_time), 3),
+            "embedding": round(float(embedding_time), 3),
+            "search": round(float(search_time), 3),
             "total": round(float(total_time), 3)
         },
+        "prefilter": detector.last_stats(),
         "performance_info": {
             "models_preloaded": True,
-            "cache_enabled": True
+            "cache_enabled": True,
+            "batched_embedding": model_manager.get_embedder().batch_ready
         }
     })
 
@@ -305,43 +302,59 @@ def mark_attendance_with_recognition():
     # Get preloaded detector
     detector = model_manager.get_detector()
 
-    data = request.get_json()
+    # Multipart / raw JPEG uploads, base64 JSON as fallback
+    data = request_fields()
     supabase_client = current_app.config.get("SUPABASE")
     threshold = float(current_app.config.get("THRESHOLD", "0.6"))
 
     session_id = data.get("session_id")
-    image_b64 = data.get("image", "")
     
     if not session_id:
         return jsonify({"success": False, "error": "Session ID required"}), 400
-    
-    if image_b64.startswith("data:"):
-        image_b64 = image_b64.split(",", 1)[1]
+
+    # The signed-in student is verified 1:1 against their own embedding;
+    # searching every enrolled student needs an explicit mode=identify
+    claimed_id = data.get("student_id") or data.get("studentId")
+    mode = (data.get("mode") or "verify").lower()
+    if mode not in ("verify", "identify"):
+        return jsonify({"success": False, "error": "mode must be 'verify' or 'identify'"}), 400
+    if mode == "verify" and not claimed_id:
+        return jsonify({"success": False, "error": "student_id is required for verification"}), 400
 
     try:
         # Optimized image processing
-        rgb = read_image_from_bytes_optimized(base64.b64decode(image_b64))
+        # Decode straight to detection size; crops come from a sharper decode later
+        frame = decode_frame(request_image("image", data))
+        rgb = frame.rgb
+    except ImageUploadError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         logger.error(f"Image processing error: {e}")
         return jsonify({"success": False, "error": "Invalid base64 image"}), 400
 
-    # Check if session exists and is active
+    # Check if session exists and is active (in-memory roster, loaded once per session)
     try:
-        from datetime import datetime
-        current_time = datetime.now().isoformat()
-        session_response = supabase_client.table('attendance_sessions').select('*').eq('id', session_id).eq('finalized', False).gt('expires_at', current_time).execute()
+        active_session = session_roster.get(supabase_client, session_id)
         
-        if not session_response.data:
+        if active_session is None or not active_session.is_active():
             return jsonify({"success": False, "error": "Session not found or expired"}), 404
+
+        # Nothing to recognize if the claimed student is already marked
+        if mode == "verify" and active_session.is_present(claimed_id):
+            return jsonify({
+                "success": False,
+                "error": "Attendance already marked for this session",
+                "student_id": claimed_id
+            })
         
-        session = session_response.data[0]
+        session = active_session.row
     except Exception as e:
         logger.error(f"Session validation error: {e}")
         return jsonify({"success": False, "error": "Failed to validate session"}), 500
 
     # Face detection
     detection_start = time.time()
-    faces = detect_faces_rgb_optimized(rgb, detector)
+    faces = frame.attach_crops(detect_faces_rgb_optimized(rgb, detector))
     detection_time = time.time() - detection_start
 
     if len(faces) == 0:
@@ -351,11 +364,15 @@ def mark_attendance_with_recognition():
             "processing_time": round(time.time() - start_time, 3)
         })
 
-    # Process the first detected face
+    # Process the first detected face (batched with concurrent requests by the scheduler)
     face = faces[0]
-    embedding_start = time.time()
-    emb = extract_embedding_optimized(face["face"])
-    embedding_time = time.time() - embedding_start
+    try:
+        face_embeddings, valid, embedding_time = embed_faces(model_manager, [face["face"]])
+    except Exception as e:
+        # Scheduler timeout or model failure: answered like a face that could not be embedded
+        logger.error(f"Embedding error: {e}")
+        face_embeddings, valid = None, [False]
+    emb = face_embeddings[0] if valid[0] else None
 
     if emb is None:
         return jsonify({
@@ -364,12 +381,25 @@ def mark_attendance_with_recognition():
             "processing_time": round(time.time() - start_time, 3)
         })
 
-    # Search for best match
+    # 1:1 verification against the claimed student, or 1:N search when opted in
     search_start = time.time()
-    best_match, min_distance = find_best_match_optimized(emb, supabase_client, threshold)
+    if mode == "verify":
+        best_match, min_distance, source = verify_student_optimized(emb, supabase_client, claimed_id, threshold)
+    else:
+        best_match, min_distance = find_best_match_optimized(emb, supabase_client, threshold)
+        source = "gallery"
     search_time = time.time() - search_start
 
     if not best_match:
+        if mode == "verify":
+            return jsonify({
+                "success": False,
+                "error": "No face registered for this student. Please register first." if source == "not_enrolled"
+                         else "Face does not match the signed-in student.",
+                "mode": mode,
+                "distance": round(min_distance, 4) if min_distance != float('inf') else None,
+                "processing_time": round(time.time() - start_time, 3)
+            })
         return jsonify({
             "success": False,
             "error": "Face not recognized. Please register first.",
@@ -385,10 +415,11 @@ def mark_attendance_with_recognition():
     student_name = best_match["studentName"]
 
     try:
-        # Check if student is already marked present in this session
-        existing_record = supabase_client.table('attendance_records').select('*').eq('session_id', session_id).eq('student_id', student_id).execute()
+        # Duplicate check and mark answered from the roster; the record is
+        # persisted by the write-behind flusher
+        status, _ = active_session.mark_present(student_id, student_name)
         
-        if existing_record.data:
+        if status == "duplicate":
             return jsonify({
                 "success": False,
                 "error": f"Attendance already marked for {student_name}",
@@ -396,39 +427,10 @@ def mark_attendance_with_recognition():
                 "student_id": student_id
             })
 
-        # Mark attendance by calling the attendance API
-        attendance_data = {
-            "session_id": session_id,
-            "student_id": student_id,
-            "student_name": student_name
-        }
-        
-        # Create attendance record
-        attendance_record = {
-            "session_id": session_id,
-            "student_id": student_id,
-            "student_name": student_name,
-            "present": True,
-            "marked_at": datetime.now().isoformat()
-        }
-        
-        # Insert attendance record
-        supabase_client.table('attendance_records').insert(attendance_record).execute()
-        
-        # Update session's students array to mark as present
-        students = session.get('students', [])
-        for student in students:
-            if student.get('student_id') == student_id:
-                student['present'] = True
-                student['marked_at'] = datetime.now().isoformat()
-                break
-        
-        # Update session with modified students array
-        supabase_client.table('attendance_sessions').update({"students": students}).eq('id', session_id).execute()
-
         return jsonify({
             "success": True,
             "message": f"Attendance marked successfully for {student_name}",
+            "mode": mode,
             "student": {
                 "student_id": student_id,
                 "student_name": student_name,
@@ -469,9 +471,15 @@ def model_status():
             "error": "Model manager not available"
         }), 500
 
+    gallery = embedding_cache.gallery
+    scheduler = model_manager.get_scheduler()
     return jsonify({
         "success": True,
         "models_ready": model_manager.is_ready(),
         "health_check": model_manager.health_check(),
+        "gallery": gallery.index_info() if gallery is not None else None,
+        "gallery_cache": embedding_cache.galleries.stats(),
+        "inference": scheduler.metrics() if scheduler else None,
+        "detection": model_manager.get_detector().metrics() if model_manager.is_ready() else None,
         "timestamp": time.time()
     })
\ No newline at end of file
@@ -0,0 +1,161 @@
+# student/queries.py - Narrow column sets, keyset pagination and aggregates for listing routes
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Explicit column sets: the students table carries the embeddings JSONB
+# (several 512-float vectors per row), so listing routes never select("*") on it
+STUDENT_LIST_COLUMNS = "student_id, student_name, department, year, division"
+STUDENT_PROFILE_COLUMNS = "student_id, student_name, department"
+ATTENDANCE_LIST_COLUMNS = "id, student_id, present, marked_at, created_at"
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+_rpc_available = {}
+# PostgREST "function not in schema cache" / Postgres undefined_function
+MISSING_FUNCTION_CODES = ("PGRST202", "42883")
+
+
+def page_params(args, default=DEFAULT_PAGE_SIZE):
+    """(limit, cursor) from request args; limit is clamped to 1..MAX_PAGE_SIZE"""
+    try:
+        limit = int(args.get('limit', default))
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, MAX_PAGE_SIZE)), args.get('cursor') or None
+
+
+def keyset_page(query, key, limit, cursor=None):
+    """
+    One page of `query` ordered by `key`, starting after `cursor`.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    if cursor is not None:
+        query = query.gt(key, cursor)
+    rows = query.order(key).limit(limit + 1).execute().data or []
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].get(key)
+    return rows, None
+
+
+def iter_keyset(build_query, key, page_size=MAX_PAGE_SIZE):
+    """Yield every row of a query page by page (build_query returns a fresh, filtered query)"""
+    cursor = None
+    while True:
+        rows, cursor = keyset_page(build_query(), key, page_size, cursor)
+        yield from rows
+        if cursor is None:
+            return
+
+
+def count_rows(query):
+    """Exact row count without transferring the rows"""
+    return query.limit(1).execute().count or 0
+
+
+def rpc_missing(error):
+    """True when an RPC error means the function is not installed (not a timeout or a failure inside it)"""
+    code = getattr(error, "code", None)
+    if code in MISSING_FUNCTION_CODES:
+        return True
+    message = str(error)
+    return any(code in message for code in MISSING_FUNCTION_CODES) or "Could not find the function" in message
+
+
+def rpc_available(name):
+    """False once `name` turned out not to be installed on the server"""
+    return _rpc_available.get(name, True)
+
+
+def call_rpc(supabase, name, params=None, strict=False):
+    """
+    Run an optional RPC from SUPABASE_RPC_FUNCTIONS.txt. Returns its data, or
+    None so the caller uses its table-query fallback. Only a missing function
+    stops later calls from trying it again. With strict=True any other error
+    is raised instead (for RPCs that write: the call may have committed, so
+    the caller decides whether a fallback is safe).
+    """
+    if not rpc_available(name):
+        return None
+    try:
+        return supabase.rpc(name, params or {}).execute().data
+    except Exception as e:
+        if rpc_missing(e):
+            _rpc_available[name] = False
+            logger.warning(f"{name} RPC unavailable, using table queries: {e}")
+        elif strict:
+            raise
+        else:
+            logger.error(f"{name} RPC failed, using table queries for this call: {e}")
+        return None
+
+
+def apply_student_filters(query, department=None, year=None, division=None, student_id=None):
+    if department:
+        query = query.eq("department", department)
+    if year:
+        query = query.eq("year", year)
+    if division:
+        query = query.eq("division", division)
+    if student_id:
+        query = query.eq("student_id", student_id)
+    return query
+
+
+def apply_day_filter(query, date=None):
+    """Restrict attendance_records to one calendar day (records carry created_at)"""
+    if date:
+        query = query.gte("created_at", f"{date}T00:00:00")
+        query = query.lt("created_at", f"{date}T23:59:59")
+    return query
+
+
+def department_counts(supabase):
+    """{department: number of students}, grouped in the database when the RPC exists"""
+    rows = call_rpc(supabase, 'student_department_counts')
+    if rows is not None:
+        return {row['department']: row['students'] for row in rows if row.get('department')}
+
+    counts = {}
+    for row in iter_keyset(lambda: supabase.table('students').select("id, department"), "id"):
+        department = row.get('department')
+        if department:
+            counts[department] = counts.get(department, 0) + 1
+    return counts
+
+
+def attendance_day_stats(supabase, date=None, department=None, year=None, division=None, student_id=None):
+    """
+    (total_students, present) for the filtered students on `date`: a student is
+    present when their latest record that day is marked present. One RPC call,
+    or narrow keyset scans of student_id / present when the RPC is missing.
+    """
+    rows = call_rpc(supabase, 'attendance_day_stats', {
+        "p_date": date or None,
+        "p_department": department or None,
+        "p_year": year or None,
+        "p_division": division or None,
+        "p_student_id": student_id or None
+    })
+    if rows:
+        return int(rows[0]['total_students'] or 0), int(rows[0]['present'] or 0)
+
+    student_ids = {
+        row['student_id'] for row in iter_keyset(
+            lambda: apply_student_filters(supabase.table("students").select("student_id"),
+                                          department, year, division, student_id),
+            "student_id"
+        )
+    }
+
+    def record_query():
+        query = apply_day_filter(supabase.table("attendance_records").select("id, student_id, present"), date)
+        return query.eq("student_id", student_id) if student_id else query
+
+    latest = {}
+    for row in iter_keyset(record_query, "id"):
+        latest[row['student_id']] = row.get('present')
+
+    present = sum(1 for sid in student_ids if latest.get(sid))
+    return len(student_ids), present
@@ -1,18 +1,19 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, jsonify, current_app
 import time
-import base64
 import numpy as np
 from PIL import Image
 import io
 from deepface import DeepFace
-from mtcnn import MTCNN
 import logging
+from face_engine import publish_student_upserted, pack_embeddings
+from face_engine.uploads import request_fields, request_images, ImageUploadError
+from student.queries import count_rows, department_counts
 
 student_registration_bp = Blueprint("student_registration", __name__)
 logger = logging.getLogger(__name__)
 
 def read_image_from_bytes(b):
-    img = Image.open(io.BytesIO(b)).convert('RGB')
+    img = Image.open(io.BytesIO(b) if isinstance(b, (bytes, bytearray)) else b).convert('RGB')
     return np.array(img)
 
 def detect_faces_rgb(rgb_image):
@@ -41,7 +42,8 @@ def extract_embedding(face_rgb):
 
 @student_registration_bp.route('/api/register-student', methods=['POST'])
 def register_student():
-    data = request.get_json()
+    # Multipart form (fields + 5 files under "images") or JSON with base64 images
+    data = request_fields()
     if not data:
         return jsonify({"success": False, "error": "Invalid JSON data"}), 400
 
@@ -49,11 +51,18 @@ def register_student():
     supabase = current_app.config.get("SUPABASE")
 
     # Check required fields
-    required_fields = ['studentName', 'studentId', 'department', 'year', 'division', 'semester', 'email', 'phoneNumber', 'images']
+    required_fields = ['studentName', 'studentId', 'department', 'year', 'division', 'semester', 'email', 'phoneNumber']
     for field in required_fields:
         if not data.get(field):
             return jsonify({"success": False, "error": f"{field} is required"}), 400
 
+    try:
+        images = request_images('images', data)
+    except ImageUploadError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if not images:
+        return jsonify({"success": False, "error": "images is required"}), 400
+
     # Check uniqueness of studentId and email
     student_id_check = supabase.table('students').select("id").eq("student_id", data['studentId']).execute()
     if student_id_check.data:
@@ -64,16 +73,13 @@ def register_student():
         return jsonify({"success": False, "error": "Email already registered"}), 400
 
     # Validate images
-    images = data.get('images')
-    if not isinstance(images, list) or len(images) != 5:
+    if len(images) != 5:
         return jsonify({"success": False, "error": "Exactly 5 images are required"}), 400
 
     embeddings = []
-    for idx, img_b64 in enumerate(images):
+    for idx, img_stream in enumerate(images):
         try:
-            if img_b64.startswith("data:"):
-                img_b64 = img_b64.split(",", 1)[1]
-            rgb = read_image_from_bytes(base64.b64decode(img_b64))
+            rgb = read_image_from_bytes(img_stream)
         except Exception:
             return jsonify({"success": False, "error": f"Invalid image data at index {idx}"}), 400
 
@@ -84,7 +90,16 @@ def register_student():
         emb = extract_embedding(faces[0]['face'])
         if emb is None:
             return jsonify({"success": False, "error": f"Failed to extract face features for image {idx+1}"}), 500
-        embeddings.append(emb.tolist())
+        embeddings.append(emb)
+
+    # Packed base64 centroid by default; "json" keeps the legacy float lists
+    storage = current_app.config.get("EMBEDDING_STORAGE", "float16")
+    if storage == "json":
+        stored_embeddings = [e.tolist() for e in embeddings]
+    else:
+        stored_embeddings = pack_embeddings(
+            embeddings, dtype=storage, keep_samples=current_app.config.get("EMBEDDING_STORE_SAMPLES", False)
+        )
 
     student_data = {
         "student_id": data['studentId'],
@@ -96,7 +111,7 @@ def register_student():
         "email": data['email'],
         "phone_number": data['phoneNumber'],
         "status": "active",
-        "embeddings": embeddings,
+        "embeddings": stored_embeddings,
         "face_registered": True,
         "created_at": int(time.time()),
         "updated_at": int(time.time())
@@ -105,6 +120,8 @@ def register_student():
     result = supabase.table('students').insert(student_data).execute()
     
     if result.data:
+        # Make the new face recognizable right away instead of after a cache refresh
+        publish_student_upserted(student_data)
         return jsonify({"success": True, "studentId": data['studentId'], "record_id": result.data[0]['id']})
     else:
         return jsonify({"success": False, "error": "Failed to register student"}), 500
@@ -112,12 +129,13 @@ def register_student():
 @student_registration_bp.route('/api/students/count', methods=['GET'])
 def get_student_count():
     supabase = current_app.config.get("SUPABASE")
-    result = supabase.table('students').select("id", count="exact").execute()
-    return jsonify({"success": True, "count": result.count})
+    count = count_rows(supabase.table('students').select("id", count="exact"))
+    return jsonify({"success": True, "count": count})
 
 @student_registration_bp.route('/api/students/departments', methods=['GET'])
 def get_departments():
     supabase = current_app.config.get("SUPABASE")
-    result = supabase.table('students').select("department").execute()
-    departments = list(set([row['department'] for row in result.data if row.get('department')]))
-    return jsonify({"success": True, "departments": departments, "count": len(departments)})
+    # Grouped server-side (RPC) or from a department-only keyset scan
+    counts = department_counts(supabase)
+    departments = sorted(counts)
+    return jsonify({"success": True, "departments": departments, "count": len(departments), "students": counts})
@@ -1,9 +1,72 @@
 from flask import Blueprint, request, jsonify, current_app
-from bson import ObjectId
 import time
+from face_engine import publish_student_upserted, publish_student_removed
+from student.queries import count_rows, department_counts, iter_keyset
 
 student_update_bp = Blueprint("student_update", __name__)
 
+# Everything but the face data, for listings and lookups
+STUDENT_DETAIL_COLUMNS = (
+    "id, student_id, student_name, department, year, division, semester, "
+    "email, phone_number, status, face_registered, created_at, updated_at"
+)
+
+def student_response(row):
+    """A students row in the camelCase shape the update pages use (`_id` is the database id)"""
+    return {
+        "_id": str(row["id"]),
+        "studentId": row.get("student_id"),
+        "studentName": row.get("student_name"),
+        "department": row.get("department"),
+        "year": row.get("year"),
+        "division": row.get("division"),
+        "semester": row.get("semester"),
+        "email": row.get("email"),
+        "phoneNumber": row.get("phone_number"),
+        "status": row.get("status"),
+        "face_registered": row.get("face_registered"),
+        "created_at": row.get("created_at"),
+        "updated_at": row.get("updated_at")
+    }
+
+def find_student(supabase, db_id, columns=STUDENT_DETAIL_COLUMNS):
+    """Students row by database id, or None"""
+    if not str(db_id).isdigit():
+        return None
+    result = supabase.table('students').select(columns).eq('id', int(db_id)).limit(1).execute()
+    return result.data[0] if result.data else None
+
+def taken_by_other(supabase, column, value, db_id):
+    """True if another student already uses `value` for a unique column"""
+    result = supabase.table('students').select("id").eq(column, value).neq('id', db_id).limit(1).execute()
+    return bool(result.data)
+
+def search_pattern(term):
+    """ilike pattern for a substring search (characters that break an or_ filter are dropped)"""
+    return "%" + "".join(c for c in term if c not in ",()%*") + "%"
+
+def notify_student_changed(student, update_data):
+    """Push an edited student into the in-process recognition galleries"""
+    old_id = student.get('student_id') or student.get('studentId')
+    if update_data.get('student_id') and update_data.get('student_id') != old_id:
+        publish_student_removed(old_id)
+    # Embeddings are not part of update_data, so the stored face data carries over
+    publish_student_upserted({**student, **update_data})
+
+def detail_updates(data, student):
+    """Editable columns from a camelCase request body (face data is never touched here)"""
+    return {
+        "student_name": data.get("studentName", student.get("student_name")),
+        "student_id": data.get("studentId", student.get("student_id")),
+        "department": data.get("department", student.get("department")),
+        "year": data.get("year", student.get("year")),
+        "division": data.get("division", student.get("division")),
+        "semester": data.get("semester", student.get("semester")),
+        "phone_number": data.get("phoneNumber", student.get("phone_number")),
+        # The recognition caches' delta poll picks rows up by updated_at
+        "updated_at": int(time.time())
+    }
+
 # ============================================================================
 # STUDENT ROUTES (Students can only update their own records)
 # ============================================================================
@@ -11,45 +74,38 @@ student_update_bp = Blueprint("student_update", __name__)
 @student_update_bp.route('/api/students', methods=['GET'])
 def get_students():
     """Get students for the logged-in user (email-based authorization for students only)"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     try:
         # Get logged-in user's email from request headers or query params
         user_email = request.headers.get('X-User-Email') or request.args.get('user_email')
         user_type = request.headers.get('X-User-Type', 'student')
-        
+
         if not user_email:
             return jsonify({"success": False, "error": "User email required for authorization"}), 401
-        
+
         # For students: only show their own record
         if user_type == 'student':
-            query = {"email": user_email}
-            
+            query = supabase.table('students').select(STUDENT_DETAIL_COLUMNS).eq('email', user_email)
+
             # Get query parameters for additional filtering
             department = request.args.get('department', '')
             year = request.args.get('year', '')
             search = request.args.get('search', '')
-            
+
             if department:
-                query['department'] = department
+                query = query.eq('department', department)
             if year:
-                query['year'] = year
+                query = query.eq('year', year)
             if search:
-                query['$or'] = [
-                    {'studentName': {'$regex': search, '$options': 'i'}},
-                    {'studentId': {'$regex': search, '$options': 'i'}}
-                ]
-            
-            # Exclude embedding field from response for performance
-            students = list(students_col.find(query, {"embedding": 0}).sort('studentName', 1))
-            
-            # Convert ObjectId to string for JSON serialization
-            for student in students:
-                student['_id'] = str(student['_id'])
-            
+                pattern = search_pattern(search)
+                query = query.or_(f"student_name.ilike.{pattern},student_id.ilike.{pattern}")
+
+            # Face data is left out of the response for performance
+            students = [student_response(row) for row in query.order('student_name').execute().data or []]
+
             return jsonify({
-                "success": True, 
+                "success": True,
                 "students": students,
                 "count": len(students),
                 "authorized_email": user_email,
@@ -58,38 +114,37 @@ def get_students():
         else:
             # For teachers, redirect to admin endpoint
             return jsonify({
-                "success": False, 
+                "success": False,
                 "error": "Teachers should use /api/admin/students endpoint"
             }), 400
-            
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @student_update_bp.route('/api/students/<student_id>', methods=['GET'])
 def get_student(student_id):
     """Get specific student (email-based authorization for students)"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     try:
         # Get logged-in user's email and type
         user_email = request.headers.get('X-User-Email')
         user_type = request.headers.get('X-User-Type', 'student')
-        
+
         if not user_email:
             return jsonify({"success": False, "error": "User email required for authorization"}), 401
-        
+
         # Get student record
-        student = students_col.find_one({"_id": ObjectId(student_id)}, {"embedding": 0})
+        student = find_student(supabase, student_id)
         if not student:
             return jsonify({"success": False, "error": "Student not found"}), 404
-        
+
         # Authorization based on user type
         if user_type == 'student':
             # Check if logged-in user's email matches student's email
             if student.get('email') != user_email:
                 return jsonify({
-                    "success": False, 
+                    "success": False,
                     "error": "Unauthorized: You can only view your own student record"
                 }), 403
         elif user_type == 'teacher':
@@ -97,132 +152,108 @@ def get_student(student_id):
             pass
         else:
             return jsonify({"success": False, "error": "Invalid user type"}), 403
-        
-        student['_id'] = str(student['_id'])
-        return jsonify({"success": True, "student": student})
+
+        return jsonify({"success": True, "student": student_response(student)})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @student_update_bp.route('/api/students/<student_id>', methods=['PUT'])
 def update_student(student_id):
     """Update student (email-based authorization for students, role-based for teachers)"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     data = request.get_json()
-    
+
     try:
         # Get logged-in user's email and type
         user_email = request.headers.get('X-User-Email') or data.get('user_email')
         user_type = request.headers.get('X-User-Type', 'student')
-        
+
         if not user_email:
             return jsonify({"success": False, "error": "User email required for authorization"}), 401
-        
-        # Validate student exists
-        student = students_col.find_one({"_id": ObjectId(student_id)})
+
+        # Validate student exists (with face data, which the gallery update carries over)
+        student = find_student(supabase, student_id, "*")
         if not student:
             return jsonify({"success": False, "error": "Student not found"}), 404
-        
+
         # Authorization check based on user type
         if user_type == 'student':
             # Students can only update their own record
             if student.get('email') != user_email:
                 return jsonify({
-                    "success": False, 
+                    "success": False,
                     "error": "Unauthorized: You can only update your own student record"
                 }), 403
-            
+
             # Students cannot change email
             if data.get('email') and data.get('email') != student.get('email'):
                 return jsonify({
-                    "success": False, 
+                    "success": False,
                     "error": "Email cannot be changed for security reasons. Contact administrator."
                 }), 400
-                
+
         elif user_type == 'teacher':
             # Teachers can update any student record
             # Check if new email conflicts with existing one (if changed)
             if data.get('email') and data.get('email') != student.get('email'):
-                existing = students_col.find_one({
-                    'email': data.get('email'),
-                    '_id': {'$ne': ObjectId(student_id)}
-                })
-                if existing:
+                if taken_by_other(supabase, 'email', data.get('email'), student['id']):
                     return jsonify({"success": False, "error": "Email already registered"}), 400
         else:
             return jsonify({"success": False, "error": "Invalid user type"}), 403
-        
+
         # Check if new student ID conflicts with existing one (if changed)
-        if data.get('studentId') and data.get('studentId') != student.get('studentId'):
-            existing = students_col.find_one({
-                'studentId': data.get('studentId'),
-                '_id': {'$ne': ObjectId(student_id)}
-            })
-            if existing:
+        if data.get('studentId') and data.get('studentId') != student.get('student_id'):
+            if taken_by_other(supabase, 'student_id', data.get('studentId'), student['id']):
                 return jsonify({"success": False, "error": "Student ID already exists"}), 400
-        
+
         # Update student data (preserve face data)
-        update_data = {
-            "studentName": data.get("studentName", student.get("studentName")),
-            "studentId": data.get("studentId", student.get("studentId")),
-            "department": data.get("department", student.get("department")),
-            "year": data.get("year", student.get("year")),
-            "division": data.get("division", student.get("division")),
-            "semester": data.get("semester", student.get("semester")),
-            "phoneNumber": data.get("phoneNumber", student.get("phoneNumber")),
-            "updated_at": time.time(),
-            "updated_by": user_email,
-            "updated_by_type": user_type
-        }
-        
+        update_data = detail_updates(data, student)
+
         # Only update email if teacher is making the change
         if user_type == 'teacher':
             update_data["email"] = data.get("email", student.get("email"))
-        
-        result = students_col.update_one(
-            {"_id": ObjectId(student_id)}, 
-            {"$set": update_data}
-        )
-        
-        if result.modified_count > 0:
+
+        result = supabase.table('students').update(update_data).eq('id', student['id']).execute()
+
+        if result.data:
+            notify_student_changed(student, update_data)
             message = "Student details updated successfully"
             if user_type == 'student':
                 message = "Your student details updated successfully"
             return jsonify({
-                "success": True, 
+                "success": True,
                 "message": message
             })
         else:
             return jsonify({"success": False, "error": "No changes made"})
-    
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @student_update_bp.route('/api/students/<student_id>', methods=['DELETE'])
 def delete_student(student_id):
     """Delete student (email-based authorization for students, role-based for teachers)"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     try:
         # Get logged-in user's email and type
         user_email = request.headers.get('X-User-Email')
         user_type = request.headers.get('X-User-Type', 'student')
-        
+
         if not user_email:
             return jsonify({"success": False, "error": "User email required for authorization"}), 401
-        
-        student = students_col.find_one({"_id": ObjectId(student_id)})
+
+        student = find_student(supabase, student_id)
         if not student:
             return jsonify({"success": False, "error": "Student not found"}), 404
-        
+
         # Authorization check based on user type
         if user_type == 'student':
             # Students can only delete their own record
             if student.get('email') != user_email:
                 return jsonify({
-                    "success": False, 
+                    "success": False,
                     "error": "Unauthorized: You can only delete your own student record"
                 }), 403
         elif user_type == 'teacher':
@@ -230,19 +261,20 @@ def delete_student(student_id):
             pass
         else:
             return jsonify({"success": False, "error": "Invalid user type"}), 403
-        
+
         # Delete complete student record (including face data)
-        students_col.delete_one({"_id": ObjectId(student_id)})
-        
-        message = f"Student {student.get('studentName')} deleted successfully"
+        supabase.table('students').delete().eq('id', student['id']).execute()
+        publish_student_removed(student.get('student_id'))
+
+        message = f"Student {student.get('student_name')} deleted successfully"
         if user_type == 'student':
-            message = f"Your student record ({student.get('studentName')}) deleted successfully"
-            
+            message = f"Your student record ({student.get('student_name')}) deleted successfully"
+
         return jsonify({
-            "success": True, 
+            "success": True,
             "message": message
         })
-    
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -264,52 +296,45 @@ def delete_student_alt(student_id):
 @student_update_bp.route('/api/admin/students', methods=['GET'])
 def get_all_students_admin():
     """Admin/Teacher route to view all students with filtering"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     try:
         # Check if user is admin or teacher
         user_type = request.headers.get('X-User-Type')
         user_email = request.headers.get('X-User-Email')
-        
+
         if user_type not in ['teacher', 'admin']:
             return jsonify({
-                "success": False, 
+                "success": False,
                 "error": "Unauthorized: Teacher/Admin access required"
             }), 403
-        
+
         # Get query parameters for filtering
         department = request.args.get('department', '')
         year = request.args.get('year', '')
         division = request.args.get('division', '')
         student_id = request.args.get('studentId', '')
         search = request.args.get('search', '')
-        
+
         # Build query
-        query = {}
+        query = supabase.table('students').select(STUDENT_DETAIL_COLUMNS)
         if department:
-            query['department'] = department
+            query = query.eq('department', department)
         if year:
-            query['year'] = year
+            query = query.eq('year', year)
         if division:
-            query['division'] = division
+            query = query.eq('division', division)
         if student_id:
-            query['studentId'] = {'$regex': student_id, '$options': 'i'}
+            query = query.ilike('student_id', search_pattern(student_id))
         if search:
-            query['$or'] = [
-                {'studentName': {'$regex': search, '$options': 'i'}},
-                {'studentId': {'$regex': search, '$options': 'i'}},
-                {'email': {'$regex': search, '$options': 'i'}}
-            ]
-        
-        # Get all students (admin view) - exclude embedding for performance
-        students = list(students_col.find(query, {"embedding": 0}).sort('studentName', 1))
-        
-        for student in students:
-            student['_id'] = str(student['_id'])
-        
+            pattern = search_pattern(search)
+            query = query.or_(f"student_name.ilike.{pattern},student_id.ilike.{pattern},email.ilike.{pattern}")
+
+        # Get all students (admin view) - face data is left out for performance
+        students = [student_response(row) for row in query.order('student_name').execute().data or []]
+
         return jsonify({
-            "success": True, 
+            "success": True,
             "students": students,
             "count": len(students),
             "admin_view": True,
@@ -321,197 +346,171 @@ def get_all_students_admin():
 @student_update_bp.route('/api/teacher/students/search', methods=['GET'])
 def search_students_teacher():
     """Advanced search for teachers with multiple filters"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     try:
         # Check if user is teacher
         user_type = request.headers.get('X-User-Type')
         if user_type != 'teacher':
             return jsonify({
-                "success": False, 
+                "success": False,
                 "error": "Unauthorized: Teacher access required"
             }), 403
-        
+
         # Get search parameters
         student_id = request.args.get('studentId', '').strip()
         student_name = request.args.get('studentName', '').strip()
         department = request.args.get('department', '').strip()
         year = request.args.get('year', '').strip()
         division = request.args.get('division', '').strip()
-        
+
         # Build query
-        query = {}
-        
+        query = supabase.table('students').select(STUDENT_DETAIL_COLUMNS)
+        filters = {}
+
         if student_id:
-            query['studentId'] = {'$regex': student_id, '$options': 'i'}
-        
+            query = query.ilike('student_id', search_pattern(student_id))
+            filters['studentId'] = student_id
+
         if student_name:
-            query['studentName'] = {'$regex': student_name, '$options': 'i'}
-        
+            query = query.ilike('student_name', search_pattern(student_name))
+            filters['studentName'] = student_name
+
         if department:
-            query['department'] = department
-            
+            query = query.eq('department', department)
+            filters['department'] = department
+
         if year:
-            query['year'] = year
-            
+            query = query.eq('year', year)
+            filters['year'] = year
+
         if division:
-            query['division'] = division
-        
+            query = query.eq('division', division)
+            filters['division'] = division
+
         # Execute search (limit to 50 results for performance)
-        students = list(students_col.find(
-            query, 
-            {"embedding": 0}  # Exclude embedding for performance
-        ).limit(50).sort('studentName', 1))
-        
-        # Convert ObjectId to string
-        for student in students:
-            student['_id'] = str(student['_id'])
-        
+        rows = query.order('student_name').limit(50).execute().data or []
+        students = [student_response(row) for row in rows]
+
         return jsonify({
             "success": True,
             "students": students,
             "count": len(students),
-            "query": query
+            "query": filters
         })
-        
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @student_update_bp.route('/api/teacher/student/<student_id_or_db_id>', methods=['GET'])
 def get_student_by_id_teacher(student_id_or_db_id):
     """Teacher route to get any student by Student ID or database _id"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     try:
         # Check if user is teacher
         user_type = request.headers.get('X-User-Type')
         if user_type != 'teacher':
             return jsonify({
-                "success": False, 
+                "success": False,
                 "error": "Unauthorized: Teacher access required"
             }), 403
-        
+
         # Try to find by studentId first (e.g., "STU001"), then by database _id
-        student = students_col.find_one({"studentId": student_id_or_db_id}, {"embedding": 0})
-        
+        result = supabase.table('students').select(STUDENT_DETAIL_COLUMNS).eq(
+            'student_id', student_id_or_db_id
+        ).limit(1).execute()
+        student = result.data[0] if result.data else None
+
         if not student:
-            # If not found by studentId, try by database ObjectId
-            try:
-                student = students_col.find_one({"_id": ObjectId(student_id_or_db_id)}, {"embedding": 0})
-            except:
-                pass
-        
+            # If not found by studentId, try by database id
+            student = find_student(supabase, student_id_or_db_id)
+
         if not student:
             return jsonify({"success": False, "error": f"Student with ID '{student_id_or_db_id}' not found"}), 404
-        
-        student['_id'] = str(student['_id'])
-        return jsonify({"success": True, "student": student})
-        
+
+        return jsonify({"success": True, "student": student_response(student)})
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @student_update_bp.route('/api/teacher/student/<student_db_id>', methods=['PUT'])
 def update_student_teacher(student_db_id):
     """Teacher route to update any student by database _id"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     data = request.get_json()
-    
+
     try:
         # Check if user is teacher
         user_type = request.headers.get('X-User-Type')
-        user_email = request.headers.get('X-User-Email')
-        
+
         if user_type != 'teacher':
             return jsonify({
-                "success": False, 
+                "success": False,
                 "error": "Unauthorized: Teacher access required"
             }), 403
-        
-        # Validate student exists
-        student = students_col.find_one({"_id": ObjectId(student_db_id)})
+
+        # Validate student exists (with face data, which the gallery update carries over)
+        student = find_student(supabase, student_db_id, "*")
         if not student:
             return jsonify({"success": False, "error": "Student not found"}), 404
-        
+
         # Check if new student ID conflicts with existing one (if changed)
-        if data.get('studentId') and data.get('studentId') != student.get('studentId'):
-            existing = students_col.find_one({
-                'studentId': data.get('studentId'),
-                '_id': {'$ne': ObjectId(student_db_id)}
-            })
-            if existing:
+        if data.get('studentId') and data.get('studentId') != student.get('student_id'):
+            if taken_by_other(supabase, 'student_id', data.get('studentId'), student['id']):
                 return jsonify({"success": False, "error": "Student ID already exists"}), 400
-        
+
         # Check if new email conflicts with existing one (if changed)
         if data.get('email') and data.get('email') != student.get('email'):
-            existing = students_col.find_one({
-                'email': data.get('email'),
-                '_id': {'$ne': ObjectId(student_db_id)}
-            })
-            if existing:
+            if taken_by_other(supabase, 'email', data.get('email'), student['id']):
                 return jsonify({"success": False, "error": "Email already registered"}), 400
-        
+
         # Update student data (preserve face data)
-        update_data = {
-            "studentName": data.get("studentName", student.get("studentName")),
-            "studentId": data.get("studentId", student.get("studentId")),
-            "department": data.get("department", student.get("department")),
-            "year": data.get("year", student.get("year")),
-            "division": data.get("division", student.get("division")),
-            "semester": data.get("semester", student.get("semester")),
-            "email": data.get("email", student.get("email")),  # Teachers can update email
-            "phoneNumber": data.get("phoneNumber", student.get("phoneNumber")),
-            "updated_at": time.time(),
-            "updated_by_teacher": user_email or 'teacher',
-            "updated_by_type": "teacher"
-        }
-        
-        result = students_col.update_one(
-            {"_id": ObjectId(student_db_id)}, 
-            {"$set": update_data}
-        )
-        
-        if result.modified_count > 0:
+        update_data = detail_updates(data, student)
+        update_data["email"] = data.get("email", student.get("email"))  # Teachers can update email
+
+        result = supabase.table('students').update(update_data).eq('id', student['id']).execute()
+
+        if result.data:
+            notify_student_changed(student, update_data)
             return jsonify({
-                "success": True, 
+                "success": True,
                 "message": f"Student {data.get('studentName', 'record')} updated successfully by teacher"
             })
         else:
             return jsonify({"success": False, "error": "No changes made"})
-    
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @student_update_bp.route('/api/teacher/student/<student_db_id>', methods=['DELETE'])
 def delete_student_teacher(student_db_id):
     """Teacher route to delete any student by database _id"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     try:
         # Check if user is teacher
         user_type = request.headers.get('X-User-Type')
         if user_type != 'teacher':
             return jsonify({
-                "success": False, 
+                "success": False,
                 "error": "Unauthorized: Teacher access required"
             }), 403
-        
-        student = students_col.find_one({"_id": ObjectId(student_db_id)})
+
+        student = find_student(supabase, student_db_id)
         if not student:
             return jsonify({"success": False, "error": "Student not found"}), 404
-        
+
         # Delete complete student record (including face data)
-        students_col.delete_one({"_id": ObjectId(student_db_id)})
-        
+        supabase.table('students').delete().eq('id', student['id']).execute()
+        publish_student_removed(student.get('student_id'))
+
         return jsonify({
-            "success": True, 
-            "message": f"Student {student.get('studentName')} deleted successfully by teacher"
+            "success": True,
+            "message": f"Student {student.get('student_name')} deleted successfully by teacher"
         })
-    
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -522,53 +521,44 @@ def delete_student_teacher(student_db_id):
 @student_update_bp.route('/api/students/search', methods=['GET'])
 def search_students():
     """General search students by various criteria"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     try:
         user_type = request.headers.get('X-User-Type', 'student')
         user_email = request.headers.get('X-User-Email')
-        
+
         # Authorization check
         if user_type not in ['student', 'teacher', 'admin']:
             return jsonify({"success": False, "error": "Unauthorized"}), 403
-        
+
         search_term = request.args.get('q', '')
         department = request.args.get('department', '')
         year = request.args.get('year', '')
         limit = int(request.args.get('limit', 10))
-        
+
         if not search_term and not department and not year:
             return jsonify({"success": False, "error": "Search term or filters required"}), 400
-        
+
         # Build search query
-        query = {}
-        
+        query = supabase.table('students').select(STUDENT_DETAIL_COLUMNS)
+
         # For students, limit to their own record
         if user_type == 'student':
-            query['email'] = user_email
-        
+            query = query.eq('email', user_email)
+
         if search_term:
-            query['$or'] = [
-                {'studentName': {'$regex': search_term, '$options': 'i'}},
-                {'studentId': {'$regex': search_term, '$options': 'i'}},
-                {'email': {'$regex': search_term, '$options': 'i'}}
-            ]
-        
+            pattern = search_pattern(search_term)
+            query = query.or_(f"student_name.ilike.{pattern},student_id.ilike.{pattern},email.ilike.{pattern}")
+
         if department:
-            query['department'] = department
+            query = query.eq('department', department)
         if year:
-            query['year'] = year
-        
-        # Execute search
-        students = list(students_col.find(
-            query, 
-            {"embedding": 0}  # Exclude embedding for performance
-        ).limit(limit).sort('studentName', 1))
-        
-        for student in students:
-            student['_id'] = str(student['_id'])
-        
+            query = query.eq('year', year)
+
+        # Execute search (face data is left out for performance)
+        rows = query.order('student_name').limit(limit).execute().data or []
+        students = [student_response(row) for row in rows]
+
         return jsonify({
             "success": True,
             "students": students,
@@ -576,45 +566,44 @@ def search_students():
             "search_term": search_term,
             "user_type": user_type
         })
-        
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @student_update_bp.route('/api/students/stats', methods=['GET'])
 def get_student_stats():
     """Get student statistics (admin/teacher only)"""
-    db = current_app.config.get("DB")
-    students_col = db.students
-    
+    supabase = current_app.config.get("SUPABASE")
+
     try:
         user_type = request.headers.get('X-User-Type')
-        
+
         if user_type not in ['teacher', 'admin']:
             return jsonify({
-                "success": False, 
+                "success": False,
                 "error": "Unauthorized: Teacher/Admin access required"
             }), 403
-        
+
         # Basic stats
-        total_students = students_col.count_documents({})
-        
+        total_students = count_rows(supabase.table('students').select("id", count="exact"))
+
         # Students by department
-        dept_pipeline = [
-            {"$group": {"_id": "$department", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]
-        dept_stats = list(students_col.aggregate(dept_pipeline))
-        
+        dept_stats = sorted(
+            ({"_id": department, "count": count} for department, count in department_counts(supabase).items()),
+            key=lambda row: -row["count"]
+        )
+
         # Students by year
-        year_pipeline = [
-            {"$group": {"_id": "$year", "count": {"$sum": 1}}},
-            {"$sort": {"_id": 1}}
-        ]
-        year_stats = list(students_col.aggregate(year_pipeline))
-        
+        years = {}
+        for row in iter_keyset(lambda: supabase.table('students').select("id, year"), "id"):
+            years[row.get('year')] = years.get(row.get('year'), 0) + 1
+        year_stats = [{"_id": year, "count": count} for year, count in sorted(years.items(), key=lambda item: str(item[0]))]
+
         # Students with face data
-        face_registered = students_col.count_documents({"embedding": {"$exists": True, "$ne": None}})
-        
+        face_registered = count_rows(
+            supabase.table('students').select("id", count="exact").eq('face_registered', True)
+        )
+
         return jsonify({
             "success": True,
             "stats": {
@@ -624,6 +613,6 @@ def get_student_stats():
                 "by_year": year_stats
             }
         })
-        
+
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -1,9 +1,28 @@
-from flask import Blueprint, request, jsonify, current_app
-from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from datetime import datetime, timedelta
 import time
+from student.export_formats import iter_csv, iter_xlsx
+from student.aggregates import attendance_summary
+from student.queries import (
+    STUDENT_LIST_COLUMNS,
+    ATTENDANCE_LIST_COLUMNS,
+    page_params,
+    keyset_page,
+    iter_keyset,
+    apply_student_filters,
+    apply_day_filter,
+    attendance_day_stats,
+    count_rows
+)
+from teacher.attendance_summaries import attendance_summaries
 
 attendance_bp = Blueprint("attendance", __name__)
 
+EXPORT_HEADER = ["studentId", "name", "subject", "date", "status"]
+
+# student_id IN (...) lists go into the PostgREST URL; larger pages are looked up in chunks
+RECORD_LOOKUP_CHUNK = 200
+
 # ------------------------- GET ATTENDANCE -------------------------
 @attendance_bp.route('/api/attendance', methods=['GET'])
 def get_attendance():
@@ -16,32 +35,24 @@ def get_attendance():
     subject = request.args.get('subject')
     student_id = request.args.get('student_id')
 
+    # Keyset pagination over student_id: ?limit=<n>&cursor=<nextCursor of the previous page>
+    limit, cursor = page_params(request.args)
+
     try:
-        # Build filters for students query
-        student_query = supabase.table("students").select("*")
-        if department: 
-            student_query = student_query.eq("department", department)
-        if year: 
-            student_query = student_query.eq("year", year)
-        if division: 
-            student_query = student_query.eq("division", division)
-        if student_id: 
-            student_query = student_query.eq("student_id", student_id)
-
-        students_result = student_query.execute()
-        students = students_result.data if students_result.data else []
-
-        # Build filters for attendance query
-        attendance_query = supabase.table("attendance_records").select("*")
-        if date:
-            # Filter by date (attendance records have created_at field)
-            attendance_query = attendance_query.gte("created_at", f"{date}T00:00:00")
-            attendance_query = attendance_query.lt("created_at", f"{date}T23:59:59")
-        if student_id:
-            attendance_query = attendance_query.eq("student_id", student_id)
-
-        attendance_result = attendance_query.execute()
-        attendance_records = attendance_result.data if attendance_result.data else []
+        student_query = apply_student_filters(
+            supabase.table("students").select(STUDENT_LIST_COLUMNS),
+            department, year, division, student_id
+        )
+        students, next_cursor = keyset_page(student_query, "student_id", limit, cursor)
+
+        # Only the records of the students on this page, oldest first so the latest one wins
+        attendance_records = []
+        page_ids = [student.get("student_id") for student in students]
+        for start in range(0, len(page_ids), RECORD_LOOKUP_CHUNK):
+            attendance_query = apply_day_filter(
+                supabase.table("attendance_records").select(ATTENDANCE_LIST_COLUMNS), date
+            ).in_("student_id", page_ids[start:start + RECORD_LOOKUP_CHUNK]).order("id")
+            attendance_records.extend(attendance_query.execute().data or [])
 
         # Create a map of student_id -> attendance record
         attendance_map = {}
@@ -78,22 +89,32 @@ def get_attendance():
                 "confidence": attendance_record.get("confidence", 0) if attendance_record else 0
             })
 
-        # Calculate stats
-        total_students = len(students)
-        present_count = len([r for r in attendance_list if r.get("status") == "present"])
-        absent_count = total_students - present_count
-        attendance_rate = round((present_count / total_students * 100) if total_students > 0 else 0, 1)
-
-        return jsonify({
+        response = {
             "success": True,
             "attendance": attendance_list,
-            "stats": {
+            "nextCursor": next_cursor
+        }
+
+        # Stats cover every filtered student, not just this page (sent with the first page only)
+        if cursor is None:
+            if attendance_summaries.seeded and not student_id:
+                # Present count from the rollups; only the filtered student count is queried
+                total_students = count_rows(apply_student_filters(
+                    supabase.table("students").select("id", count="exact"), department, year, division
+                ))
+                present_count = min(attendance_summaries.latest_present(department, year, division, date), total_students)
+            else:
+                total_students, present_count = attendance_day_stats(supabase, date, department, year, division, student_id)
+            absent_count = total_students - present_count
+            attendance_rate = round((present_count / total_students * 100) if total_students > 0 else 0, 1)
+            response["stats"] = {
                 "totalStudents": total_students,
                 "presentToday": present_count,
                 "absentToday": absent_count,
                 "attendanceRate": attendance_rate
             }
-        })
+
+        return jsonify(response)
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -110,48 +131,81 @@ def export_attendance():
     division = request.args.get('division')
     subject = request.args.get('subject')
 
-    try:
-        # Build filters for students query
-        student_query = supabase.table("students").select("*")
-        if department: 
-            student_query = student_query.eq("department", department)
-        if year: 
-            student_query = student_query.eq("year", year)
-        if division: 
-            student_query = student_query.eq("division", division)
-
-        students_result = student_query.execute()
-        students = students_result.data if students_result.data else []
-
-        # Build filters for attendance query
-        attendance_query = supabase.table("attendance_records").select("*")
-        if date:
-            attendance_query = attendance_query.gte("created_at", f"{date}T00:00:00")
-            attendance_query = attendance_query.lt("created_at", f"{date}T23:59:59")
-
-        attendance_result = attendance_query.execute()
-        attendance_records = attendance_result.data if attendance_result.data else []
-
-        # Create a set of present student IDs
-        present_students = set()
-        for record in attendance_records:
-            if record.get("present"):
-                present_students.add(record.get("student_id"))
+    # json (default, same payload as before), csv or xlsx (streamed downloads)
+    export_format = (request.args.get('format') or 'json').lower()
 
-        # Build export data
-        export_data = []
-        for student in students:
-            sid = student.get("student_id")
-            status = "present" if sid in present_students else "absent"
-            export_data.append({
-                "studentId": str(sid),
-                "name": student.get("student_name"),
-                "subject": str(subject) if subject else "N/A",
-                "date": str(date) if date else "N/A",
-                "status": status
-            })
+    # Narrow projections, keyset-paged: never loads embeddings or a whole table at once
+    def student_query():
+        return apply_student_filters(supabase.table("students").select("student_id, student_name"),
+                                     department, year, division)
+
+    def attendance_query():
+        return apply_day_filter(supabase.table("attendance_records").select("id, student_id").eq("present", True), date)
 
+    try:
+        # Set of present student IDs (bounded by the number of students)
+        present_students = {record.get("student_id") for record in iter_keyset(attendance_query, "id")}
+
+        def export_rows():
+            for student in iter_keyset(student_query, "student_id"):
+                sid = student.get("student_id")
+                yield (
+                    str(sid),
+                    student.get("student_name"),
+                    str(subject) if subject else "N/A",
+                    str(date) if date else "N/A",
+                    "present" if sid in present_students else "absent"
+                )
+
+        filename = f"attendance_{date or 'export'}"
+        if export_format == "csv":
+            return Response(stream_with_context(iter_csv(EXPORT_HEADER, export_rows())), mimetype="text/csv",
+                            headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'})
+        if export_format == "xlsx":
+            return Response(stream_with_context(iter_xlsx(EXPORT_HEADER, export_rows())),
+                            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            headers={"Content-Disposition": f'attachment; filename="{filename}.xlsx"'})
+
+        export_data = [dict(zip(EXPORT_HEADER, row)) for row in export_rows()]
         return jsonify({"success": True, "data": export_data})
 
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ------------------------- DATE-RANGE SUMMARY -------------------------
+@attendance_bp.route('/api/attendance/summary', methods=['GET'])
+def attendance_range_summary():
+    supabase = current_app.config.get("SUPABASE")
+
+    # Defaults to the last 30 days
+    date_to = request.args.get('to') or datetime.now().strftime("%Y-%m-%d")
+    date_from = request.args.get('from')
+    try:
+        end = datetime.strptime(date_to, "%Y-%m-%d")
+        date_from = date_from or (end - timedelta(days=30)).strftime("%Y-%m-%d")
+        if datetime.strptime(date_from, "%Y-%m-%d") > end:
+            return jsonify({"success": False, "error": "'from' must not be after 'to'"}), 400
+    except ValueError:
+        return jsonify({"success": False, "error": "Dates must be YYYY-MM-DD"}), 400
+
+    try:
+        start = time.time()
+        summary, source = attendance_summary(
+            supabase, date_from, date_to,
+            department=request.args.get('department'),
+            year=request.args.get('year'),
+            division=request.args.get('division'),
+            subject=request.args.get('subject'),
+            student_id=request.args.get('student_id')
+        )
+        return jsonify({
+            "success": True,
+            "from": date_from,
+            "to": date_to,
+            **summary,
+            "source": source,
+            "query_time": round(time.time() - start, 3)
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
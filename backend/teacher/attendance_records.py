@@ -1,16 +1,23 @@
 # teacher/attendance_records.py - OPTIMIZED VERSION
 
-import io
-import base64
-import numpy as np
-from flask import Blueprint, request, jsonify, current_app
-from bson.objectid import ObjectId
+from flask import Blueprint, request, jsonify, current_app, Response
 from datetime import datetime, timedelta
-from PIL import Image
-from scipy.spatial.distance import cosine
-from deepface import DeepFace
 import logging
+import queue
+import threading
 import time
+import weakref
+from face_engine import IncrementalGalleryCache, GalleryPartitions
+from face_engine.embedding import embed_faces
+from face_engine.tracker import SessionTrackers
+from face_engine.uploads import request_fields, request_image, ImageUploadError
+from face_engine.decode import decode_frame
+from teacher.session_roster import (
+    session_roster, active_session_cache, roster_from_records, write_attendance_records, FINALIZED_SESSION_ERROR
+)
+from teacher.session_events import session_events, format_sse
+from teacher.attendance_summaries import attendance_summaries
+from student.queries import call_rpc, rpc_available
 
 logger = logging.getLogger(__name__)
 
@@ -23,20 +30,6 @@ attendance_session_bp = Blueprint(
 
 # ----------------- OPTIMIZED Helper Functions ----------------- #
 
-def read_image_from_base64_optimized(image_b64: str, target_size=(640, 480)):
-    """Convert base64 image to RGB numpy array with optimization"""
-    if image_b64.startswith("data:"):
-        image_b64 = image_b64.split(",", 1)[1]
-    
-    image_bytes = base64.b64decode(image_b64)
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    
-    # Resize large images to reduce processing time
-    if img.width > target_size[0] or img.height > target_size[1]:
-        img.thumbnail(target_size, Image.Resampling.LANCZOS)
-    
-    return np.array(img)
-
 def detect_faces_optimized(rgb_image, detector):
     """Detect faces using preloaded MTCNN detector"""
     # Skip detection if image is too small
@@ -60,119 +53,128 @@ def detect_faces_optimized(rgb_image, detector):
     
     return faces
 
-def extract_embedding_optimized(face_rgb):
-    """Extract embedding using preloaded DeepFace model"""
-    try:
-        if face_rgb.shape[0] < 40 or face_rgb.shape[1] < 40:
-            return None
-            
-        # Resize face to standard size
-        face_pil = Image.fromarray(face_rgb.astype("uint8")).resize((160, 160))
-        face_array = np.array(face_pil)
-        
-        # Use DeepFace with optimized parameters
-        rep = DeepFace.represent(
-            face_array, 
-            model_name="Facenet512", 
-            detector_backend="skip",
-            enforce_detection=False  # Skip additional detection for speed
-        )
-        return np.array(rep[0]["embedding"], dtype=np.float32)  # Use float32 for speed
-        
-    except Exception as e:
-        logger.error(f"Embedding extraction error: {e}")
-        return None
-
-def get_attendance_collection():
-    """Get the attendance collection from app config"""
-    return current_app.config.get("SUPABASE")
-
-# Enhanced embedding cache for attendance sessions
-class AttendanceEmbeddingCache:
+# Enhanced embedding cache for attendance sessions (one gallery per class filter,
+# kept current by registration/update events and background delta polls)
+class AttendanceEmbeddingCache(IncrementalGalleryCache):
     def __init__(self):
-        self.cached_embeddings = {}
-        self.last_update = {}
-        self.cache_duration = 600  # 10 minutes for attendance sessions
+        super().__init__(poll_interval=30, full_reload_interval=3600)
+        self.partitions = GalleryPartitions()
+        # session_id -> prefetch state; "pinned" holds (weakref to the gallery, class partition):
+        # the session keeps only its partition alive, and only until the session expires
+        self.session_galleries = {}
+        self.session_lock = threading.Lock()
+
+    def set_budget(self, max_bytes):
+        super().set_budget(max_bytes)
+        self.partitions.partitions.max_bytes = max_bytes
     
-    def get_session_embeddings(self, students_col, session_filter):
-        """Get cached embeddings for specific session filters"""
-        cache_key = str(sorted(session_filter.items()))
-        current_time = time.time()
-        
-        if (cache_key not in self.cached_embeddings or 
-            current_time - self.last_update.get(cache_key, 0) > self.cache_duration):
-            
-            logger.info(f"Refreshing attendance embedding cache for {session_filter}")
-            
-            # Fetch students matching the session filter
-            students = list(students_col.find(session_filter))
-            
-            # Process embeddings - handle both old and new embedding formats
-            session_embeddings = []
-            for student in students:
-                # Handle multiple embedding formats
-                embeddings = student.get('embeddings') or student.get('embedding')
-                if embeddings:
-                    if isinstance(embeddings, list) and len(embeddings) > 0:
-                        # Multiple embeddings - average them
-                        if isinstance(embeddings[0], list):
-                            avg_embedding = np.mean(embeddings, axis=0).astype(np.float32)
-                        else:
-                            avg_embedding = np.array(embeddings, dtype=np.float32)
-                    else:
-                        # Single embedding
-                        avg_embedding = np.array(embeddings, dtype=np.float32)
-                    
-                    session_embeddings.append({
-                        'embedding': avg_embedding,
-                        'studentId': student.get('studentId'),
-                        'studentName': student.get('studentName'),
-                        'department': student.get('department'),
-                        'year': student.get('year'),
-                        'division': student.get('division')
-                    })
-            
-            self.cached_embeddings[cache_key] = session_embeddings
-            self.last_update[cache_key] = current_time
-            logger.info(f"Cached {len(session_embeddings)} student embeddings for session")
-        
-        return self.cached_embeddings[cache_key]
+    def get_session_gallery(self, supabase, session_filter):
+        """Get the cached gallery for specific session filters"""
+        return self.get_gallery(
+            supabase,
+            session_filter,
+            index_config=current_app.config.get("GALLERY_INDEX_CONFIG")
+        )
+
+    def get_tiered_galleries(self, supabase, session_filter, session_id=None):
+        """(class partition, global gallery) - the partition is a cached view of the global one"""
+        gallery = self.get_session_gallery(supabase, {})
+        with self.session_lock:
+            self._drop_expired()
+            state = self.session_galleries.get(str(session_id))
+            pinned = state.get("pinned") if state else None
+        if pinned is not None and pinned[0]() is gallery:
+            return pinned[1], gallery
+
+        partition = self.partitions.get(gallery, session_filter)
+        if state is not None:
+            with self.session_lock:
+                state["pinned"] = (weakref.ref(gallery), partition)
+        return partition, gallery
+
+    def prefetch_session(self, supabase, session_id, session_filter, index_config=None, expires_at=None):
+        """Build the session's class partition in the background so its first frame finds it ready"""
+        session_id = str(session_id)
+        with self.session_lock:
+            self._drop_expired()
+            self.session_galleries[session_id] = {"ready": False, "pinned": None, "students": None,
+                                                  "load_time": None, "error": None, "expires_at": expires_at}
+        threading.Thread(
+            target=self._prefetch, args=(supabase, session_id, dict(session_filter), index_config),
+            name=f"gallery-prefetch-{session_id}", daemon=True
+        ).start()
+
+    def _drop_expired(self):
+        """Forget sessions whose time is up, also when no request ever ends or expires them (call with session_lock)"""
+        now_iso = datetime.now().isoformat()
+        for session_id in [sid for sid, state in self.session_galleries.items()
+                           if state.get("expires_at") and state["expires_at"] < now_iso]:
+            del self.session_galleries[session_id]
+
+    def _prefetch(self, supabase, session_id, session_filter, index_config):
+        start = time.time()
+        try:
+            # Same loads as a recognition request; a frame arriving meanwhile waits on them instead of repeating them
+            gallery = self.get_gallery(supabase, {}, index_config)
+            partition = self.partitions.get(gallery, session_filter)
+        except Exception as e:
+            logger.error(f"Gallery prefetch for session {session_id} failed: {e}")
+            with self.session_lock:
+                if session_id in self.session_galleries:
+                    self.session_galleries[session_id]["error"] = str(e)
+            return
+
+        load_time = time.time() - start
+        with self.session_lock:
+            state = self.session_galleries.get(session_id)
+            if state is None:
+                return  # session already ended
+            state.update(ready=True, students=len(partition), load_time=round(load_time, 3))
+            if state["pinned"] is None:
+                state["pinned"] = (weakref.ref(gallery), partition)
+        logger.info(f"🔥 Gallery for session {session_id} ready: {len(partition)} class students in {load_time:.2f}s")
+
+    def session_gallery_status(self, session_id):
+        """Readiness of the session's class gallery (None if it was never prefetched in this worker)"""
+        with self.session_lock:
+            self._drop_expired()
+            state = self.session_galleries.get(str(session_id))
+            if state is None:
+                return None
+            return {key: value for key, value in state.items() if key not in ("pinned", "expires_at")}
+
+    def release_session(self, session_id):
+        with self.session_lock:
+            self.session_galleries.pop(str(session_id), None)
 
 # Global cache instance for attendance
 attendance_cache = AttendanceEmbeddingCache()
 
-def find_best_match_optimized_attendance(query_embedding, students_col, session_doc, threshold=0.6):
-    """Optimized student matching for attendance with session-specific filtering"""
-    # Build filter for students in this session's class
-    student_filter = {"embeddings": {"$exists": True, "$ne": None}}
-    
-    # Add session-specific filters
-    if session_doc.get("department"):
-        student_filter["department"] = session_doc.get("department")
-    if session_doc.get("year"):
-        student_filter["year"] = session_doc.get("year")
-    if session_doc.get("division"):
-        student_filter["division"] = session_doc.get("division")
-    
-    # Get cached embeddings for this session
-    cached_embeddings = attendance_cache.get_session_embeddings(students_col, student_filter)
-    
-    if not cached_embeddings:
-        return None, float('inf')
-    
-    best_match = None
-    min_distance = float('inf')
-    
-    # Vectorized comparison for speed
-    for student_data in cached_embeddings:
-        stored_embedding = student_data['embedding']
-        distance = cosine(query_embedding, stored_embedding)
-        
-        if distance < min_distance:
-            min_distance = distance
-            best_match = student_data
-    
-    return best_match if min_distance < threshold else None, min_distance
+# Faces followed across the frames of each live session, so seated students
+# are not re-embedded on every frame
+session_trackers = SessionTrackers()
+
+def session_student_filter(session_doc):
+    """Class filter (department/year/division) for a session row"""
+    student_filter = {}
+    for key in ("department", "year", "division"):
+        if session_doc.get(key):
+            student_filter[key] = session_doc.get(key)
+    return student_filter
+
+def format_active_session(session):
+    """Session fields the student dashboards display"""
+    return {
+        "session_id": session['id'],
+        "date": session['date'],
+        "subject": session['subject'],
+        "department": session['department'],
+        "year": session['year'],
+        "division": session['division'],
+        "duration_minutes": session['duration_minutes'],
+        "expires_at": session['expires_at'],
+        "created_at": session['created_at']
+    }
 
 # ----------------- OPTIMIZED Routes ----------------- #
 
@@ -242,18 +244,62 @@ def create_session():
         # Insert session into Supabase attendance_sessions table
         response = supabase.table('attendance_sessions').insert(session_doc).execute()
         session_id = response.data[0]['id']
+        active_session_cache.invalidate()
+        attendance_summaries.session_started({**session_doc, "id": session_id})
+        attendance_cache.prefetch_session(
+            supabase, session_id, student_filter, current_app.config.get("GALLERY_INDEX_CONFIG"),
+            expires_at=session_doc["expires_at"]
+        )
+        session_events.publish("session_created", format_active_session({**session_doc, "id": session_id}))
         
         # return expires_at as ISO string for frontend timers
         return jsonify({
             "session_id": str(session_id),
             "students_count": len(session_doc["students"]),
             "duration_minutes": duration_minutes,
-            "expires_at": session_doc["expires_at"]
+            "expires_at": session_doc["expires_at"],
+            "gallery_ready": attendance_cache.session_gallery_status(session_id)["ready"]
         })
     except Exception as e:
         logger.error(f"Error creating session in Supabase: {e}")
         return jsonify({"error": "Failed to create session"}), 500
 
+def finalize_session_bulk(supabase, session_id, absent_rows, roster, ended_at):
+    """
+    Write all absentee records plus the final roster and finalized flag.
+    One RPC round trip when finalize_attendance_session exists (see
+    SUPABASE_RPC_FUNCTIONS.txt), otherwise one batched records write and one
+    update. Both paths are idempotent; returns "already_finalized" when
+    another end_session (or expiry) finalized the session first.
+    """
+    # Errors other than a missing function are raised: a timeout may fire after the commit
+    absent_count = call_rpc(supabase, 'finalize_attendance_session', {
+        "p_session_id": int(session_id),
+        "p_absent": absent_rows,
+        "p_students": roster,
+        "p_ended_at": ended_at
+    }, strict=True)
+    if absent_count is not None:
+        return "rpc"
+    if rpc_available('finalize_attendance_session'):
+        # The function ran and returned NULL: the session was already finalized
+        return "already_finalized"
+
+    try:
+        # A record that already exists (present or absent) is left alone
+        write_attendance_records(supabase, session_id, [
+            {**row, "session_id": session_id, "present": False, "marked_at": None}
+            for row in absent_rows
+        ])
+    except Exception as e:
+        if FINALIZED_SESSION_ERROR in str(e):
+            return "already_finalized"
+        raise
+    claimed = supabase.table('attendance_sessions').update(
+        {"students": roster, "finalized": True, "ended_at": ended_at}
+    ).eq('id', session_id).eq('finalized', False).execute()
+    return "batched" if claimed.data else "already_finalized"
+
 @attendance_session_bp.route("/end_session", methods=["POST"])
 def end_session():
     """Finalize an attendance session with enhanced logging"""
@@ -263,77 +309,249 @@ def end_session():
         return jsonify({"error": "Missing session_id"}), 400
 
     try:
-        collection = get_attendance_collection()
-        db = current_app.config.get("DB")
-        students_col = db.students
-
-        session_doc = collection.find_one({"_id": ObjectId(session_id)})
-        if not session_doc:
+        # Persist every queued mark before finalizing; a failed flush aborts the end
+        session_roster.close(session_id)
+        finalize_start = time.time()
+        supabase = current_app.config.get("SUPABASE")
+
+        session_response = supabase.table('attendance_sessions').select(
+            'id, date, subject, department, year, division, finalized, students'
+        ).eq('id', session_id).execute()
+        if not session_response.data:
             return jsonify({"error": "Session not found"}), 404
+        session_doc = session_response.data[0]
 
-        # Build set of present student ids
-        present_students = set(
-            s.get("student_id") for s in session_doc.get("students", []) 
-            if s.get("present")
-        )
+        # The roster JSON is not written during the session: rebuild it from the persisted records
+        records_response = supabase.table('attendance_records').select(
+            'student_id, student_name, present, marked_at'
+        ).eq('session_id', session_id).execute()
+        records = records_response.data or []
+        recorded = {r["student_id"]: r.get("present") for r in records}
+        roster = roster_from_records(session_doc.get("students"), records)
+        present_students = {s.get("student_id") for s in roster if s.get("present")}
+
+        if session_doc.get("finalized"):
+            return jsonify({
+                "success": True,
+                "already_finalized": True,
+                "statistics": {
+                    "present_count": len(present_students),
+                    "absent_count": sum(1 for present in recorded.values() if not present),
+                    "total_students": len(recorded)
+                }
+            })
 
-        # Get all students in that class
-        student_filter = {}
-        if session_doc.get("department"): student_filter["department"] = session_doc.get("department")
-        if session_doc.get("year"): student_filter["year"] = session_doc.get("year")
-        if session_doc.get("division"): student_filter["division"] = session_doc.get("division")
+        # Get all students in that class in one query
+        student_filter = session_student_filter(session_doc)
+        all_students = []
+        if student_filter:
+            query = supabase.table('students').select('student_id, student_name')
+            for key, value in student_filter.items():
+                query = query.eq(key, value)
+            all_students = query.execute().data or []
 
-        all_students = list(students_col.find(student_filter)) if student_filter else []
-        
-        # Mark absent students
-        absent_count = 0
+        # Compute the absent set in memory
+        roster_index = {s.get("student_id"): s for s in roster}
+        absent_rows = []
         for s in all_students:
-            sid = s.get("studentId") or s.get("student_id")
-            sname = s.get("studentName") or s.get("student_name")
-            
-            if sid not in present_students:
-                # Update existing entry or create new absent entry
-                updated = collection.update_one(
-                    {"_id": ObjectId(session_id), "students.student_id": sid},
-                    {"$set": {"students.$.present": False, "students.$.marked_at": None}}
-                )
-                
-                if updated.matched_count == 0:
-                    # No existing entry, add new absent entry
-                    collection.update_one(
-                        {"_id": ObjectId(session_id)},
-                        {"$push": {
-                            "students": {
-                                "student_id": sid, 
-                                "student_name": sname, 
-                                "present": False, 
-                                "marked_at": None
-                            }
-                        }}
-                    )
-                absent_count += 1
-
-        # Mark session as finalized
-        collection.update_one(
-            {"_id": ObjectId(session_id)}, 
-            {"$set": {"finalized": True, "ended_at": datetime.now()}}
+            sid, sname = s.get("student_id"), s.get("student_name")
+            if sid in present_students:
+                continue
+            entry = roster_index.get(sid)
+            if entry is None:
+                entry = roster_index[sid] = {"student_id": sid, "student_name": sname}
+                roster.append(entry)
+            entry["present"] = False
+            entry["marked_at"] = None
+            if sid not in recorded:
+                absent_rows.append({"student_id": sid, "student_name": sname})
+
+        # Write all absentees and the finalized flag together
+        write_path = finalize_session_bulk(supabase, session_id, absent_rows, roster, datetime.now().isoformat())
+        active_session_cache.invalidate()
+        if write_path == "already_finalized":
+            # A concurrent end_session got there first and reported the statistics
+            return jsonify({"success": True, "already_finalized": True})
+        absent_count = sum(1 for s in all_students if s.get("student_id") not in present_students)
+        # Students marked from outside the class count too, as in session_attendance
+        total_students = len(present_students) + absent_count
+        attendance_summaries.session_finalized(
+            session_doc, absent_ids=[row["student_id"] for row in absent_rows], total=total_students or None
         )
+        session_events.publish("session_finalized", {"session_id": session_id})
+        session_trackers.drop(session_id)
+        attendance_cache.release_session(session_id)
+        finalization_time = time.time() - finalize_start
 
-        logger.info(f"Session finalized: {len(present_students)} present, {absent_count} absent")
+        logger.info(f"Session finalized: {len(present_students)} present, {absent_count} absent "
+                    f"({write_path}, {finalization_time:.3f}s)")
 
         return jsonify({
             "success": True,
             "statistics": {
                 "present_count": len(present_students),
                 "absent_count": absent_count,
-                "total_students": len(all_students)
-            }
+                "total_students": total_students
+            },
+            "finalization_time": round(finalization_time, 3),
+            "write_path": write_path
         })
 
     except Exception as e:
         logger.error(f"Error ending session: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+def recognize_session_frame(model_manager, supabase, session, faces, threshold):
+    """
+    Identify the detected faces of one frame and mark recognized students in
+    the session roster. Returns (results, info); shared by real-mark and the
+    WebSocket recognition channel.
+    """
+    session_id = session.session_id
+
+    # The session's class first, then every student for faces the class did not resolve
+    class_gallery, gallery = attendance_cache.get_tiered_galleries(
+        supabase, session_student_filter(session.row), session_id
+    )
+
+    # Follow faces from the previous frames; confirmed tracks keep their identity
+    tracker = session_trackers.get(session_id)
+    tracks = tracker.assign([f["box"] for f in faces])
+    to_embed = [i for i, track in enumerate(tracks) if tracker.needs_embedding(track)]
+
+    # One batched forward pass for the new/unconfirmed faces only
+    valid = [True] * len(faces)
+    embedded_idx = []
+    embedding_time = 0.0
+    if to_embed:
+        face_embeddings, embedded_valid, embedding_time = embed_faces(
+            model_manager, [faces[i]["face"] for i in to_embed], min_size=40
+        )
+        for row, i in enumerate(to_embed):
+            valid[i] = bool(embedded_valid[row])
+        embedded_idx = [i for i in to_embed if valid[i]]
+        face_embeddings = face_embeddings[embedded_valid]
+    
+    # Match the embedded faces with one matrix multiply per tier
+    matches = {}
+    tier_of = {}
+    if embedded_idx and len(class_gallery):
+        for i, match in zip(embedded_idx, class_gallery.match(face_embeddings, threshold)):
+            matches[i] = match
+            if match[0] is not None:
+                tier_of[i] = "class"
+    unresolved = [row for row, i in enumerate(embedded_idx) if i not in tier_of]
+    if unresolved and class_gallery is not gallery and len(gallery):
+        for row, match in zip(unresolved, gallery.match(face_embeddings[unresolved], threshold)):
+            i = embedded_idx[row]
+            if match[0] is not None or i not in matches:
+                matches[i] = match
+            if match[0] is not None:
+                tier_of[i] = "global"
+    for i in embedded_idx:
+        best, min_d, _ = matches.get(i, (None, float("inf"), []))
+        tracker.observe(tracks[i], best, min_d)
+    for i in range(len(faces)):
+        if i not in to_embed:
+            matches[i] = (tracks[i].student, tracks[i].distance, [])
+            tier_of[i] = "tracked"
+    results = []
+
+    for i, f in enumerate(faces):
+        if not valid[i]:
+            results.append({
+                "match": None, 
+                "distance": None, 
+                "box": f["box"],
+                "error": "Failed to extract embedding"
+            })
+            continue
+
+        best, min_d, _ = matches.get(i, (None, float("inf"), []))
+
+        if min_d < threshold and best:
+            student_id = best.get("studentId")
+            student_name = best.get("studentName")
+
+            # CHECK FOR DUPLICATE AND MARK in the in-memory roster; the
+            # record is written to Supabase by the write-behind flusher
+            status, _ = session.mark_present(student_id, student_name)
+            if status == "duplicate":
+                # Student already marked present in this session
+                results.append({
+                    "match": {"user_id": student_id, "name": student_name},
+                    "distance": round(float(min_d), 4),
+                    "confidence": round((1 - min_d) * 100, 1),
+                    "box": f["box"],
+                    "track_id": tracks[i].track_id,
+                    "tracked": i not in to_embed,
+                    "tier": tier_of.get(i),
+                    "already_marked": True,
+                    "status": "duplicate",
+                    "message": f"{student_name} is already marked present in this session"
+                })
+                logger.info(f"Duplicate detection: {student_name} ({student_id}) already present")
+                continue
+
+            added = status == "marked_present_new"
+            results.append({
+                "match": {"user_id": student_id, "name": student_name},
+                "distance": round(float(min_d), 4),
+                "confidence": round((1 - min_d) * 100, 1),
+                "box": f["box"],
+                "track_id": tracks[i].track_id,
+                "tier": tier_of.get(i),
+                "already_marked": False,
+                "status": status,
+                "message": f"{student_name} added to session and marked present" if added
+                           else f"{student_name} marked present successfully"
+            })
+            logger.info(f"✅ {'Added' if added else 'Marked'} {student_name} ({student_id}) as present")
+
+        else:
+            # No match found
+            results.append({
+                "match": None, 
+                "distance": round(float(min_d), 4) if min_d != float('inf') else None,
+                "confidence": round((1 - min_d) * 100, 1) if min_d != float('inf') else None,
+                "box": f["box"],
+                "track_id": tracks[i].track_id,
+                "status": "no_match",
+                "message": "Face not recognized"
+            })
+
+    info = {
+        "embedding_time": embedding_time,
+        "faces_embedded": len(to_embed),
+        "faces_tracked": len(faces) - len(to_embed),
+        "tiers": {
+            "class_partition_size": len(class_gallery),
+            "global_size": len(gallery),
+            "resolved_tracked": sum(1 for t in tier_of.values() if t == "tracked"),
+            "resolved_class": sum(1 for t in tier_of.values() if t == "class"),
+            "resolved_global": sum(1 for t in tier_of.values() if t == "global"),
+            "global_searches": len(unresolved) if class_gallery is not gallery else 0
+        }
+    }
+    return results, info
+
+def expire_session(supabase, session_id, session):
+    """Auto-finalize a session whose duration is over"""
+    session_roster.close(session_id)
+    records = supabase.table('attendance_records').select(
+        'student_id, student_name, present, marked_at'
+    ).eq('session_id', session_id).execute().data or []
+    supabase.table('attendance_sessions').update({
+        "finalized": True,
+        "ended_at": datetime.now().isoformat(),
+        "students": roster_from_records(session.row.get("students"), records)
+    }).eq('id', session_id).eq('finalized', False).execute()
+    active_session_cache.invalidate()
+    attendance_summaries.session_finalized(session.row)
+    session_events.publish("session_finalized", {"session_id": session_id, "reason": "expired"})
+    attendance_cache.release_session(session_id)
+    logger.info(f"Session {session_id} expired at {session.expires_at}, auto-finalized")
+
 @attendance_session_bp.route("/real-mark", methods=["POST"])
 def mark_attendance_with_duplicate_prevention():
     """Attendance marking with enhanced duplicate prevention"""
@@ -346,162 +564,49 @@ def mark_attendance_with_duplicate_prevention():
     
     detector = model_manager.get_detector()
     
-    data = request.get_json()
+    # Multipart / raw JPEG uploads, base64 JSON as fallback
+    data = request_fields()
     session_id = data.get("session_id")
-    image_b64 = data.get("image")
+    try:
+        image_stream = request_image("image", data)
+    except ImageUploadError:
+        image_stream = None
 
-    if not session_id or not image_b64:
+    if not session_id or image_stream is None:
         return jsonify({"error": "Missing session_id or image"}), 400
 
     try:
-        # Use same image processing as demo
-        rgb = read_image_from_base64_optimized(image_b64)
-        faces = detect_faces_optimized(rgb, detector)
+        # Same image processing as demo: decode straight to detection size; crops come from a sharper decode later
+        frame = decode_frame(image_stream)
+        faces = frame.attach_crops(detect_faces_optimized(frame.rgb, detector))
 
         if len(faces) == 0:
-            return jsonify({"message": "No faces detected", "faces": []})
+            return jsonify({"message": "No faces detected", "faces": [], "prefilter": detector.last_stats()})
 
-        # Validate session
-        collection = get_attendance_collection()
-        session_doc = collection.find_one({"_id": ObjectId(session_id)})
-        if not session_doc:
+        # Validate session against the in-memory roster (loaded once per session)
+        supabase = current_app.config.get("SUPABASE")
+        session = session_roster.get(supabase, session_id)
+        if session is None:
             return jsonify({"error": "Session not found"}), 404
 
         # Check if session already finalized
-        if session_doc.get("finalized"):
+        if session.finalized:
             return jsonify({"error": "Session already finalized"}), 400
 
         # Check if session has expired based on duration
-        expires_at = session_doc.get("expires_at")
-        if expires_at:
-            # expires_at stored as datetime in MongoDB
-            now = datetime.now()
-            if now > expires_at:
-                # finalize session and return expired message
-                collection.update_one({"_id": ObjectId(session_id)}, {"$set": {"finalized": True, "ended_at": now}})
-                logger.info(f"Session {session_id} expired at {expires_at}, auto-finalized")
-                return jsonify({"error": "Session expired"}), 400
-
-        # GET LIST OF ALREADY MARKED STUDENTS IN THIS SESSION
-        already_present_students = set()
-        for student_entry in session_doc.get("students", []):
-            if student_entry.get("present") == True:
-                already_present_students.add(student_entry.get("student_id"))
+        if session.is_expired():
+            # finalize session and return expired message
+            expire_session(supabase, session_id, session)
+            return jsonify({"error": "Session expired"}), 400
+
+        # Students already marked present in this session (answered locally)
+        already_present_students = session.present
         
         logger.info(f"Session {session_id} already has {len(already_present_students)} students marked present")
 
         # Recognition logic (same as demo session)
-        db = current_app.config.get("DB")
-        students_col = db.students
         threshold = float(current_app.config.get("THRESHOLD", 0.6))
-        
-        # Search ALL students (same as demo session)
-        students = list(students_col.find({"embeddings": {"$exists": True, "$ne": None}}))
-        results = []
-
-        for f in faces:
-            emb = extract_embedding_optimized(f["face"])
-            if emb is None:
-                results.append({
-                    "match": None, 
-                    "distance": None, 
-                    "box": f["box"],
-                    "error": "Failed to extract embedding"
-                })
-                continue
-
-            # EXACT SAME MATCHING LOGIC AS DEMO SESSION
-            best, min_d = None, float("inf")
-            for student in students:
-                stored_embeddings = student.get("embeddings", [])
-                if not stored_embeddings:
-                    continue
-                
-                # Average multiple embeddings
-                if isinstance(stored_embeddings, list) and len(stored_embeddings) > 0:
-                    avg_embedding = np.mean(stored_embeddings, axis=0)
-                else:
-                    avg_embedding = np.array(stored_embeddings)
-                
-                d = cosine(emb, avg_embedding)
-                if d < min_d:
-                    min_d = d
-                    best = student
-
-            if min_d < threshold and best:
-                student_id = best.get("studentId")
-                student_name = best.get("studentName")
-
-                # CHECK FOR DUPLICATE BEFORE MARKING
-                if student_id in already_present_students:
-                    # Student already marked present in this session
-                    results.append({
-                        "match": {"user_id": student_id, "name": student_name},
-                        "distance": round(float(min_d), 4),
-                        "confidence": round((1 - min_d) * 100, 1),
-                        "box": f["box"],
-                        "already_marked": True,
-                        "status": "duplicate",
-                        "message": f"{student_name} is already marked present in this session"
-                    })
-                    logger.info(f"Duplicate detection: {student_name} ({student_id}) already present")
-                    continue
-
-                # MARK ATTENDANCE (Student not yet marked)
-                updated = collection.update_one(
-                    {"_id": ObjectId(session_id), "students.student_id": student_id, "students.present": False},
-                    {"$set": {"students.$.present": True, "students.$.marked_at": datetime.now()}}
-                )
-
-                if updated.matched_count > 0 and updated.modified_count > 0:
-                    # Successfully marked present
-                    already_present_students.add(student_id)  # Update our local set
-                    results.append({
-                        "match": {"user_id": student_id, "name": student_name},
-                        "distance": round(float(min_d), 4),
-                        "confidence": round((1 - min_d) * 100, 1),
-                        "box": f["box"],
-                        "already_marked": False,
-                        "status": "marked_present",
-                        "message": f"{student_name} marked present successfully"
-                    })
-                    logger.info(f"✅ Marked {student_name} ({student_id}) as present")
-                
-                else:
-                    # Student entry doesn't exist, create new one
-                    collection.update_one(
-                        {"_id": ObjectId(session_id)},
-                        {"$push": {
-                            "students": {
-                                "student_id": student_id,
-                                "student_name": student_name,
-                                "present": True,
-                                "marked_at": datetime.now()
-                            }
-                        }}
-                    )
-                    already_present_students.add(student_id)  # Update our local set
-                    results.append({
-                        "match": {"user_id": student_id, "name": student_name},
-                        "distance": round(float(min_d), 4),
-                        "confidence": round((1 - min_d) * 100, 1),
-                        "box": f["box"],
-                        "already_marked": False,
-                        "status": "marked_present_new",
-                        "message": f"{student_name} added to session and marked present"
-                    })
-                    logger.info(f"✅ Added {student_name} ({student_id}) to session as present")
-
-            else:
-                # No match found
-                results.append({
-                    "match": None, 
-                    "distance": round(float(min_d), 4) if min_d != float('inf') else None,
-                    "confidence": round((1 - min_d) * 100, 1) if min_d != float('inf') else None,
-                    "box": f["box"],
-                    "status": "no_match",
-                    "message": "Face not recognized"
-                })
+        results, info = recognize_session_frame(model_manager, supabase, session, faces, threshold)
 
         processing_time = time.time() - start_time
         
@@ -510,10 +615,15 @@ def mark_attendance_with_duplicate_prevention():
             "message": "Recognition processed", 
             "faces": results, 
             "processing_time": round(processing_time, 3),
+            "embedding_time": round(info["embedding_time"], 3),
+            "prefilter": detector.last_stats(),
             "session_info": {
                 "session_id": session_id,
                 "total_present_now": len(already_present_students),
                 "faces_detected": len(faces),
+                "faces_embedded": info["faces_embedded"],
+                "faces_tracked": info["faces_tracked"],
+                "tiers": info["tiers"],
                 "duplicates_prevented": sum(1 for r in results if r.get("status") == "duplicate")
             }
         })
@@ -522,84 +632,6 @@ def mark_attendance_with_duplicate_prevention():
         logger.error(f"Attendance error: {e}")
         return jsonify({"error": str(e)}), 500
 
-    """Finalize an attendance session with enhanced logging"""
-    data = request.get_json()
-    session_id = data.get("session_id")
-    if not session_id:
-        return jsonify({"error": "Missing session_id"}), 400
-
-    try:
-        collection = get_attendance_collection()
-        db = current_app.config.get("DB")
-        students_col = db.students
-
-        session_doc = collection.find_one({"_id": ObjectId(session_id)})
-        if not session_doc:
-            return jsonify({"error": "Session not found"}), 404
-
-        # Build set of present student ids
-        present_students = set(
-            s.get("student_id") for s in session_doc.get("students", []) 
-            if s.get("present")
-        )
-
-        # Get all students in that class
-        student_filter = {}
-        if session_doc.get("department"): student_filter["department"] = session_doc.get("department")
-        if session_doc.get("year"): student_filter["year"] = session_doc.get("year")
-        if session_doc.get("division"): student_filter["division"] = session_doc.get("division")
-
-        all_students = list(students_col.find(student_filter)) if student_filter else []
-        
-        # Mark absent students
-        absent_count = 0
-        for s in all_students:
-            sid = s.get("studentId") or s.get("student_id")
-            sname = s.get("studentName") or s.get("student_name")
-            
-            if sid not in present_students:
-                # Update existing entry or create new absent entry
-                updated = collection.update_one(
-                    {"_id": ObjectId(session_id), "students.student_id": sid},
-                    {"$set": {"students.$.present": False, "students.$.marked_at": None}}
-                )
-                
-                if updated.matched_count == 0:
-                    # No existing entry, add new absent entry
-                    collection.update_one(
-                        {"_id": ObjectId(session_id)},
-                        {"$push": {
-                            "students": {
-                                "student_id": sid, 
-                                "student_name": sname, 
-                                "present": False, 
-                                "marked_at": None
-                            }
-                        }}
-                    )
-                absent_count += 1
-
-        # Mark session as finalized
-        collection.update_one(
-            {"_id": ObjectId(session_id)}, 
-            {"$set": {"finalized": True, "ended_at": datetime.now()}}
-        )
-
-        logger.info(f"Session finalized: {len(present_students)} present, {absent_count} absent")
-
-        return jsonify({
-            "success": True,
-            "statistics": {
-                "present_count": len(present_students),
-                "absent_count": absent_count,
-                "total_students": len(all_students)
-            }
-        })
-
-    except Exception as e:
-        logger.error(f"Error ending session: {e}")
-        return jsonify({"success": False, "error": str(e)}), 500
-
 # Get active sessions for students
 @attendance_session_bp.route("/active_sessions", methods=["GET"])
 def get_active_sessions():
@@ -607,27 +639,11 @@ def get_active_sessions():
     supabase = current_app.config.get("SUPABASE")
     
     try:
-        # Get current time
-        current_time = datetime.now().isoformat()
-        
-        # Fetch active sessions that haven't expired and aren't finalized
-        response = supabase.table('attendance_sessions').select('*').eq('finalized', False).gt('expires_at', current_time).execute()
-        sessions = response.data
+        # Active sessions that haven't expired and aren't finalized (shared cache, one query per TTL)
+        sessions = active_session_cache.get(supabase)
         
         # Format sessions for frontend
-        active_sessions = []
-        for session in sessions:
-            active_sessions.append({
-                "session_id": session['id'],
-                "date": session['date'],
-                "subject": session['subject'],
-                "department": session['department'],
-                "year": session['year'],
-                "division": session['division'],
-                "duration_minutes": session['duration_minutes'],
-                "expires_at": session['expires_at'],
-                "created_at": session['created_at']
-            })
+        active_sessions = [format_active_session(session) for session in sessions]
         
         return jsonify({
             "success": True,
@@ -639,6 +655,67 @@ def get_active_sessions():
         logger.error(f"Error fetching active sessions: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+# Live feed of session changes and mark confirmations (replaces dashboard polling)
+@attendance_session_bp.route("/events", methods=["GET"])
+def session_event_stream():
+    """Server-Sent Events: active-session snapshot, then created/finalized/expired and mark events"""
+    supabase = current_app.config.get("SUPABASE")
+    subscription = session_events.subscribe(
+        student_id=request.args.get("student_id"),
+        session_id=request.args.get("session_id")
+    )
+    if subscription is None:
+        # Every stream holds a worker thread; past the cap, keep the threads for recognition
+        return jsonify({"success": False, "error": "Too many open event streams, poll instead"}), 503, {"Retry-After": "30"}
+    # Streams end after this long and the browser reconnects, so held threads turn over
+    max_seconds = current_app.config.get("SSE_STREAM_SECONDS", 300)
+    try:
+        sessions = [format_active_session(s) for s in active_session_cache.get(supabase)]
+    except Exception as e:
+        session_events.unsubscribe(subscription)
+        logger.error(f"Error opening session event stream: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    def stream():
+        # Expiry is detected here from expires_at, so it costs no query or publisher
+        expiring = {str(s["session_id"]): s["expires_at"] for s in sessions}
+        opened = last_sent = time.time()
+        try:
+            yield format_sse("snapshot", {"active_sessions": sessions})
+            while time.time() - opened < max_seconds:
+                try:
+                    event = subscription.events.get(timeout=1.0)
+                except queue.Empty:
+                    event = None
+
+                if event is not None:
+                    data = event["data"]
+                    if event["type"] == "session_created":
+                        expiring[str(data["session_id"])] = data.get("expires_at")
+                    elif event["type"] == "session_finalized":
+                        expiring.pop(str(data["session_id"]), None)
+                    last_sent = time.time()
+                    yield format_sse(event["type"], data)
+
+                now_iso = datetime.now().isoformat()
+                for sid, expires_at in list(expiring.items()):
+                    if expires_at and expires_at <= now_iso:
+                        del expiring[sid]
+                        last_sent = time.time()
+                        yield format_sse("session_expired", {"session_id": sid})
+
+                if time.time() - last_sent > 15:
+                    # Comment line keeps proxies from closing an idle stream
+                    last_sent = time.time()
+                    yield ": keep-alive\n\n"
+        finally:
+            session_events.unsubscribe(subscription)
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 # Mark attendance for a student in a session
 @attendance_session_bp.route("/mark_attendance", methods=["POST"])
 def mark_attendance():
@@ -654,44 +731,16 @@ def mark_attendance():
         return jsonify({"success": False, "error": "Missing required fields"}), 400
     
     try:
-        # Check if session exists and is active
-        current_time = datetime.now().isoformat()
-        session_response = supabase.table('attendance_sessions').select('*').eq('id', session_id).eq('finalized', False).gt('expires_at', current_time).execute()
-        
-        if not session_response.data:
+        # Check if session exists and is active (in-memory roster, loaded once)
+        session = session_roster.get(supabase, session_id)
+        if session is None or not session.is_active():
             return jsonify({"success": False, "error": "Session not found or expired"}), 404
         
-        session = session_response.data[0]
-        
-        # Check if student is already marked present
-        existing_record = supabase.table('attendance_records').select('*').eq('session_id', session_id).eq('student_id', student_id).execute()
-        
-        if existing_record.data:
+        # Duplicate check and mark answered locally; persisted by the write-behind flusher
+        status, _ = session.mark_present(student_id, student_name)
+        if status == "duplicate":
             return jsonify({"success": False, "error": "Attendance already marked for this student"}), 400
         
-        # Create attendance record
-        attendance_record = {
-            "session_id": session_id,
-            "student_id": student_id,
-            "student_name": student_name,
-            "present": True,
-            "marked_at": datetime.now().isoformat()
-        }
-        
-        # Insert attendance record
-        supabase.table('attendance_records').insert(attendance_record).execute()
-        
-        # Update session's students array to mark as present
-        students = session.get('students', [])
-        for student in students:
-            if student.get('student_id') == student_id:
-                student['present'] = True
-                student['marked_at'] = datetime.now().isoformat()
-                break
-        
-        # Update session with modified students array
-        supabase.table('attendance_sessions').update({"students": students}).eq('id', session_id).execute()
-        
         return jsonify({
             "success": True,
             "message": "Attendance marked successfully",
@@ -711,33 +760,30 @@ def check_student_attendance(student_id):
     supabase = current_app.config.get("SUPABASE")
     
     try:
-        # Get current time
-        current_time = datetime.now().isoformat()
-        
-        # Check for attendance records in active sessions
-        attendance_response = supabase.table('attendance_records').select('session_id').eq('student_id', student_id).execute()
-        
-        if attendance_response.data:
-            # Get session IDs where student has marked attendance
-            marked_session_ids = [record['session_id'] for record in attendance_response.data]
-            
-            # Check if any of these sessions are still active
-            active_marked_sessions = []
-            for session_id in marked_session_ids:
-                session_response = supabase.table('attendance_sessions').select('*').eq('id', session_id).eq('finalized', False).gt('expires_at', current_time).execute()
-                if session_response.data:
-                    active_marked_sessions.append(session_response.data[0])
-            
-            return jsonify({
-                "success": True,
-                "has_marked_attendance": len(active_marked_sessions) > 0,
-                "marked_sessions": active_marked_sessions
-            })
+        # Currently active sessions come from the shared cache, not a per-poll query
+        sessions = {str(s["id"]): s for s in active_session_cache.get(supabase)}
+        marked_ids = set()
+        
+        # Sessions live in this process answer from the in-memory roster
+        unknown_ids = []
+        for session_id in sessions:
+            roster = session_roster.peek(session_id)
+            if roster is None:
+                unknown_ids.append(session_id)
+            elif roster.is_present(student_id):
+                marked_ids.add(session_id)
+        
+        # Everything else: one query restricted to the active session ids
+        if unknown_ids:
+            attendance_response = supabase.table('attendance_records').select('session_id').eq('student_id', student_id).in_('session_id', unknown_ids).execute()
+            marked_ids.update(str(record['session_id']) for record in attendance_response.data or [])
+        
+        active_marked_sessions = [{**sessions[sid], "session_id": sessions[sid]["id"]} for sid in sessions if sid in marked_ids]
         
         return jsonify({
             "success": True,
-            "has_marked_attendance": False,
-            "marked_sessions": []
+            "has_marked_attendance": len(active_marked_sessions) > 0,
+            "marked_sessions": active_marked_sessions
         })
         
     except Exception as e:
@@ -763,9 +809,9 @@ def get_session_attendance(session_id):
         attendance_response = supabase.table('attendance_records').select('*').eq('session_id', session_id).execute()
         attendance_records = attendance_response.data
         
-        # Count present and total students
-        total_students = len(session.get('students', []))
-        present_count = len(attendance_records)
+        # Counted from this session's records (absentee records written at finalization are not present)
+        present_count = sum(1 for r in attendance_records or [] if r.get("present"))
+        total_students = max(len(session.get('students') or []), len(attendance_records or []))
         
         return jsonify({
             "success": True,
@@ -793,6 +839,53 @@ def get_session_attendance(session_id):
         logger.error(f"Error fetching session attendance: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+# Whether the session's class gallery is loaded (recognition frames will not wait on it)
+@attendance_session_bp.route("/session_gallery/<session_id>", methods=["GET"])
+def get_session_gallery_status(session_id):
+    """Prefetch state of a session's class gallery in this worker"""
+    status = attendance_cache.session_gallery_status(session_id)
+    if status is None:
+        # Created by another worker (or before a restart): loaded on this worker's first frame
+        status = {"ready": False, "prefetched": False}
+    else:
+        status["prefetched"] = True
+    return jsonify({"success": True, "session_id": session_id, **status})
+
+# Attendance stats served from the in-process rollups (no record scans)
+@attendance_session_bp.route("/stats", methods=["GET"])
+def get_attendance_stats():
+    """?session_id=... | ?student_id=... | ?department=&year=&division=&date=..."""
+    if not attendance_summaries.seeded:
+        # Seeded by a background thread at startup; never scanned inside a request
+        response = jsonify({"success": False, "error": "Attendance summaries are still loading"})
+        response.headers["Retry-After"] = str(attendance_summaries.refresh_interval)
+        return response, 503
+    try:
+        if request.args.get("session_id"):
+            summary = attendance_summaries.session_summary(request.args["session_id"])
+            if summary is None:
+                return jsonify({"success": False, "error": "Session not found"}), 404
+            return jsonify({"success": True, "scope": "session", "statistics": summary})
+        if request.args.get("student_id"):
+            return jsonify({
+                "success": True,
+                "scope": "student",
+                "statistics": attendance_summaries.student_summary(request.args["student_id"])
+            })
+        return jsonify({
+            "success": True,
+            "scope": "class",
+            "statistics": attendance_summaries.class_summary(
+                department=request.args.get("department"),
+                year=request.args.get("year"),
+                division=request.args.get("division"),
+                date=request.args.get("date")
+            )
+        })
+    except Exception as e:
+        logger.error(f"Error reading attendance stats: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # Health check for attendance models
 @attendance_session_bp.route("/models/status", methods=["GET"])
 def attendance_model_status():
@@ -809,9 +902,20 @@ def attendance_model_status():
         "success": True,
         "models_ready": model_manager.is_ready(),
         "health_check": model_manager.health_check(),
+        "detection": model_manager.get_detector().metrics() if model_manager.is_ready() else None,
         "cache_info": {
             "embedding_cache_active": True,
-            "cache_duration": "10 minutes"
+            "cached_filters": len(attendance_cache.galleries),
+            "class_partitions": len(attendance_cache.partitions),
+            "prefetched_sessions": len(attendance_cache.session_galleries),
+            "gallery_cache": attendance_cache.galleries.stats(),
+            "partition_cache": attendance_cache.partitions.partitions.stats(),
+            "tracked_sessions": len(session_trackers),
+            "roster": session_roster.stats(),
+            "event_stream": session_events.stats(),
+            "summaries": attendance_summaries.stats(),
+            "delta_poll_interval": attendance_cache.poll_interval,
+            "full_reload_interval": attendance_cache.full_reload_interval
         },
         "timestamp": time.time()
     })
@@ -0,0 +1,340 @@
+# teacher/attendance_summaries.py - Incrementally maintained attendance rollups (per session, student, class/day)
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Rows written by other workers show up within this many seconds
+REFRESH_INTERVAL = 10
+# Ids are assigned before commit, so each refresh re-reads a few already seen
+# records in case a lower id committed after a higher one (seen ids are skipped)
+RECORD_ID_OVERLAP = 200
+SESSION_CHUNK = 200
+# A mark counted by this worker is matched against its record for this long
+LIVE_MARK_TTL = 600
+
+SESSION_SUMMARY_COLUMNS = "id, date, subject, department, year, division, finalized, expires_at"
+
+
+def _rate(present, records):
+    return round(present / records * 100, 1) if records else 0.0
+
+
+def _class_key(row):
+    return (row.get("department") or None, row.get("year") or None, row.get("division") or None, row.get("date") or None)
+
+
+def _matches(wanted, key):
+    return all(w is None or w == k for w, k in zip(wanted, key))
+
+
+class SessionSummary:
+    """Counts for one session (roster size, records, present)"""
+    __slots__ = ("session_id", "class_key", "subject", "total", "finalized", "expires_at", "records", "present")
+
+    def __init__(self, session_id, row):
+        self.session_id = session_id
+        self.class_key = _class_key(row)
+        self.subject = row.get("subject")
+        self.total = len(row.get("students") or [])
+        self.finalized = bool(row.get("finalized"))
+        self.expires_at = row.get("expires_at")
+        self.records = 0
+        self.present = 0
+
+    def to_dict(self):
+        total = max(self.total, self.records)
+        return {
+            "session_id": self.session_id,
+            "subject": self.subject,
+            "finalized": self.finalized,
+            "total_students": total,
+            "present_count": self.present,
+            "absent_count": total - self.present,
+            "attendance_percentage": _rate(self.present, total)
+        }
+
+
+class AttendanceSummaryStore:
+    """
+    Counters that the marking paths bump as they happen, so stats reads are
+    dictionary lookups instead of scans of attendance_records:
+
+    - per session: roster size, records, present, finalized flag
+    - per student: records (sessions attended or finalized as absent) and present
+    - per class and day (department, year, division, session date): sessions,
+      records, present and the latest session
+
+    A background thread (start()) seeds the store from the grouped counts of
+    the attendance_rollup_counts RPC (or one narrow keyset scan without it),
+    then every `refresh_interval` seconds applies the records and sessions
+    past the last seen ids plus the open sessions another worker finalized.
+    Records are never rewritten (see session_roster.write_attendance_records),
+    so each is counted once by id; a mark this worker already counted is
+    remembered by (session, student) until its record shows up.
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.sessions = {}
+        self.students = {}
+        self.class_days = {}
+        self.live = {}          # (session_id, student_id) -> time counted here, until its record is scanned
+        self.recent_ids = set()  # record ids inside the re-read overlap that were already counted
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.refresh_interval = refresh_interval
+        self.last_session_id = 0
+        self.last_record_id = 0
+        self.last_refresh = 0.0
+        self.refresh_errors = 0
+        self.seeded = False
+        self.seed_time = None
+        self.seed_path = None
+        self.thread = None
+
+    def start(self, client, refresh_interval=None):
+        """Seed and keep refreshing in a background thread (reads never wait on the database)"""
+        if refresh_interval:
+            self.refresh_interval = refresh_interval
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, args=(client,), name="attendance-summaries", daemon=True)
+        self.thread.start()
+
+    def _run(self, client):
+        while True:
+            try:
+                self.refresh(client)
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.error(f"Attendance summary refresh failed: {e}")
+            time.sleep(self.refresh_interval)
+
+    # ---- updates ----
+
+    def _session(self, row):
+        session_id = str(row["id"])
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = SessionSummary(session_id, row)
+            day = self.class_days.setdefault(session.class_key, {"sessions": 0, "records": 0, "present": 0, "latest": None})
+            day["sessions"] += 1
+            if day["latest"] is None or int(session_id) > int(day["latest"]):
+                day["latest"] = session_id
+        return session
+
+    def _count(self, session, student_id, records, present):
+        session.records += records
+        session.present += present
+        day = self.class_days[session.class_key]
+        day["records"] += records
+        day["present"] += present
+        if student_id is not None:
+            student = self.students.setdefault(student_id, {"records": 0, "present": 0})
+            student["records"] += records
+            student["present"] += present
+
+    def _count_live(self, row, student_id, present):
+        key = (str(row["id"]), student_id)
+        if key in self.live:
+            return
+        self.live[key] = time.time()
+        self._count(self._session(row), student_id, 1, int(present))
+
+    def session_started(self, row):
+        """create_session: the row carries the preloaded roster"""
+        with self.lock:
+            session = self._session(row)
+            session.total = max(session.total, len(row.get("students") or []))
+
+    def student_marked(self, row, student_id):
+        """A student was marked present (teacher, demo, real-mark or socket path)"""
+        with self.lock:
+            self._count_live(row, student_id, True)
+
+    def session_finalized(self, row, absent_ids=(), total=None):
+        """end_session / expiry: absentees now have records and the roster is final"""
+        with self.lock:
+            session = self._session(row)
+            session.finalized = True
+            for student_id in absent_ids:
+                self._count_live(row, student_id, False)
+            if total is not None:
+                session.total = total
+
+    # ---- refresh ----
+
+    def refresh(self, client):
+        """Catch up with rows written since the last refresh (by any worker)"""
+        with self.refresh_lock:
+            start = time.time()
+            if not self.seeded:
+                self._seed(client)
+                self.seed_time = time.time() - start
+                self.seeded = True
+                logger.info(f"📊 Attendance summaries seeded ({self.seed_path}): "
+                            f"{len(self.sessions)} sessions in {self.seed_time:.2f}s")
+            else:
+                self._apply_changes(client)
+            self.last_refresh = time.time()
+
+    def _seed(self, client):
+        """Grouped counts in one RPC call; without it, the first refresh scans every record (narrow columns)"""
+        # Imported here: the student package imports teacher.session_roster, which imports this module
+        from student.queries import call_rpc, iter_keyset
+
+        counts = call_rpc(client, 'attendance_rollup_counts')
+        if not counts:
+            self.seed_path = "scan"
+            self._apply_changes(client)
+            return
+
+        max_record_id = int(counts.get("max_record_id") or 0)
+        sessions = list(iter_keyset(lambda: client.table('attendance_sessions').select(SESSION_SUMMARY_COLUMNS), "id"))
+        # Records in the overlap window were counted by the RPC; the first refresh must skip them
+        overlap = client.table('attendance_records').select("id").gt(
+            "id", max(0, max_record_id - RECORD_ID_OVERLAP)
+        ).lte("id", max_record_id).execute().data or []
+
+        with self.lock:
+            # Marks counted here so far are part of the grouped counts or come after max_record_id
+            self.live = {}
+            self.students = {}
+            for summary in self.sessions.values():
+                summary.records = summary.present = 0
+            for day in self.class_days.values():
+                day["records"] = day["present"] = 0
+            for row in sessions:
+                self._session(row)
+            for row in counts.get("sessions") or []:
+                summary = self.sessions.get(str(row["session_id"]))
+                if summary is not None:
+                    self._count(summary, None, int(row["records"]), int(row["present"]))
+            for row in counts.get("students") or []:
+                self.students[row["student_id"]] = {"records": int(row["records"]), "present": int(row["present"])}
+            self.recent_ids = {r["id"] for r in overlap}
+        self.last_record_id = max_record_id
+        self.last_session_id = max([0] + [r["id"] for r in sessions])
+        self.seed_path = "rpc"
+
+    def _apply_changes(self, client):
+        from student.queries import iter_keyset
+
+        # Records first: every session they reference exists by the time sessions are scanned
+        since_record = max(0, self.last_record_id - RECORD_ID_OVERLAP)
+        records = list(iter_keyset(
+            lambda: client.table('attendance_records').select("id, session_id, student_id, present").gt("id", since_record),
+            "id"
+        ))
+        since_session = self.last_session_id
+        new_sessions = list(iter_keyset(
+            lambda: client.table('attendance_sessions').select(SESSION_SUMMARY_COLUMNS).gt("id", since_session),
+            "id"
+        ))
+        finalized = self._finalized_since(client)
+
+        now = time.time()
+        with self.lock:
+            for row in new_sessions:
+                summary = self._session(row)
+                summary.finalized = summary.finalized or bool(row.get("finalized"))
+            for row in finalized:
+                self._session(row).finalized = True
+            for record in records:
+                if record["id"] in self.recent_ids:
+                    continue
+                self.recent_ids.add(record["id"])
+                # Counted when it happened in this worker
+                if self.live.pop((str(record.get("session_id")), record.get("student_id")), None) is not None:
+                    continue
+                summary = self.sessions.get(str(record.get("session_id")))
+                if summary is not None:
+                    self._count(summary, record.get("student_id"), 1, int(bool(record.get("present"))))
+
+            self.last_record_id = max([self.last_record_id] + [r["id"] for r in records])
+            self.last_session_id = max([self.last_session_id] + [r["id"] for r in new_sessions])
+            floor = self.last_record_id - RECORD_ID_OVERLAP
+            self.recent_ids = {record_id for record_id in self.recent_ids if record_id > floor}
+            self.live = {key: at for key, at in self.live.items() if now - at < LIVE_MARK_TTL}
+
+    def _finalized_since(self, client):
+        """Rows of sessions this store holds as open that another worker has finalized"""
+        now_iso = datetime.now().isoformat()
+        with self.lock:
+            # An expired session takes no more marks; it leaves the open set even if nobody finalizes it
+            for summary in self.sessions.values():
+                if not summary.finalized and summary.expires_at and summary.expires_at < now_iso:
+                    summary.finalized = True
+            open_ids = [sid for sid, s in self.sessions.items() if not s.finalized]
+        rows = []
+        for start in range(0, len(open_ids), SESSION_CHUNK):
+            response = client.table('attendance_sessions').select("id").in_(
+                "id", open_ids[start:start + SESSION_CHUNK]
+            ).eq("finalized", True).execute()
+            rows.extend(response.data or [])
+        return rows
+
+    # ---- reads (callers check `seeded` first and fall back to their queries until it is set) ----
+
+    def session_summary(self, session_id):
+        with self.lock:
+            session = self.sessions.get(str(session_id))
+            return session.to_dict() if session else None
+
+    def student_summary(self, student_id):
+        with self.lock:
+            counts = dict(self.students.get(student_id) or {"records": 0, "present": 0})
+        counts["absent"] = counts["records"] - counts["present"]
+        counts["attendance_percentage"] = _rate(counts["present"], counts["records"])
+        return {"student_id": student_id, **counts}
+
+    def class_summary(self, department=None, year=None, division=None, date=None):
+        """Totals over the (class, day) rollups matching the given filters"""
+        wanted = (department or None, year or None, division or None, date or None)
+        totals = {"sessions": 0, "records": 0, "present": 0}
+        with self.lock:
+            for key, day in self.class_days.items():
+                if _matches(wanted, key):
+                    for field in totals:
+                        totals[field] += day[field]
+        totals["absent"] = totals["records"] - totals["present"]
+        totals["attendance_percentage"] = _rate(totals["present"], totals["records"])
+        return {"department": department, "year": year, "division": division, "date": date, **totals}
+
+    def latest_present(self, department=None, year=None, division=None, date=None):
+        """
+        Students present in the latest session of each matching class (on
+        `date`, or ever) - the rollup form of "the latest record wins" used by
+        the attendance dashboard stats.
+        """
+        wanted = (department or None, year or None, division or None, date or None)
+        latest = {}
+        with self.lock:
+            for key, day in self.class_days.items():
+                if day["latest"] is not None and _matches(wanted, key):
+                    current = latest.get(key[:3])
+                    if current is None or int(day["latest"]) > int(current):
+                        latest[key[:3]] = day["latest"]
+            return sum(self.sessions[session_id].present for session_id in latest.values())
+
+    def stats(self):
+        with self.lock:
+            return {
+                "seeded": self.seeded,
+                "seed_path": self.seed_path,
+                "seed_time": round(self.seed_time, 3) if self.seed_time is not None else None,
+                "last_refresh": self.last_refresh or None,
+                "refresh_interval": self.refresh_interval,
+                "refresh_errors": self.refresh_errors,
+                "sessions": len(self.sessions),
+                "open_sessions": sum(1 for s in self.sessions.values() if not s.finalized),
+                "students": len(self.students),
+                "class_days": len(self.class_days),
+                "unmatched_live_marks": len(self.live)
+            }
+
+
+# Shared by the teacher and student blueprints
+attendance_summaries = AttendanceSummaryStore()
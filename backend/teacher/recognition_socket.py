@@ -0,0 +1,163 @@
+# teacher/recognition_socket.py - Persistent WebSocket recognition channel per attendance session
+import base64
+import json
+import logging
+import threading
+import time
+from flask import current_app
+
+from face_engine.decode import decode_frame
+from teacher.session_roster import session_roster
+from teacher.attendance_records import (
+    detect_faces_optimized,
+    recognize_session_frame,
+    expire_session,
+    attendance_cache
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LatestFrame:
+    """
+    Single-slot mailbox between the socket reader and the recognizer: a new
+    frame replaces one that has not been picked up yet, so when inference falls
+    behind the stale frames are dropped and the newest one is processed next.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, frame):
+        with self.condition:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = frame
+            self.sequence += 1
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def take(self):
+        """Block until a frame arrives; returns (frame, sequence, dropped_so_far) or (None, ...) once closed"""
+        with self.condition:
+            while self.frame is None and not self.closed:
+                self.condition.wait()
+            frame, self.frame = self.frame, None
+            return frame, self.sequence, self.dropped
+
+
+def _read_frames(ws, slot):
+    """Socket reader: binary messages are JPEG frames, text messages are JSON control/base64 fallback"""
+    try:
+        while True:
+            message = ws.receive()
+            if message is None:
+                break
+            if isinstance(message, (bytes, bytearray)):
+                slot.put(bytes(message))
+                continue
+            payload = json.loads(message)
+            if payload.get("type") == "close":
+                break
+            image = payload.get("image")
+            if image:
+                if image.startswith("data:"):
+                    image = image.split(",", 1)[1]
+                slot.put(base64.b64decode(image))
+    except Exception as e:
+        logger.debug(f"Recognition socket reader stopped: {e}")
+    finally:
+        slot.close()
+
+
+def _send(ws, message_type, **fields):
+    ws.send(json.dumps({"type": message_type, **fields}, default=str))
+
+
+def _serve_frames(ws, session_id, session, model_manager, supabase):
+    """Recognize frames from one channel until it closes or the session ends"""
+    detector = model_manager.get_detector()
+    threshold = float(current_app.config.get("THRESHOLD", 0.6))
+    slot = LatestFrame()
+    threading.Thread(target=_read_frames, args=(ws, slot), name=f"ws-reader-{session_id}", daemon=True).start()
+    gallery_status = attendance_cache.session_gallery_status(session_id)
+    _send(ws, "ready", session_id=session_id, total_present_now=len(session.present),
+          gallery_ready=bool(gallery_status and gallery_status["ready"]))
+    logger.info(f"🔌 Recognition channel opened for session {session_id}")
+
+    last_empty = False
+    while True:
+        frame_bytes, sequence, dropped = slot.take()
+        if frame_bytes is None:
+            break
+
+        if session.finalized or session.is_expired():
+            if not session.finalized:
+                expire_session(supabase, session_id, session)
+            _send(ws, "session_ended", session_id=session_id)
+            break
+
+        start = time.time()
+        try:
+            frame = decode_frame(frame_bytes)
+            faces = frame.attach_crops(detect_faces_optimized(frame.rgb, detector))
+            results, info = [], {"embedding_time": 0.0, "faces_embedded": 0, "faces_tracked": 0, "tiers": None}
+            if faces:
+                results, info = recognize_session_frame(model_manager, supabase, session, faces, threshold)
+        except Exception as e:
+            logger.error(f"Recognition channel error: {e}")
+            _send(ws, "error", frame=sequence, error=str(e))
+            continue
+
+        # Consecutive empty frames are reported once
+        if not results and last_empty:
+            continue
+        last_empty = not results
+
+        _send(
+            ws, "result",
+            frame=sequence,
+            faces=results,
+            new_marks=[r["match"] for r in results if r.get("status", "").startswith("marked_present")],
+            dropped_frames=dropped,
+            processing_time=round(time.time() - start, 3),
+            embedding_time=round(info["embedding_time"], 3),
+            faces_embedded=info["faces_embedded"],
+            faces_tracked=info["faces_tracked"],
+            tiers=info["tiers"],
+            total_present_now=len(session.present)
+        )
+
+
+def register_recognition_socket(sock):
+    """Attach /ws/attendance/<session_id> to a flask-sock instance"""
+
+    @sock.route("/ws/attendance/<session_id>")
+    def recognition_channel(ws, session_id):
+        model_manager = current_app.config.get("MODEL_MANAGER")
+        supabase = current_app.config.get("SUPABASE")
+        if not model_manager or not model_manager.is_ready():
+            _send(ws, "error", error="Face recognition models not initialized")
+            return
+
+        # Validate the session once for the whole connection (held in memory until it closes)
+        session = session_roster.hold(supabase, session_id)
+        if session is None or not session.is_active():
+            if session is not None:
+                session_roster.release(session)
+            _send(ws, "error", error="Session not found or expired")
+            return
+
+        try:
+            _serve_frames(ws, session_id, session, model_manager, supabase)
+        finally:
+            session_roster.release(session)
+        logger.info(f"🔌 Recognition channel closed for session {session_id}")
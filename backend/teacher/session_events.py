@@ -0,0 +1,142 @@
+# teacher/session_events.py - Pub/sub hub for live session events (served over SSE), fanned out across workers via Redis
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One connected dashboard; receives session events plus marks for its student/session"""
+
+    def __init__(self, student_id=None, session_id=None, max_queued=100):
+        self.student_id = student_id
+        self.session_id = str(session_id) if session_id else None
+        self.events = queue.Queue(maxsize=max_queued)
+
+    def wants(self, event):
+        if event["type"] != "attendance_marked":
+            return True
+        data = event["data"]
+        return (
+            (self.student_id is not None and data.get("student_id") == self.student_id)
+            or (self.session_id is not None and str(data.get("session_id")) == self.session_id)
+        )
+
+
+class SessionEventHub:
+    """
+    Fans out session_created / session_finalized / attendance_marked events to
+    every open event stream. Publishing never blocks: a client too slow to
+    drain its queue loses its oldest events instead.
+
+    With a Redis URL configured, events are published to a Redis channel and
+    every worker delivers what it receives there to its own streams, so a mark
+    made on one worker reaches dashboards connected to any other. Without it
+    (or while Redis is unreachable) events only reach this process.
+
+    Each open stream occupies a worker thread for as long as it stays open,
+    so at most `max_subscribers` streams are accepted per process; the rest
+    are turned away and the dashboards fall back to polling.
+    """
+
+    def __init__(self, max_subscribers=None):
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self.rejected = 0
+        self.redis = None
+        self.channel = None
+        self.listener = None
+
+    def configure(self, redis_url=None, channel="attendance:session_events", max_subscribers=None):
+        """Called once at startup; a Redis URL enables cross-worker delivery (needs the redis package)"""
+        self.max_subscribers = max_subscribers
+        if not redis_url:
+            return
+        try:
+            import redis
+        except ImportError:
+            logger.warning("⚠️ redis not installed, session events stay within each worker")
+            return
+        self.redis = redis.Redis.from_url(redis_url)
+        self.channel = channel
+        self.listener = threading.Thread(target=self._listen, name="session-events-redis", daemon=True)
+        self.listener.start()
+
+    def _listen(self):
+        """Deliver every event published on the Redis channel (by any worker) to this worker's streams"""
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                logger.info(f"📡 Session events subscribed to Redis channel {self.channel}")
+                for message in pubsub.listen():
+                    self._deliver(json.loads(message["data"]))
+            except Exception as e:
+                logger.error(f"Session event listener lost Redis: {e}")
+                time.sleep(1.0)
+
+    def subscribe(self, student_id=None, session_id=None):
+        """A new subscription, or None when this worker already serves max_subscribers streams"""
+        subscription = Subscription(student_id, session_id)
+        with self.lock:
+            if self.max_subscribers is not None and len(self.subscriptions) >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, event_type, data):
+        event = {"type": event_type, "data": data}
+        with self.lock:
+            self.published += 1
+        if self.redis is not None:
+            try:
+                # The listener of every worker, this one included, delivers it
+                self.redis.publish(self.channel, json.dumps(event, default=str))
+                return
+            except Exception as e:
+                logger.error(f"Publishing session event to Redis failed, delivering locally: {e}")
+        self._deliver(event)
+
+    def _deliver(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if not subscription.wants(event):
+                continue
+            try:
+                subscription.events.put_nowait(event)
+            except queue.Full:
+                try:
+                    subscription.events.get_nowait()
+                    subscription.events.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                "subscribers": len(self.subscriptions),
+                "max_subscribers": self.max_subscribers,
+                "rejected": self.rejected,
+                "published": self.published,
+                "redis": self.redis is not None
+            }
+
+
+def format_sse(event_type, data):
+    """One Server-Sent Events frame"""
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+# Shared by the teacher and student blueprints
+session_events = SessionEventHub()
@@ -0,0 +1,334 @@
+# teacher/session_roster.py - In-memory roster of live attendance sessions with write-behind persistence
+import logging
+import threading
+import time
+from datetime import datetime
+from teacher.session_events import session_events
+from teacher.attendance_summaries import attendance_summaries
+
+logger = logging.getLogger(__name__)
+
+SESSION_COLUMNS = "id, date, subject, department, year, division, created_at, duration_minutes, expires_at, finalized, students"
+
+# Raised by the reject_finalized_session_records trigger (SUPABASE_RPC_FUNCTIONS.txt)
+FINALIZED_SESSION_ERROR = "attendance session is finalized"
+# Postgres: no unique index matches the ON CONFLICT target (the required migration is not applied)
+MISSING_UNIQUE_INDEX_CODE = "42P10"
+RECORD_LOOKUP_CHUNK = 200
+
+
+def missing_unique_index(error):
+    """True when an upsert failed because attendance_records has no (session_id, student_id) unique index"""
+    if getattr(error, "code", None) == MISSING_UNIQUE_INDEX_CODE:
+        return True
+    message = str(error)
+    return MISSING_UNIQUE_INDEX_CODE in message or "no unique or exclusion constraint" in message
+
+
+def write_attendance_records(client, session_id, records):
+    """
+    Write records that do not exist yet for (session_id, student_id); an
+    existing record (present or absent) is never changed. One upsert with
+    the unique index, otherwise a lookup of the existing students and an
+    insert of the rest. Returns the number of records sent.
+    """
+    if not records:
+        return 0
+    try:
+        client.table('attendance_records').upsert(
+            records, on_conflict="session_id,student_id", ignore_duplicates=True
+        ).execute()
+        return len(records)
+    except Exception as e:
+        if not missing_unique_index(e):
+            raise
+        logger.warning(f"attendance_records has no (session_id, student_id) unique index, "
+                       f"apply the required migration in SUPABASE_RPC_FUNCTIONS.txt: {e}")
+
+    student_ids = [r["student_id"] for r in records]
+    existing = set()
+    for lo in range(0, len(student_ids), RECORD_LOOKUP_CHUNK):
+        response = client.table('attendance_records').select('student_id').eq('session_id', session_id).in_(
+            'student_id', student_ids[lo:lo + RECORD_LOOKUP_CHUNK]
+        ).execute()
+        existing.update(r["student_id"] for r in response.data or [])
+    fresh = [r for r in records if r["student_id"] not in existing]
+    if fresh:
+        client.table('attendance_records').insert(fresh).execute()
+    return len(fresh)
+
+
+def roster_from_records(roster, records):
+    """
+    Final roster JSON for a session: its stored roster with every attendance
+    record applied. Records are the source of truth; live marks never
+    rewrite the roster, so workers cannot overwrite each other's flags.
+    """
+    roster = [dict(s) for s in roster or []]
+    index = {s.get("student_id"): s for s in roster}
+    for record in records:
+        entry = index.get(record["student_id"])
+        if entry is None:
+            entry = index[record["student_id"]] = {
+                "student_id": record["student_id"], "student_name": record.get("student_name")
+            }
+            roster.append(entry)
+        entry["present"] = bool(record.get("present"))
+        entry["marked_at"] = record.get("marked_at")
+    return roster
+
+
+class ActiveSession:
+    """
+    One live session held in memory: the students on its roster, the present
+    set and expiry. Marks are answered from here and queued for the background
+    flusher instead of being written one by one; only attendance_records are
+    written, the roster JSON is rebuilt from them when the session is finalized.
+    """
+
+    def __init__(self, row, client):
+        self.session_id = str(row["id"])
+        self.row = row
+        self.client = client
+        roster = row.get("students") or []
+        self.roster_ids = {s.get("student_id") for s in roster}
+        self.present = {s.get("student_id") for s in roster if s.get("present")}
+        self.expires_at = row.get("expires_at")
+        self.finalized = bool(row.get("finalized"))
+
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # keeps roster writes in order
+        self.pending_records = []
+        self.last_used = time.time()
+        self.holders = 0       # open connections (WebSocket channels) using this object
+        self.evicted = False   # dropped from the roster; marks are then flushed by the caller
+
+    def is_expired(self):
+        # expires_at is stored as an ISO string, same comparison the queries use
+        return bool(self.expires_at) and datetime.now().isoformat() > self.expires_at
+
+    def is_active(self):
+        return not self.finalized and not self.is_expired()
+
+    def is_present(self, student_id):
+        return student_id in self.present
+
+    def mark_present(self, student_id, student_name):
+        """Returns (status, marked_at); status is "marked_present", "marked_present_new" or "duplicate"."""
+        with self.lock:
+            self.last_used = time.time()
+            if student_id in self.present:
+                return "duplicate", None
+
+            marked_at = datetime.now().isoformat()
+            status = "marked_present"
+            if student_id not in self.roster_ids:
+                # Not preloaded with the class (e.g. global search) - joins the roster at finalize
+                self.roster_ids.add(student_id)
+                status = "marked_present_new"
+
+            self.present.add(student_id)
+            self.pending_records.append({
+                "session_id": self.row["id"],
+                "student_id": student_id,
+                "student_name": student_name,
+                "present": True,
+                "marked_at": marked_at
+            })
+            evicted = self.evicted
+
+        if evicted:
+            # The background flusher no longer sees this object
+            self.flush()
+
+        attendance_summaries.student_marked(self.row, student_id)
+
+        # Push the confirmation to the student's (and teacher's) open dashboards
+        session_events.publish("attendance_marked", {
+            "session_id": self.row["id"],
+            "student_id": student_id,
+            "student_name": student_name,
+            "marked_at": marked_at
+        })
+        return status, marked_at
+
+    def has_pending(self):
+        return bool(self.pending_records)
+
+    def flush(self):
+        """
+        Write queued records in one batch. Safe to retry: a record that
+        already exists is left alone, so a late flush never turns a
+        finalized absentee present, and the database refuses new records for
+        a session that was finalized meanwhile (possibly by another worker).
+        """
+        with self.flush_lock:
+            with self.lock:
+                records, self.pending_records = self.pending_records, []
+            if not records:
+                return 0
+
+            try:
+                return write_attendance_records(self.client, self.row["id"], records)
+            except Exception as e:
+                if FINALIZED_SESSION_ERROR in str(e):
+                    self.finalized = True
+                    logger.warning(f"Session {self.session_id} was finalized elsewhere; "
+                                   f"dropped {len(records)} unflushed marks")
+                    return 0
+                # Put them back; the next flush retries them
+                with self.lock:
+                    self.pending_records = records + self.pending_records
+                raise
+
+
+class SessionRoster:
+    """
+    Active sessions of this process, loaded on first use. A background thread
+    flushes queued marks every `flush_interval` seconds, so a burst of
+    recognitions turns into one records write per session.
+    flush_session() writes synchronously and is called before a session is
+    finalized, so no acknowledged mark is lost when a teacher ends a session.
+    """
+
+    def __init__(self, flush_interval=0.3, idle_timeout=1800):
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.flush_errors = 0
+        self.flushed_marks = 0
+        self.flusher = threading.Thread(target=self._run, name="session-roster-flush", daemon=True)
+        self.flusher.start()
+
+    def get(self, client, session_id):
+        """The in-memory session (loaded from Supabase once), or None if it does not exist"""
+        session_id = str(session_id)
+        with self.lock:
+            session = self.sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.time()
+            return session
+
+        response = client.table('attendance_sessions').select(SESSION_COLUMNS).eq('id', session_id).execute()
+        if not response.data:
+            return None
+        session = ActiveSession(response.data[0], client)
+
+        # Marks already persisted by another worker before this one loaded the session
+        records = client.table('attendance_records').select('student_id').eq('session_id', session_id).execute()
+        session.present.update(r["student_id"] for r in records.data or [])
+
+        with self.lock:
+            # Another request may have loaded it meanwhile; keep the first copy
+            return self.sessions.setdefault(session_id, session)
+
+    def hold(self, client, session_id):
+        """get() for a long-lived user (a WebSocket channel); the session is not evicted until release()"""
+        session = self.get(client, session_id)
+        if session is not None:
+            with session.lock:
+                session.holders += 1
+        return session
+
+    def release(self, session):
+        with session.lock:
+            session.holders -= 1
+            session.last_used = time.time()
+
+    def peek(self, session_id):
+        """The session if it is already loaded in this process (never queries)"""
+        with self.lock:
+            return self.sessions.get(str(session_id))
+
+    def flush_session(self, session_id):
+        """Synchronously persist everything queued for a session"""
+        with self.lock:
+            session = self.sessions.get(str(session_id))
+        if session is not None and session.has_pending():
+            self.flushed_marks += session.flush()
+
+    def close(self, session_id):
+        """Flush and forget a session (it is being finalized)"""
+        self.flush_session(session_id)
+        with self.lock:
+            session = self.sessions.pop(str(session_id), None)
+        if session is not None:
+            with session.lock:
+                session.finalized = True
+                session.evicted = True
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with self.lock:
+                sessions = list(self.sessions.values())
+            now = time.time()
+            for session in sessions:
+                if session.has_pending():
+                    try:
+                        self.flushed_marks += session.flush()
+                    except Exception as e:
+                        self.flush_errors += 1
+                        logger.error(f"Attendance flush failed for session {session.session_id}: {e}")
+                    continue
+                if now - session.last_used > self.idle_timeout:
+                    self._evict(session)
+
+    def _evict(self, session):
+        """Drop an idle session unless it is held open or has marks queued"""
+        with self.lock, session.lock:
+            if session.holders or session.pending_records:
+                return
+            if self.sessions.get(session.session_id) is session:
+                del self.sessions[session.session_id]
+            session.evicted = True
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return {
+            "active_sessions": len(sessions),
+            "pending_marks": sum(len(s.pending_records) for s in sessions),
+            "held_sessions": sum(1 for s in sessions if s.holders),
+            "flushed_marks": self.flushed_marks,
+            "flush_errors": self.flush_errors,
+            "flush_interval": self.flush_interval
+        }
+
+
+ACTIVE_SESSION_COLUMNS = "id, date, subject, department, year, division, duration_minutes, expires_at, created_at"
+
+
+class ActiveSessionCache:
+    """
+    The list of unfinalized, unexpired sessions, shared by every request of
+    this process. It is fetched at most once per `ttl` seconds (and right after
+    a session is created or ended); expiry is re-checked on every read, so a
+    session drops out as soon as its time is up without another query.
+    """
+
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        self.sessions = []
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = 0.0
+
+    def get(self, client):
+        now_iso = datetime.now().isoformat()
+        with self.lock:
+            if time.time() - self.loaded_at > self.ttl:
+                response = client.table('attendance_sessions').select(ACTIVE_SESSION_COLUMNS).eq('finalized', False).gt('expires_at', now_iso).execute()
+                self.sessions = response.data or []
+                self.loaded_at = time.time()
+            sessions = self.sessions
+        return [s for s in sessions if not s.get("expires_at") or s["expires_at"] > now_iso]
+
+
+# Shared by the teacher and student blueprints
+session_roster = SessionRoster()
+active_session_cache = ActiveSessionCache()
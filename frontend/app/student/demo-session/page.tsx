@@ -52,7 +52,8 @@ export default function DemoSession() {
 
   // Get student ID from localStorage
   useEffect(() => {
-    const storedStudentId = localStorage.getItem("studentId") || localStorage.getItem("username");
+    // Set at sign-in from the students table; the username is not a student ID
+    const storedStudentId = localStorage.getItem("studentId");
     if (storedStudentId) {
       setStudentId(storedStudentId);
     }
@@ -118,10 +119,35 @@ export default function DemoSession() {
 
   useEffect(() => {
     fetchSessionsAndStatus();
-    // Refresh every 30 seconds
-    const interval = setInterval(fetchSessionsAndStatus, 30000);
-    return () => clearInterval(interval);
-  }, [fetchSessionsAndStatus]);
+    // Live updates pushed by the server instead of polling every 30 seconds
+    const params = studentId ? `?student_id=${encodeURIComponent(studentId)}` : "";
+    const events = new EventSource(`http://localhost:5000/api/attendance/events${params}`);
+    events.addEventListener("snapshot", (e) => {
+      setActiveSessions(JSON.parse((e as MessageEvent).data).active_sessions);
+    });
+    events.addEventListener("session_created", (e) => {
+      const session = JSON.parse((e as MessageEvent).data) as AttendanceSession;
+      setActiveSessions((prev) => [...prev.filter((s) => String(s.session_id) !== String(session.session_id)), session]);
+    });
+    const removeSession = (e: Event) => {
+      const { session_id } = JSON.parse((e as MessageEvent).data);
+      setActiveSessions((prev) => prev.filter((s) => String(s.session_id) !== String(session_id)));
+    };
+    events.addEventListener("session_finalized", removeSession);
+    events.addEventListener("session_expired", removeSession);
+    events.addEventListener("attendance_marked", () => fetchSessionsAndStatus());
+    // Refused (server at its stream limit) or failed for good: fall back to polling
+    let poll: ReturnType<typeof setInterval> | null = null;
+    events.onerror = () => {
+      if (events.readyState === EventSource.CLOSED && !poll) {
+        poll = setInterval(fetchSessionsAndStatus, 30000);
+      }
+    };
+    return () => {
+      events.close();
+      if (poll) clearInterval(poll);
+    };
+  }, [fetchSessionsAndStatus, studentId]);
 
   // Calculate time remaining for a session
   const getTimeRemaining = (expiresAt: string) => {
@@ -139,6 +165,10 @@ export default function DemoSession() {
 
   const handleMarkAttendance = useCallback(async (imageDataUrl: string) => {
     if (!selectedSession || markingAttendance) return;
+    if (!studentId) {
+      setStatus("❌ Student ID not found - please sign in again");
+      return;
+    }
 
     setMarkingAttendance(true);
     setStatus("Processing attendance...");
@@ -149,6 +179,8 @@ export default function DemoSession() {
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ 
           session_id: selectedSession.session_id,
+          // Verified 1:1 against the signed-in student's own face
+          student_id: studentId,
           image: imageDataUrl 
         }),
       });
@@ -170,7 +202,7 @@ export default function DemoSession() {
     } finally {
       setMarkingAttendance(false);
     }
-  }, [selectedSession, markingAttendance, fetchSessionsAndStatus]);
+  }, [selectedSession, markingAttendance, fetchSessionsAndStatus, studentId]);
 
   const handleRecognize = useCallback(async (dataUrl: string) => {
     if (cameraMode === "attendance" && isLiveActive && selectedSession) {
@@ -188,10 +220,12 @@ export default function DemoSession() {
       setRecognitionCount(prev => prev + 1);
       setStatus("🔍 Analyzing face with stored photos...");
       
+      // Send the frame as a raw JPEG body rather than base64 JSON
+      const frame = await (await fetch(dataUrl)).blob();
       const res = await fetch("http://127.0.0.1:5000/api/demo/recognize", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ image: dataUrl }),
+        headers: { "Content-Type": frame.type || "image/jpeg" },
+        body: frame,
       });
       
       if (!res.ok) {
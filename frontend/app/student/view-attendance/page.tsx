@@ -32,8 +32,9 @@ export default function ViewAttendance() {
     attendanceRate: 0,
   });
   const [searched, setSearched] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
 
-  const fetchAttendanceData = async () => {
+  const fetchAttendanceData = async (cursor: string | null = null) => {
     if (!selectedDate && !filterDepartment) {
       alert("Please select at least one filter.");
       return;
@@ -47,6 +48,8 @@ export default function ViewAttendance() {
       if (filterDivision) params.set("division", filterDivision);
       if (filterSubject) params.set("subject", filterSubject);
       if (filterStudentId) params.set("student_id", filterStudentId);
+      // Pages are keyed by student ID; the next page starts after the cursor
+      if (cursor) params.set("cursor", cursor);
 
       const res = await fetch(`http://127.0.0.1:5000/api/attendance?${params.toString()}`);
       const raw = await res.text();
@@ -68,8 +71,9 @@ export default function ViewAttendance() {
           status: record.status || "present",
           confidence: record.confidence || 0,
         }));
-        setAttendanceData(mappedData);
-        setStats(data.stats);
+        setAttendanceData(prev => (cursor ? [...prev, ...mappedData] : mappedData));
+        if (data.stats) setStats(data.stats);
+        setNextCursor(data.nextCursor || null);
       }
       setSearched(true);
     } catch (error) {
@@ -88,23 +92,9 @@ export default function ViewAttendance() {
       if (filterDivision) params.set("division", filterDivision);
       if (filterSubject) params.set("subject", filterSubject);
 
-      const res = await fetch(`http://127.0.0.1:5000/api/attendance/export?${params.toString()}`);
-      const raw = await res.text();
-      let data: any;
-      try {
-        data = JSON.parse(raw);
-      } catch (err) {
-        console.error("Failed to parse /api/attendance/export response as JSON. status=", res.status, "body=", raw);
-        throw err;
-      }
-      if (data && data.success) {
-        // Dynamic import so bundlers (Next.js SSR) don't try to include node-only deps
-        const XLSX = await import("xlsx");
-        const worksheet = XLSX.utils.json_to_sheet(data.data);
-        const workbook = XLSX.utils.book_new();
-        XLSX.utils.book_append_sheet(workbook, worksheet, "Attendance");
-        XLSX.writeFile(workbook, `attendance_${selectedDate || "export"}.xlsx`);
-      }
+      // The server streams the workbook, so large exports download progressively
+      params.set("format", "xlsx");
+      window.location.href = `http://127.0.0.1:5000/api/attendance/export?${params.toString()}`;
     } catch (error) {
       console.error("Error exporting excel:", error);
     }
@@ -202,7 +192,7 @@ export default function ViewAttendance() {
             </div>
             <div className="flex gap-4">
               <button
-                onClick={fetchAttendanceData}
+                onClick={() => fetchAttendanceData()}
                 className="px-4 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700"
               >
                 🔍 Search
@@ -318,6 +308,17 @@ export default function ViewAttendance() {
                   ))}
                 </tbody>
               </table>
+              {nextCursor && (
+                <div className="p-4 text-center">
+                  <button
+                    onClick={() => fetchAttendanceData(nextCursor)}
+                    disabled={loading}
+                    className="px-4 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 disabled:opacity-50"
+                  >
+                    {loading ? "Loading..." : "Load more"}
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
@@ -20,6 +20,12 @@ export default function TeacherDashboard() {
   const [loading, setLoading] = useState(true);
   const [mobileMenuOpen, setMobileMenuOpen] = useState(false);
   const [activeCard, setActiveCard] = useState<number | null>(null);
+  const [todayStats, setTodayStats] = useState<{
+    sessions: number;
+    present: number;
+    absent: number;
+    attendance_percentage: number;
+  } | null>(null);
 
   useEffect(() => {
     const checkStatus = () => {
@@ -48,6 +54,20 @@ export default function TeacherDashboard() {
     return () => clearTimeout(timeoutId);
   }, [router]);
 
+  // Today's totals come from the backend's attendance rollups (no record scans)
+  useEffect(() => {
+    if (!isLoggedIn) return;
+    const today = new Date().toISOString().split("T")[0];
+    fetch(`http://127.0.0.1:5000/api/attendance/stats?date=${today}`)
+      .then((res) => (res.ok ? res.json() : null))
+      .then((data) => {
+        if (data?.success) setTodayStats(data.statistics);
+      })
+      .catch(() => {
+        // Stats are optional on the dashboard
+      });
+  }, [isLoggedIn]);
+
   const handleLogout = async () => {
     try {
       await fetch("http://127.0.0.1:5000/api/logout", {
@@ -205,6 +225,28 @@ export default function TeacherDashboard() {
             </p>
           </div>
 
+          {/* Today's Attendance (from the rollups) */}
+          {todayStats && (
+            <div className="grid grid-cols-2 md:grid-cols-4 gap-4 mb-10">
+              <div className="bg-white rounded-xl border border-slate-200 p-4 text-center shadow-sm">
+                <div className="text-2xl font-bold text-blue-600">{todayStats.sessions}</div>
+                <div className="text-slate-500 text-sm">Sessions Today</div>
+              </div>
+              <div className="bg-white rounded-xl border border-slate-200 p-4 text-center shadow-sm">
+                <div className="text-2xl font-bold text-green-600">{todayStats.present}</div>
+                <div className="text-slate-500 text-sm">Present Marks</div>
+              </div>
+              <div className="bg-white rounded-xl border border-slate-200 p-4 text-center shadow-sm">
+                <div className="text-2xl font-bold text-red-600">{todayStats.absent}</div>
+                <div className="text-slate-500 text-sm">Absent Marks</div>
+              </div>
+              <div className="bg-white rounded-xl border border-slate-200 p-4 text-center shadow-sm">
+                <div className="text-2xl font-bold text-purple-600">{todayStats.attendance_percentage}%</div>
+                <div className="text-slate-500 text-sm">Attendance Rate</div>
+              </div>
+            </div>
+          )}
+
           {/* Teacher Management Tools Grid */}
           <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-4 gap-6">
             {teacherMenuItems.map((item, idx) => (
@@ -1,6 +1,6 @@
 "use client";
 
-import React, { useState, useCallback } from "react";
+import React, { useState, useCallback, useRef } from "react";
 import { useRouter } from "next/navigation";
 import { Camera, ArrowLeft, Play, Square, User, Calendar, BookOpen, GraduationCap, Users, CheckCircle2 } from "lucide-react";
 import CameraCapture, { FaceData } from "../../components/CameraCapture";
@@ -14,6 +14,9 @@ export default function DemoSessionPage() {
   const [status, setStatus] = useState("");
   const [facesData, setFacesData] = useState<FaceData[]>([]);
   const [recognizedStudents, setRecognizedStudents] = useState<string[]>([]);
+  // Persistent recognition channel; frames fall back to HTTP POST while it is not open
+  const socketRef = useRef<WebSocket | null>(null);
+  const [socketReady, setSocketReady] = useState(false);
 
   const [form, setForm] = useState({
     date: "",
@@ -63,46 +66,77 @@ export default function DemoSessionPage() {
     }
   };
 
+  const applyRecognition = useCallback((data: any) => {
+    if (data.faces && data.faces.length > 0) {
+      const face = data.faces[0];
+      if (face.match) {
+        setStatus(`✅ Recognized ${face.match.name}`);
+        setRecognizedStudents((prev) => (prev.includes(face.match.name) ? prev : [...prev, face.match.name]));
+      } else {
+        setStatus("❌ Face not recognized");
+      }
+      setFacesData(data.faces.map((f: FaceData) => ({ box: f.box, match: f.match })));
+    } else {
+      setStatus("❌ No faces detected");
+      setFacesData([]);
+    }
+  }, []);
+
+  // Open the WebSocket recognition channel once the session is live
+  React.useEffect(() => {
+    if (!sessionId || !recognitionStarted) return;
+    const socket = new WebSocket(`ws://localhost:5000/ws/attendance/${sessionId}`);
+    socket.binaryType = "arraybuffer";
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === "ready") setSocketReady(true);
+      else if (message.type === "result") applyRecognition(message);
+      else if (message.type === "session_ended") setStatus("⏰ Session has ended");
+      else if (message.type === "error") console.error(message.error);
+    };
+    socket.onclose = () => setSocketReady(false);
+    socketRef.current = socket;
+    return () => {
+      socket.close();
+      socketRef.current = null;
+      setSocketReady(false);
+    };
+  }, [sessionId, recognitionStarted, applyRecognition]);
+
   const handleRecognize = useCallback(
     async (imageDataUrl: string) => {
-      // Build payload: include session_id when available, otherwise include filters for demo recognition
-      const payload: any = { image: imageDataUrl };
-      if (sessionId) payload.session_id = sessionId;
+      const socket = socketRef.current;
+      if (socket && socket.readyState === WebSocket.OPEN) {
+        // Binary frame over the open channel; the server keeps only the newest one
+        socket.send(await (await fetch(imageDataUrl)).blob());
+        return;
+      }
+
+      // Build multipart payload: the frame goes up as a binary JPEG instead of base64 JSON
+      const payload = new FormData();
+      if (sessionId) payload.append("session_id", sessionId);
       else {
         // include optional filters from the form for candidate narrowing
-        if (form.department) payload.department = form.department;
-        if (form.year) payload.year = form.year;
-        if (form.division) payload.division = form.division;
+        if (form.department) payload.append("department", form.department);
+        if (form.year) payload.append("year", form.year);
+        if (form.division) payload.append("division", form.division);
       }
 
       try {
+        const frame = await (await fetch(imageDataUrl)).blob();
+        payload.append("image", frame, "frame.jpg");
         const res = await fetch("http://localhost:5000/api/attendance/real-mark", {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify(payload),
+          body: payload,
         });
-        const data = await res.json();
-
-        if (data.faces && data.faces.length > 0) {
-          const face = data.faces[0];
-          if (face.match) {
-            setStatus(`✅ Recognized ${face.match.name}`);
-            setRecognizedStudents((prev) => (prev.includes(face.match.name) ? prev : [...prev, face.match.name]));
-          } else {
-            setStatus("❌ Face not recognized");
-          }
-          setFacesData(data.faces.map((f: FaceData) => ({ box: f.box, match: f.match })));
-        } else {
-          setStatus("❌ No faces detected");
-          setFacesData([]);
-        }
+        applyRecognition(await res.json());
       } catch (err) {
         console.error(err);
         setStatus("❌ Recognition failed");
         setFacesData([]);
       }
     },
-    [sessionId, form]
+    [sessionId, form, applyRecognition]
   );
 
   const handleStartRecognition = () => {
@@ -478,7 +512,7 @@ export default function DemoSessionPage() {
                       isLiveMode={true}
                       onCapture={handleRecognize}
                       facesData={facesData}
-                      captureIntervalMs={2000}
+                      captureIntervalMs={socketReady ? 250 : 2000}
                     />
                   </div>
                 )}